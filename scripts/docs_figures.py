@@ -1,13 +1,25 @@
+import hashlib
+import importlib.util
+import inspect
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
+from typing import Callable, NamedTuple
 
 import numpy as np
 import matplotlib.pyplot as plt
 import pyvista as pv
 import matplotlib as mpl
 
-from atomview.wavefunction_calc import (
-    get_atomic_wavefunction, get_radial_part,
-    get_wavefunction_prob_contour_mesh, get_wavefunction_volume_mesh)
+from atomview.atlas import get_mesh_key
+from atomview.disk_cache import SOURCE_MODULES
+from atomview.mesh_executor import generate_mesh, init_disk_cache
+from atomview.wavefunction_calc import get_atomic_wavefunction, get_radial_part
 from atomview.utils import complex_to_rgba
 
 COLOR = 'white'
@@ -18,6 +30,21 @@ mpl.rcParams['ytick.color'] = COLOR
 mpl.rc('axes', edgecolor='white')
 
 fig_dir = Path(Path.cwd(), 'figures', 'docs_figs')
+# Inputs and output hashes of the rendered figures, see is_up_to_date.
+manifest_path = Path(fig_dir.parent, 'docs_figs_manifest.json')
+
+NUM_PTS = 100
+
+
+def contour_mesh_spec(n, l, m, prob_threshold_list, mag_maps_to=''):  # noqa
+    return 'contour', dict(n=n, l=l, m=m, num_pts=NUM_PTS,
+                           prob_threshold_list=tuple(prob_threshold_list),
+                           mag_maps_to=mag_maps_to)
+
+
+def volume_mesh_spec(n, l, m, max_opacity):  # noqa
+    return 'volume', dict(n=n, l=l, m=m, num_pts=NUM_PTS,
+                          max_opacity=max_opacity, opacity_exp=1.0)
 
 
 def add_2d_fig(n, l, m, real=False, span=None,
@@ -83,18 +110,16 @@ def add_radial_fig(n, l, span=None, ax=None):
     ax.plot(r, radial_part, color='r')
 
 
-def intro_multi_view_3d_320_fig():
+def intro_multi_view_3d_320_fig(contour_mesh, multi_contour_mesh,
+                                volume_mesh):
     (n, l, m) = (3, 2, 0)
 
     pl = pv.Plotter(shape=(1, 3), off_screen=True)
 
     # Contour plot
     pl.subplot(0, 0)
-    mesh = get_wavefunction_prob_contour_mesh(
-        n, l, m, num_pts=100,
-        prob_threshold_list=(0.5,))
     pl.set_background('black')
-    pl.add_mesh(mesh, scalars='rgba', rgb=True,
+    pl.add_mesh(contour_mesh, scalars='rgba', rgb=True,
                 smooth_shading=True,
                 specular=0,
                 diffuse=1,
@@ -106,11 +131,8 @@ def intro_multi_view_3d_320_fig():
 
     # Multi-contour plot
     pl.subplot(0, 1)
-    mesh = get_wavefunction_prob_contour_mesh(
-        n, l, m, num_pts=100, mag_maps_to='a',
-        prob_threshold_list=(0.2, 0.5, 0.8))
     pl.set_background('black')
-    pl.add_mesh(mesh, scalars='rgba', rgb=True,
+    pl.add_mesh(multi_contour_mesh, scalars='rgba', rgb=True,
                 smooth_shading=True,
                 specular=0,
                 diffuse=1,
@@ -120,12 +142,8 @@ def intro_multi_view_3d_320_fig():
 
     # Volume plot
     pl.subplot(0, 2)
-    mesh = get_wavefunction_volume_mesh(n, l, m,
-                                        num_pts=100,
-                                        max_opacity=0.7,
-                                        opacity_exp=1.0)
     pl.set_background('black')
-    pl.add_volume(mesh, scalars='rgba', mapper='gpu')
+    pl.add_volume(volume_mesh, scalars='rgba', mapper='gpu')
     pl.camera = cam
 
     pl.show(screenshot=Path(fig_dir, f'multi_view_3d_{n}{l}{m}.png'))
@@ -141,8 +159,7 @@ def radial_100_1d_fig():
     ax.set_facecolor('black')
     fig.set_facecolor('black')
     fig.savefig(Path(fig_dir, '100_simple_1D.png'))
-
-    plt.show()
+    plt.close(fig)
 
 
 def density_2d_100_2d_fig():
@@ -161,31 +178,24 @@ def density_2d_100_2d_fig():
     fig.set_tight_layout(True)
 
     fig.savefig(Path(fig_dir, 'density_2d_100.png'))
-
-    plt.show()
+    plt.close(fig)
 
 
-def simple_100_volume_3d_plot():
-    (n, l, m) = (1, 0, 0)
+def simple_100_volume_3d_plot(volume_mesh):
     grid_span = 2
     grid_bounds = [-grid_span, grid_span, -grid_span, grid_span, -grid_span,
                    grid_span]
 
     pl = pv.Plotter(off_screen=True)
 
-    mesh = get_wavefunction_volume_mesh(n, l, m,
-                                        num_pts=100,
-                                        max_opacity=1.0,
-                                        opacity_exp=1.0)
     pl.set_background('black')
-    pl.add_volume(mesh, scalars='rgba', mapper='gpu')
+    pl.add_volume(volume_mesh, scalars='rgba', mapper='gpu')
     pl.show_grid(color='white', bounds=grid_bounds)
 
     pl.show(screenshot=Path(fig_dir, f'simple_100_volume_3d.png'))
 
 
-def simple_100_contour_3d_plots():
-    (n, l, m) = (1, 0, 0)
+def simple_100_contour_3d_plots(contour_mesh, multi_contour_mesh):
     grid_span = 2
     grid_bounds = [-grid_span, grid_span, -grid_span, grid_span, -grid_span,
                    grid_span]
@@ -195,11 +205,8 @@ def simple_100_contour_3d_plots():
 
     # Contour plot
     pl.subplot(0, 0)
-    mesh = get_wavefunction_prob_contour_mesh(
-        n, l, m, num_pts=100,
-        prob_threshold_list=(0.5,))
     pl.set_background('black')
-    pl.add_mesh(mesh, scalars='rgba', rgb=True,
+    pl.add_mesh(contour_mesh, scalars='rgba', rgb=True,
                 smooth_shading=True,
                 specular=0,
                 diffuse=1,
@@ -212,11 +219,8 @@ def simple_100_contour_3d_plots():
 
     # Multi-contour plot
     pl.subplot(0, 1)
-    mesh = get_wavefunction_prob_contour_mesh(
-        n, l, m, num_pts=100, mag_maps_to='a',
-        prob_threshold_list=(0.2, 0.4, 0.6))
     pl.set_background('black')
-    pl.add_mesh(mesh, scalars='rgba', rgb=True,
+    pl.add_mesh(multi_contour_mesh, scalars='rgba', rgb=True,
                 smooth_shading=True,
                 specular=0,
                 diffuse=1,
@@ -240,8 +244,7 @@ def radial_210_1d_fig():
     ax.set_facecolor('black')
     fig.set_facecolor('black')
     fig.savefig(Path(fig_dir, 'radial_210_1d.png'))
-
-    plt.show()
+    plt.close(fig)
 
 
 def density_2d_210_fig():
@@ -260,11 +263,10 @@ def density_2d_210_fig():
     fig.set_tight_layout(True)
 
     fig.savefig(Path(fig_dir, 'density_2d_210.png'))
-
-    plt.show()
+    plt.close(fig)
 
 
-def multi_view_3d_210_fig():
+def multi_view_3d_210_fig(contour_mesh, multi_contour_mesh, volume_mesh):
     (n, l, m) = (2, 1, 0)
     grid_span = 4
     grid_bounds = [-grid_span, grid_span, -grid_span, grid_span, -grid_span,
@@ -275,11 +277,8 @@ def multi_view_3d_210_fig():
 
     # Contour plot
     pl.subplot(0, 1)
-    mesh = get_wavefunction_prob_contour_mesh(
-        n, l, m, num_pts=100,
-        prob_threshold_list=(0.5,))
     pl.set_background('black')
-    pl.add_mesh(mesh, scalars='rgba', rgb=True,
+    pl.add_mesh(contour_mesh, scalars='rgba', rgb=True,
                 smooth_shading=True,
                 specular=0,
                 diffuse=1,
@@ -293,11 +292,8 @@ def multi_view_3d_210_fig():
 
     # Multi-contour plot
     pl.subplot(0, 2)
-    mesh = get_wavefunction_prob_contour_mesh(
-        n, l, m, num_pts=100, mag_maps_to='a',
-        prob_threshold_list=(0.2, 0.4, 0.6))
     pl.set_background('black')
-    pl.add_mesh(mesh, scalars='rgba', rgb=True,
+    pl.add_mesh(multi_contour_mesh, scalars='rgba', rgb=True,
                 smooth_shading=True,
                 specular=0,
                 diffuse=1,
@@ -308,12 +304,8 @@ def multi_view_3d_210_fig():
 
     # Volume plot
     pl.subplot(0, 0)
-    mesh = get_wavefunction_volume_mesh(n, l, m,
-                                        num_pts=100,
-                                        max_opacity=0.7,
-                                        opacity_exp=1.0)
     pl.set_background('black')
-    pl.add_volume(mesh, scalars='rgba', mapper='gpu')
+    pl.add_volume(volume_mesh, scalars='rgba', mapper='gpu')
     pl.camera = cam
     pl.show_grid(color='white', bounds=grid_bounds)
 
@@ -338,22 +330,229 @@ def complex_colors():
     fig.set_tight_layout(True)
 
     fig.savefig(Path(fig_dir, 'complex_colors.png'))
-
-    plt.show()
-
-
-def main():
+    plt.close(fig)
+
+
+class Figure(NamedTuple):
+    func: Callable
+    # Specs of the meshes passed to func. Meshes with the same spec are
+    # generated once for all figures.
+    mesh_specs: tuple = ()
+    # Functions of this script that func calls.
+    helpers: tuple = ()
+    # atomview modules func uses directly.
+    modules: tuple = ()
+
+
+# Each figure is saved to fig_dir under its name, see get_figure_path.
+FIGURES = {
+    'multi_view_3d_320': Figure(intro_multi_view_3d_320_fig, (
+        contour_mesh_spec(3, 2, 0, (0.5,)),
+        contour_mesh_spec(3, 2, 0, (0.2, 0.5, 0.8), mag_maps_to='a'),
+        volume_mesh_spec(3, 2, 0, max_opacity=0.7))),
+    '100_simple_1D': Figure(radial_100_1d_fig, helpers=(add_radial_fig,),
+                            modules=('wavefunction_calc',)),
+    'density_2d_100': Figure(density_2d_100_2d_fig, helpers=(add_2d_fig,),
+                             modules=('utils', 'wavefunction_calc')),
+    'simple_100_volume_3d': Figure(simple_100_volume_3d_plot, (
+        volume_mesh_spec(1, 0, 0, max_opacity=1.0),)),
+    'simple_100_contour_3d_plots': Figure(simple_100_contour_3d_plots, (
+        contour_mesh_spec(1, 0, 0, (0.5,)),
+        contour_mesh_spec(1, 0, 0, (0.2, 0.4, 0.6), mag_maps_to='a'))),
+    'radial_210_1d': Figure(radial_210_1d_fig, helpers=(add_radial_fig,),
+                            modules=('wavefunction_calc',)),
+    'density_2d_210': Figure(density_2d_210_fig, helpers=(add_2d_fig,),
+                             modules=('utils', 'wavefunction_calc')),
+    'multi_view_3d_210': Figure(multi_view_3d_210_fig, (
+        contour_mesh_spec(2, 1, 0, (0.5,)),
+        contour_mesh_spec(2, 1, 0, (0.2, 0.4, 0.6), mag_maps_to='a'),
+        volume_mesh_spec(2, 1, 0, max_opacity=0.7))),
+    'complex_colors': Figure(complex_colors, modules=('utils',)),
+}
+
+
+def get_figure_path(name):
+    return Path(fig_dir, f'{name}.png')
+
+
+def get_file_hash(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def get_module_hashes(module_names):
+    return {module_name: get_file_hash(
+                importlib.util.find_spec(f'atomview.{module_name}').origin)
+            for module_name in sorted(module_names)}
+
+
+def get_figure_inputs_hash(name):
+    # Hash of everything the figure depends on: its meshes, the source of
+    # its functions, which holds the plotting options, the styling of this
+    # script, the atomview modules used and the plotting library versions.
+    figure = FIGURES[name]
+    modules = set(figure.modules)
+    if figure.mesh_specs:
+        modules.update(SOURCE_MODULES)
+    inputs = {
+        'mesh_specs': figure.mesh_specs,
+        'source': [inspect.getsource(func)
+                   for func in (figure.func,) + figure.helpers],
+        'color': COLOR,
+        'modules': get_module_hashes(modules),
+        'versions': {'matplotlib': mpl.__version__,
+                     'pyvista': pv.__version__,
+                     'vtk': pv.vtk_version_info},
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def read_manifest():
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            return json.load(f)
+    return dict()
+
+
+def write_manifest(manifest):
+    tmp_path = manifest_path.with_name(f'{manifest_path.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_up_to_date(name, manifest):
+    # The figure was rendered from the same inputs and its file is the one
+    # that was rendered.
+    entry = manifest.get(name)
+    path = get_figure_path(name)
+    return (entry is not None
+            and entry['inputs'] == get_figure_inputs_hash(name)
+            and path.exists()
+            and entry['output'] == get_file_hash(path))
+
+
+def build_mesh(kind, params):
+    # Runs in a worker process. The mesh is stored in the shared disk cache
+    # by its pipeline, only the time taken is returned.
+    start = time.perf_counter()
+    generate_mesh(kind, params)
+    return time.perf_counter() - start
+
+
+def render_figure(name):
+    # Runs in a worker process once the figure's meshes are in the disk
+    # cache, from which generate_mesh reads them.
+    start = time.perf_counter()
+    figure = FIGURES[name]
+    figure.func(*(generate_mesh(kind, params)
+                  for kind, params in figure.mesh_specs))
+    return time.perf_counter() - start
+
+
+def run_figures(names, cache_dir, processes=None, force=False, log=print):
+    """
+    Render the named figures in a pool of worker processes. Figures whose
+    inputs and file are unchanged since they were last rendered are
+    skipped unless force is set. The meshes the figures need are generated
+    first, each once, into a DiskCache in cache_dir, and every figure is
+    rendered as soon as its meshes are ready. Returns the seconds taken by
+    each rendered figure.
+    """
     fig_dir.mkdir(parents=True, exist_ok=True)
-
-    # intro_multi_view_3d_320_fig()
-    # radial_100_1d_fig()
-    # simple_100_2d_fig()
-    # simple_100_volume_3d_plot()
-    # simple_100_contour_3d_plots()
-    # radial_210_1d_fig()
-    # density_2d_210_fig()
-    # multi_view_3d_210_fig()
-    complex_colors()
+    manifest = read_manifest()
+    if not force:
+        names = [name for name in names
+                 if not is_up_to_date(name, manifest)]
+    log(f'{len(names)} figures to render.')
+    if not names:
+        return dict()
+
+    start = time.perf_counter()
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_disk_cache,
+        initargs=(cache_dir, float('inf')))
+    figure_seconds = dict()
+    try:
+        mesh_futures = dict()
+        mesh_labels = dict()
+        waiting_meshes = dict()
+        for name in names:
+            waiting_meshes[name] = set()
+            for kind, params in FIGURES[name].mesh_specs:
+                key = get_mesh_key(kind, params)
+                if key not in mesh_futures:
+                    mesh_futures[key] = pool.submit(build_mesh, kind, params)
+                    mesh_labels[key] = (f'{kind} mesh {params["n"]}'
+                                        f'{params["l"]}{params["m"]}')
+                waiting_meshes[name].add(key)
+        mesh_keys = {future: key for key, future in mesh_futures.items()}
+
+        figure_futures = dict()
+        pending = set(mesh_futures.values())
+        while True:
+            for name, keys in list(waiting_meshes.items()):
+                if not keys:
+                    del waiting_meshes[name]
+                    future = pool.submit(render_figure, name)
+                    figure_futures[future] = name
+                    pending.add(future)
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in mesh_keys:
+                    key = mesh_keys[future]
+                    log(f'{mesh_labels[key]} {future.result():.2f} s')
+                    for keys in waiting_meshes.values():
+                        keys.discard(key)
+                else:
+                    name = figure_futures[future]
+                    figure_seconds[name] = future.result()
+                    log(f'{name} {figure_seconds[name]:.2f} s')
+                    manifest[name] = {
+                        'inputs': get_figure_inputs_hash(name),
+                        'output': get_file_hash(get_figure_path(name))}
+                    write_manifest(manifest)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    log(f'{len(figure_seconds)} figures in '
+        f'{time.perf_counter() - start:.2f} s, '
+        f'{sum(figure_seconds.values()):.2f} s rendering in total')
+    return figure_seconds
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        description=f'Render the documentation figures into {fig_dir}.')
+    parser.add_argument('figures', nargs='*',
+                        help=f'Figures to render, all by default. One of '
+                             f'{", ".join(FIGURES)}.')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes. Defaults to the '
+                             'number of CPUs.')
+    parser.add_argument('--cache-dir', type=Path, default=None,
+                        help='Directory of the mesh cache shared by the '
+                             'workers. A temporary directory by default.')
+    parser.add_argument('--force', action='store_true',
+                        help='Render the figures even if they are up to '
+                             f'date with {manifest_path.name}.')
+    args = parser.parse_args(argv)
+    unknown_names = set(args.figures) - set(FIGURES)
+    if unknown_names:
+        parser.error(f'Unknown figures {", ".join(sorted(unknown_names))}.')
+
+    names = args.figures or list(FIGURES)
+    if args.cache_dir is not None:
+        run_figures(names, args.cache_dir, processes=args.processes,
+                    force=args.force)
+    else:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            run_figures(names, cache_dir, processes=args.processes,
+                        force=args.force)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from warnings import warn
+
+from atomview.disk_cache import (
+    CACHE_FORMAT_VERSION, CODE_VERSION, DiskCache, normalize_key_part,
+    write_cache_file)
+from atomview.mesh_executor import PIPELINE_CLASSES, generate_mesh
+
+
+ATLAS_MODES = ('contour', 'multi_contour', 'volume')
+INDEX_FILE_NAME = 'index.json'
+
+
+def get_mode_params(mode, n, l, m, real=False, num_pts=100,  # noqa
+                    contour_prob_threshold=0.5, cutout=False,
+                    mc_threshold_list=(0.2, 0.5, 0.8)):
+    # Pipeline kind and parameters for the viewer's visualization modes. The
+    # keyword defaults are the viewer's initial settings.
+    if mode == 'contour':
+        return 'contour', dict(
+            n=n, l=l, m=m,
+            prob_threshold_list=[contour_prob_threshold],
+            num_pts=num_pts,
+            mag_maps_to='',
+            real=real,
+            clip=cutout)
+    elif mode == 'multi_contour':
+        return 'contour', dict(
+            n=n, l=l, m=m,
+            prob_threshold_list=list(mc_threshold_list),
+            num_pts=num_pts,
+            mag_maps_to='a',
+            real=real,
+            clip=False)
+    elif mode == 'volume':
+        return 'volume', dict(
+            n=n, l=l, m=m,
+            num_pts=num_pts,
+            real=real,
+            baked_rgba=False)
+    else:
+        raise ValueError(f'Unknown visualization mode \'{mode}\'.')
+
+
+def get_atlas_states(n_max, modes=ATLAS_MODES, reals=(False, True)):
+    # States are ordered so that consecutive states share a grid.
+    return [(mode, n, l, m, real)
+            for mode in modes
+            for real in reals
+            for n in range(1, n_max + 1)
+            for l in range(n)  # noqa
+            for m in range(-l, l + 1)]
+
+
+def get_state_name(mode, n, l, m, real, num_pts):  # noqa
+    real_str = 'real' if real else 'complex'
+    return f'{mode}/{n}/{l}/{m}/{real_str}/{num_pts}'
+
+
+def get_mesh_key(kind, params):
+    # Key of the mesh in a DiskCache. It matches the key a pipeline with a
+    # disk cache stores its mesh under.
+    pipeline = PIPELINE_CLASSES[kind](**params)
+    return pipeline.get_disk_key(pipeline.mesh_stage)
+
+
+def ignore_sigint():
+    # Worker initializer. Ctrl+C is handled by the parent, which cancels the
+    # pending jobs and lets the running ones finish writing their meshes.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def build_atlas_entry(atlas_dir, mode, n, l, m, real, num_pts):  # noqa
+    # Runs in a worker process. The mesh is written straight to the atlas
+    # directory, only its key is returned.
+    start = time.perf_counter()
+    kind, params = get_mode_params(mode, n, l, m, real, num_pts)
+    mesh = generate_mesh(kind, params, pipeline_key=kind)
+    key = get_mesh_key(kind, params)
+    path = Path(atlas_dir, f'{key}.atv')
+    write_cache_file(path, mesh)
+    return key, path.stat().st_size, time.perf_counter() - start
+
+
+def get_params_id(kind, params):
+    # Hashable identity of a pipeline kind and parameters, equal for
+    # parameters that went through JSON and for the original ones.
+    return normalize_key_part((kind, dict(params)))
+
+
+class Atlas:
+    """
+    Store of precomputed meshes built by build_atlas. The meshes are kept in
+    DiskCache format. index.json maps each state, and its pipeline kind and
+    parameters, to the key of its mesh, so meshes are found through the
+    index rather than by recomputing content keys, which change with the
+    code. An atlas built with another cache format version is ignored.
+    """
+    def __init__(self, atlas_dir):
+        self.atlas_dir = Path(atlas_dir)
+        self.disk_cache = DiskCache(self.atlas_dir, max_bytes=float('inf'))
+        self.index_path = self.atlas_dir / INDEX_FILE_NAME
+        self.states = dict()
+        if self.index_path.exists():
+            with open(self.index_path) as f:
+                index = json.load(f)
+            format_version = index.get('cache_format_version')
+            if format_version == CACHE_FORMAT_VERSION:
+                self.states = index['states']
+            else:
+                warn(f'The atlas in {self.atlas_dir} has cache format '
+                     f'version {format_version}, expected '
+                     f'{CACHE_FORMAT_VERSION}. Its meshes are ignored.')
+        self.state_keys = {
+            get_params_id(entry['kind'], entry['params']): entry['key']
+            for entry in self.states.values()}
+
+    def __len__(self):
+        return len(self.states)
+
+    def get_key(self, kind, params):
+        # Key of the mesh for kind and params, None if it is not stored.
+        key = self.state_keys.get(get_params_id(kind, params))
+        if key is None or key not in self.disk_cache:
+            return None
+        return key
+
+    def has_mesh(self, kind, params):
+        return self.get_key(kind, params) is not None
+
+    def get(self, kind, params):
+        key = self.get_key(kind, params)
+        return None if key is None else self.disk_cache.get(key)
+
+    def get_state(self, mode, n, l, m, real=False, num_pts=100):  # noqa
+        return self.get(*get_mode_params(mode, n, l, m, real, num_pts))
+
+    def has_state(self, state_name):
+        entry = self.states.get(state_name)
+        return entry is not None and entry['key'] in self.disk_cache
+
+    def add_entry(self, state_name, kind, params, key, nbytes):
+        self.states[state_name] = {'kind': kind, 'params': params,
+                                   'key': key, 'nbytes': nbytes}
+        self.state_keys[get_params_id(kind, params)] = key
+
+    def write_index(self):
+        # atomview_version records the code that generated the meshes.
+        index = {'cache_format_version': CACHE_FORMAT_VERSION,
+                 'atomview_version': CODE_VERSION,
+                 'states': self.states}
+        tmp_path = self.index_path.with_name(f'{INDEX_FILE_NAME}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+
+def build_atlas(atlas_dir, n_max, modes=ATLAS_MODES, reals=(False, True),
+                num_pts=100, processes=None, log=print):
+    """
+    Generate the meshes of every state up to n_max into the atlas in
+    atlas_dir. States already in the atlas are skipped, so an interrupted
+    build resumes where it stopped.
+    """
+    atlas = Atlas(atlas_dir)
+    states = get_atlas_states(n_max, modes, reals)
+    jobs = []
+    for mode, n, l, m, real in states:
+        state_name = get_state_name(mode, n, l, m, real, num_pts)
+        if atlas.has_state(state_name):
+            continue
+        kind, params = get_mode_params(mode, n, l, m, real, num_pts)
+        key = get_mesh_key(kind, params)
+        if key in atlas.disk_cache:
+            # A mesh written just before an interruption.
+            atlas.add_entry(state_name, kind, params, key,
+                            atlas.disk_cache.get_path(key).stat().st_size)
+            continue
+        jobs.append((state_name, kind, params,
+                     (mode, n, l, m, real, num_pts)))
+    atlas.write_index()
+
+    num_states = len(states)
+    num_built = num_states - len(jobs)
+    log(f'{num_built} of {num_states} states already built, '
+        f'building {len(jobs)}.')
+    if not jobs:
+        return atlas
+
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=ignore_sigint)
+    start = time.perf_counter()
+    built_nbytes = 0
+    try:
+        futures = {pool.submit(build_atlas_entry, atlas_dir, *job_args):
+                   (state_name, kind, params)
+                   for state_name, kind, params, job_args in jobs}
+        for num_done, future in enumerate(as_completed(futures), start=1):
+            state_name, kind, params = futures[future]
+            key, nbytes, seconds = future.result()
+            atlas.add_entry(state_name, kind, params, key, nbytes)
+            atlas.write_index()
+
+            built_nbytes += nbytes
+            elapsed = time.perf_counter() - start
+            rate = num_done / elapsed
+            eta = (len(jobs) - num_done) / rate
+            log(f'[{num_built + num_done}/{num_states}] {state_name} '
+                f'{seconds:.2f} s, {rate:.2f} states/s, '
+                f'{built_nbytes / 2**20 / elapsed:.1f} MiB/s, '
+                f'ETA {eta:.0f} s')
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return atlas
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        description='Precompute the meshes of every orbital up to n_max '
+                    'into an atlas directory which the viewer and scripts '
+                    'can read. Rerunning resumes an interrupted build.')
+    parser.add_argument('atlas_dir', type=Path)
+    parser.add_argument('--n-max', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', choices=ATLAS_MODES,
+                        default=list(ATLAS_MODES))
+    parser.add_argument('--wavefunctions', nargs='+',
+                        choices=('complex', 'real'),
+                        default=['complex', 'real'])
+    parser.add_argument('--num-pts', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes. Defaults to the '
+                             'number of CPUs.')
+    args = parser.parse_args(argv)
+
+    reals = tuple(wavefunction == 'real'
+                  for wavefunction in args.wavefunctions)
+    try:
+        build_atlas(args.atlas_dir, args.n_max, modes=args.modes,
+                    reals=reals, num_pts=args.num_pts,
+                    processes=args.processes)
+    except KeyboardInterrupt:
+        print('Interrupted, rerun to resume.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
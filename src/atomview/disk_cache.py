@@ -0,0 +1,281 @@
+import hashlib
+import importlib.util
+import json
+import marshal
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+
+import numpy as np
+import pyvista as pv
+
+from atomview.mesh_io import get_mesh_arrays, mesh_from_arrays
+
+
+# Bump when the file layout or the meaning of cached stage outputs changes.
+CACHE_FORMAT_VERSION = 1
+CACHE_FILE_SUFFIX = '.atv'
+_MAGIC = b'ATOMVIEW'
+_ALIGN = 64
+
+# atomview modules whose code determines the cached stage outputs.
+SOURCE_MODULES = ('utils', 'wavefunction_calc', 'wavefunction_mesh')
+
+try:
+    CODE_VERSION = version('atomview')
+except PackageNotFoundError:
+    CODE_VERSION = 'unknown'
+
+
+def get_module_code_bytes(module_name):
+    # The module's source, or its marshalled code object when only that is
+    # available, e.g. in a PyInstaller bundle. None if the loader provides
+    # neither.
+    loader = importlib.util.find_spec(module_name).loader
+    try:
+        source = loader.get_source(module_name)
+        if source is not None:
+            return source.encode()
+        code = loader.get_code(module_name)
+    except (AttributeError, ImportError, OSError):
+        return None
+    return None if code is None else marshal.dumps(code)
+
+
+@lru_cache(maxsize=None)
+def get_source_hash():
+    # The package version does not change while editing a development
+    # install, so the code of SOURCE_MODULES is hashed into the keys as
+    # well. Without it the keys depend on the version only.
+    source_hash = hashlib.sha256()
+    for module_name in SOURCE_MODULES:
+        code_bytes = get_module_code_bytes(f'atomview.{module_name}')
+        if code_bytes is None:
+            return 'unknown'
+        source_hash.update(code_bytes)
+    return source_hash.hexdigest()
+
+
+def normalize_key_part(part):
+    # Convert numpy scalars and dtypes to plain Python values so that equal
+    # parameters give equal hashes.
+    if isinstance(part, dict):
+        return tuple((name, normalize_key_part(value))
+                     for name, value in sorted(part.items()))
+    if isinstance(part, (tuple, list)):
+        return tuple(normalize_key_part(value) for value in part)
+    if isinstance(part, np.dtype):
+        return part.str
+    if isinstance(part, np.generic):
+        return part.item()
+    return part
+
+
+def get_cache_key(*parts):
+    key_parts = (CACHE_FORMAT_VERSION, CODE_VERSION, get_source_hash(),
+                 normalize_key_part(parts))
+    return hashlib.sha256(repr(key_parts).encode()).hexdigest()
+
+
+def value_to_arrays(value):
+    # A cached value is a mesh, a tuple of meshes or a dict of arrays.
+    if isinstance(value, pv.DataSet):
+        mesh_type, arrays = get_mesh_arrays(value)
+        return {'kind': 'mesh', 'mesh_type': mesh_type}, arrays
+    if isinstance(value, tuple):
+        metas = []
+        arrays = []
+        for idx, sub_mesh in enumerate(value):
+            mesh_type, sub_arrays = get_mesh_arrays(sub_mesh)
+            metas.append(mesh_type)
+            arrays += [(f'{idx}/{group}', name, arr)
+                       for group, name, arr in sub_arrays]
+        return {'kind': 'mesh_tuple', 'mesh_types': metas}, arrays
+    if isinstance(value, dict):
+        arrays = [('arrays', name, np.asarray(arr))
+                  for name, arr in value.items()]
+        return {'kind': 'arrays'}, arrays
+    raise TypeError(f'Unsupported value type {type(value).__name__}.')
+
+
+def value_from_arrays(meta, arrays):
+    if meta['kind'] == 'mesh':
+        return mesh_from_arrays(meta['mesh_type'], arrays)
+    if meta['kind'] == 'mesh_tuple':
+        meshes = []
+        for idx, mesh_type in enumerate(meta['mesh_types']):
+            prefix = f'{idx}/'
+            sub_arrays = [(group[len(prefix):], name, arr)
+                          for group, name, arr in arrays
+                          if group.startswith(prefix)]
+            meshes.append(mesh_from_arrays(mesh_type, sub_arrays))
+        return tuple(meshes)
+    if meta['kind'] == 'arrays':
+        return {name: arr for _, name, arr in arrays}
+    raise ValueError(f'Unknown cached value kind {meta["kind"]}.')
+
+
+def write_array_file(path, magic, meta, arrays):
+    # Layout: 8 byte magic, little endian uint64 header length, JSON header,
+    # then the raw arrays. Array offsets are relative to the first 64 byte
+    # boundary after the header and every array is 64 byte aligned. arrays
+    # holds (group, name, dtype, shape, chunks) where chunks yields the
+    # array's data in order, so arrays can be converted and written a piece
+    # at a time. The file is written to a temporary name and then moved into
+    # place.
+    array_specs = []
+    offset = 0
+    for group, name, dtype, shape, _ in arrays:
+        dtype = np.dtype(dtype)
+        offset = -(-offset // _ALIGN) * _ALIGN
+        array_specs.append((group, name, dtype.str, tuple(shape), offset))
+        offset += dtype.itemsize * int(np.prod(shape))
+    header = json.dumps({'meta': meta, 'arrays': array_specs}).encode()
+    data_start = -(-(len(magic) + 8 + len(header)) // _ALIGN) * _ALIGN
+
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(magic)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for (_, _, dtype, _, chunks), (_, _, _, _, arr_offset) in zip(
+                    arrays, array_specs):
+                f.write(b'\0' * (data_start + arr_offset - f.tell()))
+                for chunk in chunks:
+                    f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Also on KeyboardInterrupt, so no partial file is left behind.
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def read_array_file(path, magic):
+    # Returns the meta and the (group, name, array) list written by
+    # write_array_file. Arrays are copy-on-write memory maps of the file, so
+    # only the pages that are used are read and the file is never modified.
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f'{path} is not a {magic.decode()} file.')
+        header_len = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_len))
+    data_start = -(-(len(magic) + 8 + header_len) // _ALIGN) * _ALIGN
+    buffer = np.memmap(path, dtype=np.uint8, mode='c')
+    arrays = []
+    for group, name, dtype, shape, offset in header['arrays']:
+        dtype = np.dtype(dtype)
+        start = data_start + offset
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        arr = buffer[start:start + nbytes].view(dtype).reshape(shape)
+        arrays.append((group, name, arr))
+    return header['meta'], arrays
+
+
+def write_cache_file(path, value):
+    meta, arrays = value_to_arrays(value)
+    write_array_file(path, _MAGIC, meta,
+                     [(group, name, arr.dtype, arr.shape, (arr,))
+                      for group, name, arr in arrays])
+
+
+def read_cache_file(path):
+    return value_from_arrays(*read_array_file(path, _MAGIC))
+
+
+class DiskCache:
+    """
+    Content-addressed cache of meshes and arrays stored in cache_dir, one
+    file per entry named by its key. Use get_cache_key to build keys from
+    everything the value depends on. The total size of the entries is kept
+    below max_bytes by removing the least recently used files. Several
+    processes may share a cache directory.
+    """
+    def __init__(self, cache_dir, max_bytes=2 * 2**30):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._file_nbytes = OrderedDict()
+        self.scan()
+
+    def scan(self):
+        self._file_nbytes.clear()
+        self.nbytes = 0
+        entries = []
+        for path in self.cache_dir.glob(f'*{CACHE_FILE_SUFFIX}'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._file_nbytes[key] = size
+            self.nbytes += size
+        self.evict()
+
+    def get_path(self, key):
+        return self.cache_dir / f'{key}{CACHE_FILE_SUFFIX}'
+
+    def __contains__(self, key):
+        return self.get_path(key).exists()
+
+    def __len__(self):
+        return len(self._file_nbytes)
+
+    def get(self, key):
+        path = self.get_path(key)
+        try:
+            value = read_cache_file(path)
+        except (OSError, ValueError):
+            return None
+        # The modification time records recency across processes.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        if key not in self._file_nbytes:
+            self._file_nbytes[key] = path.stat().st_size
+            self.nbytes += self._file_nbytes[key]
+        self._file_nbytes.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        path = self.get_path(key)
+        try:
+            write_cache_file(path, value)
+        except OSError:
+            # E.g. the file is memory mapped by another process on Windows.
+            return
+        self.nbytes -= self._file_nbytes.pop(key, 0)
+        self._file_nbytes[key] = path.stat().st_size
+        self.nbytes += self._file_nbytes[key]
+        self.evict()
+
+    def pop(self, key):
+        try:
+            self.get_path(key).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        self.nbytes -= self._file_nbytes.pop(key, 0)
+        return True
+
+    def evict(self):
+        for key in list(self._file_nbytes):
+            if self.nbytes <= self.max_bytes:
+                break
+            # Files which are in use can't be removed on some platforms, pop
+            # leaves them in place.
+            self.pop(key)
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self):
+        for key in list(self._file_nbytes):
+            self.pop(key)
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+
+def get_mesh_nbytes(mesh):
+    if isinstance(mesh, (tuple, list)):
+        return sum(get_mesh_nbytes(sub_mesh) for sub_mesh in mesh)
+    # actual_memory_size is reported in KiB.
+    return 1024 * mesh.actual_memory_size
+
+
+class MeshCache:
+    """
+    Least-recently-used cache of pyvista meshes bounded by the total number
+    of bytes held by the cached meshes. Values may be single meshes or
+    tuples of meshes, e.g. a contour mesh and its ghost mesh.
+    """
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._meshes = OrderedDict()
+        self._mesh_nbytes = dict()
+
+    def __contains__(self, key):
+        return key in self._meshes
+
+    def __len__(self):
+        return len(self._meshes)
+
+    def get(self, key):
+        if key not in self._meshes:
+            return None
+        self._meshes.move_to_end(key)
+        return self._meshes[key]
+
+    def put(self, key, mesh):
+        self.pop(key)
+        mesh_nbytes = get_mesh_nbytes(mesh)
+        if mesh_nbytes > self.max_bytes:
+            return
+        self._meshes[key] = mesh
+        self._mesh_nbytes[key] = mesh_nbytes
+        self.nbytes += mesh_nbytes
+        self.evict()
+
+    def pop(self, key):
+        if key not in self._meshes:
+            return None
+        self.nbytes -= self._mesh_nbytes.pop(key)
+        return self._meshes.pop(key)
+
+    def evict(self):
+        while self.nbytes > self.max_bytes:
+            oldest_key = next(iter(self._meshes))
+            self.pop(oldest_key)
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self):
+        self._meshes.clear()
+        self._mesh_nbytes.clear()
+        self.nbytes = 0
@@ -0,0 +1,188 @@
+import multiprocessing
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from atomview.disk_cache import DiskCache
+from atomview.mesh_io import get_mesh_arrays, mesh_from_arrays
+from atomview.wavefunction_mesh import (
+    ContourMeshPipeline, VolumeMeshPipeline)
+
+
+PIPELINE_CLASSES = {
+    'contour': ContourMeshPipeline,
+    'volume': VolumeMeshPipeline,
+}
+
+# Pipelines kept by each process so that requests sharing a pipeline_key
+# reuse memoized stages when they land on the same process.
+_pipelines = dict()
+# Disk cache used by the pipelines of this process, see init_disk_cache.
+_disk_cache = None
+
+
+def init_disk_cache(cache_dir=None, max_bytes=2 * 2**30):
+    global _disk_cache
+    if cache_dir is None:
+        _disk_cache = None
+    else:
+        _disk_cache = DiskCache(cache_dir, max_bytes=max_bytes)
+
+
+def mesh_to_shared_memory(mesh):
+    # Pack every array of the mesh into one shared memory block and return
+    # a small picklable description of it. The block is released by
+    # mesh_from_shared_memory in the receiving process.
+    if isinstance(mesh, (tuple, list)):
+        return tuple(mesh_to_shared_memory(sub_mesh) for sub_mesh in mesh)
+
+    mesh_type, arrays = get_mesh_arrays(mesh)
+    array_specs = []
+    offset = 0
+    for group, name, arr in arrays:
+        # Keep every array 8 byte aligned.
+        offset = -(-offset // 8) * 8
+        array_specs.append((group, name, arr.dtype.str, arr.shape, offset))
+        offset += arr.nbytes
+
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    try:
+        for (group, name, arr), (_, _, dtype, shape, arr_offset) in zip(
+                arrays, array_specs):
+            shm_arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                                 offset=arr_offset)
+            shm_arr[...] = arr
+            del shm_arr
+    finally:
+        shm.close()
+
+    return {'mesh_type': mesh_type,
+            'shm_name': shm.name,
+            'array_specs': array_specs}
+
+
+def mesh_from_shared_memory(mesh_spec):
+    if isinstance(mesh_spec, tuple):
+        return tuple(mesh_from_shared_memory(sub_spec)
+                     for sub_spec in mesh_spec)
+
+    shm = SharedMemory(name=mesh_spec['shm_name'])
+    try:
+        arrays = [(group, name,
+                   np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                              offset=offset).copy())
+                  for group, name, dtype, shape, offset
+                  in mesh_spec['array_specs']]
+    finally:
+        shm.close()
+        shm.unlink()
+    return mesh_from_arrays(mesh_spec['mesh_type'], arrays)
+
+
+def generate_mesh(kind, params, pipeline_key=None):
+    if pipeline_key is None:
+        pipeline = PIPELINE_CLASSES[kind]()
+    else:
+        pipeline = _pipelines.get(pipeline_key)
+        if not isinstance(pipeline, PIPELINE_CLASSES[kind]):
+            pipeline = PIPELINE_CLASSES[kind]()
+            _pipelines[pipeline_key] = pipeline
+    pipeline.disk_cache = _disk_cache
+    pipeline.set_params(**params)
+    return pipeline.get_mesh()
+
+
+def has_cached_mesh(kind, params, pipeline_key=None, disk_cache=None):
+    # Whether generate_mesh would return the mesh without computing it,
+    # either memoized by the pipeline of pipeline_key or in disk_cache.
+    pipeline = _pipelines.get(pipeline_key)
+    if not isinstance(pipeline, PIPELINE_CLASSES[kind]):
+        pipeline = PIPELINE_CLASSES[kind]()
+    pipeline.disk_cache = disk_cache
+    pipeline.set_params(**params)
+    return pipeline.has_stage_output(pipeline.mesh_stage)
+
+
+def generate_mesh_shared(kind, params, pipeline_key=None):
+    return mesh_to_shared_memory(generate_mesh(kind, params, pipeline_key))
+
+
+class SerialMeshExecutor:
+    """
+    Generates meshes in the calling thread. Has the same interface as
+    ProcessMeshExecutor.
+    """
+    def __init__(self, disk_cache_dir=None, disk_cache_max_bytes=2 * 2**30):
+        init_disk_cache(disk_cache_dir, disk_cache_max_bytes)
+
+    def submit(self, kind, params, pipeline_key=None):
+        future = Future()
+        try:
+            future.set_result(generate_mesh(kind, params, pipeline_key))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def has_cached_mesh(self, kind, params, pipeline_key=None):
+        return has_cached_mesh(kind, params, pipeline_key, _disk_cache)
+
+    def shutdown(self, wait=True, cancel_futures=True):
+        pass
+
+
+class ProcessMeshExecutor:
+    """
+    Generates meshes in a pool of worker processes so that independent
+    requests run concurrently. Meshes are returned through shared memory
+    rather than by pickling their arrays. submit returns a
+    concurrent.futures.Future which resolves to the mesh (or tuple of
+    meshes). If disk_cache_dir is given the workers share a DiskCache in
+    that directory, and has_cached_mesh checks it from the calling process.
+    """
+    def __init__(self, max_workers=None, disk_cache_dir=None,
+                 disk_cache_max_bytes=2 * 2**30):
+        self.disk_cache = (None if disk_cache_dir is None else
+                           DiskCache(disk_cache_dir, disk_cache_max_bytes))
+        self.pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_disk_cache,
+            initargs=(disk_cache_dir, disk_cache_max_bytes))
+
+    def submit(self, kind, params, pipeline_key=None):
+        # Cancelling the returned future cancels the pool task if it has not
+        # started. A task that finishes after its future was cancelled still
+        # has its shared memory released.
+        future = Future()
+        pool_future = self.pool.submit(generate_mesh_shared, kind, params,
+                                       pipeline_key)
+
+        def pool_future_done(done_future):
+            if done_future.cancelled():
+                future.cancel()
+                return
+            try:
+                if done_future.exception() is not None:
+                    future.set_exception(done_future.exception())
+                else:
+                    mesh = mesh_from_shared_memory(done_future.result())
+                    future.set_result(mesh)
+            except InvalidStateError:
+                pass
+
+        def future_done(done_future):
+            if done_future.cancelled():
+                pool_future.cancel()
+
+        future.add_done_callback(future_done)
+        pool_future.add_done_callback(pool_future_done)
+        return future
+
+    def has_cached_mesh(self, kind, params, pipeline_key=None):
+        # The memoized stages of the worker processes are not visible here,
+        # only the shared disk cache is.
+        return has_cached_mesh(kind, params, disk_cache=self.disk_cache)
+
+    def shutdown(self, wait=True, cancel_futures=True):
+        self.pool.shutdown(wait=wait, cancel_futures=cancel_futures)
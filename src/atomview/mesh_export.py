@@ -0,0 +1,205 @@
+import numpy as np
+import pyvista as pv
+
+from atomview.disk_cache import read_array_file, write_array_file
+
+
+# Compact mesh files for other tools. Unlike DiskCache files, which store
+# meshes exactly, positions are quantized to uint16 within the bounding box,
+# colours to uint8 and normals to octahedral int16 pairs. Bump when the
+# layout or the encodings change.
+EXPORT_FORMAT_VERSION = 1
+EXPORT_FILE_SUFFIX = '.atq'
+_MAGIC = b'ATOMVQNT'
+# Rows converted at a time when writing or reading, so no full size
+# temporary is made.
+_CHUNK_ROWS = 2**18
+_POSITION_MAX = np.iinfo(np.uint16).max
+_NORMAL_MAX = np.iinfo(np.int16).max
+
+
+def iter_chunks(arr, func):
+    for start in range(0, max(len(arr), 1), _CHUNK_ROWS):
+        yield func(arr[start:start + _CHUNK_ROWS])
+
+
+def quantize_positions(points, bounds_min, bounds_max):
+    # Positions as uint16 fractions of the bounding box. Flat axes map to 0.
+    extent = np.asarray(bounds_max) - np.asarray(bounds_min)
+    scale = np.divide(_POSITION_MAX, extent, out=np.zeros_like(extent),
+                      where=extent > 0)
+    return np.rint((points - bounds_min) * scale).astype(np.uint16)
+
+
+def dequantize_positions(quantized, bounds_min, bounds_max):
+    extent = np.asarray(bounds_max) - np.asarray(bounds_min)
+    return bounds_min + quantized * (extent / _POSITION_MAX)
+
+
+def encode_octahedral(normals):
+    # Unit vectors projected onto the octahedron |x| + |y| + |z| = 1 whose
+    # lower half is folded over the upper one, leaving (x, y) in [-1, 1]^2.
+    normals = np.asarray(normals, dtype=np.float64)
+    norm_1 = np.sum(np.abs(normals), axis=-1, keepdims=True)
+    xy = np.divide(normals[..., :2], norm_1,
+                   out=np.zeros_like(normals[..., :2]), where=norm_1 > 0)
+    lower = normals[..., 2] < 0
+    sign = np.where(xy[lower] >= 0, 1.0, -1.0)
+    xy[lower] = (1 - np.abs(xy[lower][:, ::-1])) * sign
+    return np.rint(xy * _NORMAL_MAX).astype(np.int16)
+
+
+def decode_octahedral(encoded):
+    xy = encoded.astype(np.float64) / _NORMAL_MAX
+    z = 1 - np.sum(np.abs(xy), axis=-1)
+    fold = np.maximum(-z, 0)[..., np.newaxis]
+    xy -= np.where(xy >= 0, fold, -fold)
+    normals = np.concatenate([xy, z[..., np.newaxis]], axis=-1)
+    return normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+
+
+def get_index_dtype(num_points):
+    for dtype in (np.uint16, np.uint32):
+        if num_points <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def encode_point_array(name, arr):
+    # Returns the encoding, stored dtype and chunk conversion. The encoding
+    # is a name, or for 'palette' a list of the values indexed by the
+    # stored uint8 array, e.g. the isovalue of each contour vertex.
+    if name == 'rgba' and arr.dtype != np.uint8:
+        return 'unorm8', np.uint8, lambda chunk: np.rint(
+            np.clip(chunk, 0, 1) * 255)
+    if name == 'Normals':
+        return 'octahedral', np.int16, encode_octahedral
+    if np.issubdtype(arr.dtype, np.floating):
+        if arr.ndim == 1:
+            palette = np.unique(arr)
+            if len(palette) <= 256:
+                return palette.tolist(), np.uint8, lambda chunk: (
+                    np.searchsorted(palette, chunk))
+        return 'float32', np.float32, lambda chunk: chunk
+    return 'raw', arr.dtype, lambda chunk: chunk
+
+
+def decode_point_array(encoding, arr):
+    if isinstance(encoding, list):
+        return np.array(encoding)[arr]
+    if encoding == 'octahedral':
+        return decode_octahedral(arr)
+    # uint8 colours are used as they are, pyvista plots them with rgb=True.
+    return arr
+
+
+def get_export_arrays(mesh, prefix, normals):
+    # Returns the meta and write_array_file arrays of one mesh.
+    if isinstance(mesh, pv.RectilinearGrid):
+        meta = {'mesh_type': 'RectilinearGrid'}
+        arrays = [(f'{prefix}geometry', name, axis.dtype, axis.shape, (axis,))
+                  for name, axis in (('x', mesh.x), ('y', mesh.y),
+                                     ('z', mesh.z))]
+    elif isinstance(mesh, pv.PolyData):
+        if mesh.n_cells > 0 and not mesh.is_all_triangles:
+            raise ValueError('Only triangle meshes can be exported.')
+        if normals and mesh.n_points > 0:
+            mesh = mesh.copy(deep=False)
+            mesh.point_data['Normals'] = mesh.point_normals
+        points = mesh.points
+        bounds_min = np.min(points, axis=0, initial=np.inf)
+        bounds_max = np.max(points, axis=0, initial=-np.inf)
+        if mesh.n_points == 0:
+            bounds_min = bounds_max = np.zeros(3)
+        meta = {'mesh_type': 'PolyData',
+                'bounds_min': bounds_min.tolist(),
+                'bounds_max': bounds_max.tolist()}
+        triangles = mesh.faces.reshape(-1, 4)[:, 1:]
+        arrays = [
+            (f'{prefix}geometry', 'points', np.uint16, points.shape,
+             iter_chunks(points, lambda chunk: quantize_positions(
+                 chunk, bounds_min, bounds_max))),
+            (f'{prefix}geometry', 'triangles',
+             get_index_dtype(mesh.n_points), triangles.shape,
+             iter_chunks(triangles, lambda chunk: chunk)),
+        ]
+    else:
+        raise TypeError(f'Unsupported mesh type {type(mesh).__name__}.')
+
+    meta['point_data'] = dict()
+    for name in mesh.point_data.keys():
+        arr = np.asarray(mesh.point_data[name])
+        encoding, dtype, func = encode_point_array(name, arr)
+        shape = arr.shape
+        if encoding == 'octahedral':
+            shape = shape[:-1] + (2,)
+        meta['point_data'][name] = encoding
+        arrays.append((f'{prefix}point_data', name, dtype, shape,
+                       iter_chunks(arr, func)))
+    return meta, arrays
+
+
+def export_mesh(path, mesh, normals=False):
+    """
+    Write a contour or volume mesh, or a tuple of them, to a compact file
+    which import_mesh or open_exported_mesh read. PolyData meshes must be
+    triangle meshes. With normals=True point normals are computed and
+    stored, a 'Normals' point array is stored in any case. Arrays are
+    converted and written a chunk at a time.
+    """
+    meshes = mesh if isinstance(mesh, tuple) else (mesh,)
+    mesh_metas = []
+    arrays = []
+    for idx, sub_mesh in enumerate(meshes):
+        mesh_meta, mesh_arrays = get_export_arrays(sub_mesh, f'{idx}/',
+                                                   normals)
+        mesh_metas.append(mesh_meta)
+        arrays += mesh_arrays
+    meta = {'version': EXPORT_FORMAT_VERSION,
+            'is_tuple': isinstance(mesh, tuple),
+            'meshes': mesh_metas}
+    write_array_file(path, _MAGIC, meta, arrays)
+
+
+def open_exported_mesh(path):
+    # The meta and the quantized arrays of a file from export_mesh, memory
+    # mapped, for readers that decode the arrays themselves. Arrays are
+    # returned per mesh as {group: {name: array}}.
+    meta, arrays = read_array_file(path, _MAGIC)
+    if meta['version'] != EXPORT_FORMAT_VERSION:
+        raise ValueError(f'{path} has format version {meta["version"]}, '
+                         f'expected {EXPORT_FORMAT_VERSION}.')
+    mesh_arrays = [{'geometry': dict(), 'point_data': dict()}
+                   for _ in meta['meshes']]
+    for group, name, arr in arrays:
+        idx, group = group.split('/')
+        mesh_arrays[int(idx)][group][name] = arr
+    return meta, mesh_arrays
+
+
+def import_mesh(path):
+    meta, mesh_arrays = open_exported_mesh(path)
+    meshes = []
+    for mesh_meta, arrays in zip(meta['meshes'], mesh_arrays):
+        geometry = arrays['geometry']
+        if mesh_meta['mesh_type'] == 'RectilinearGrid':
+            mesh = pv.RectilinearGrid(geometry['x'], geometry['y'],
+                                      geometry['z'])
+        else:
+            bounds_min = np.array(mesh_meta['bounds_min'])
+            bounds_max = np.array(mesh_meta['bounds_max'])
+            points = np.empty(geometry['points'].shape)
+            for start in range(0, len(points), _CHUNK_ROWS):
+                chunk = slice(start, start + _CHUNK_ROWS)
+                points[chunk] = dequantize_positions(
+                    geometry['points'][chunk], bounds_min, bounds_max)
+            triangles = geometry['triangles']
+            faces = np.empty((len(triangles), 4), dtype=np.int64)
+            faces[:, 0] = 3
+            faces[:, 1:] = triangles
+            mesh = pv.PolyData(points, faces=faces.ravel())
+        for name, encoding in mesh_meta['point_data'].items():
+            mesh.point_data[name] = decode_point_array(
+                encoding, arrays['point_data'][name])
+        meshes.append(mesh)
+    return tuple(meshes) if meta['is_tuple'] else meshes[0]
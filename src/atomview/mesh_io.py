@@ -0,0 +1,48 @@
+import numpy as np
+import pyvista as pv
+
+
+def get_mesh_arrays(mesh):
+    # Returns the mesh type name and a list of (group, name, array) holding
+    # everything needed to rebuild the mesh with mesh_from_arrays.
+    if isinstance(mesh, pv.RectilinearGrid):
+        geometry = {'x': mesh.x, 'y': mesh.y, 'z': mesh.z}
+    elif isinstance(mesh, pv.PolyData):
+        geometry = {'points': mesh.points,
+                    'verts': mesh.verts,
+                    'lines': mesh.lines,
+                    'faces': mesh.faces,
+                    'strips': mesh.strips}
+    else:
+        raise TypeError(f'Unsupported mesh type {type(mesh).__name__}.')
+    arrays = [('geometry', name, np.asarray(arr))
+              for name, arr in geometry.items()]
+    arrays += [('point_data', name, np.asarray(mesh.point_data[name]))
+               for name in mesh.point_data.keys()]
+    arrays += [('cell_data', name, np.asarray(mesh.cell_data[name]))
+               for name in mesh.cell_data.keys()]
+    return type(mesh).__name__, arrays
+
+
+def mesh_from_arrays(mesh_type, arrays):
+    grouped_arrays = {'geometry': dict(), 'point_data': dict(),
+                      'cell_data': dict()}
+    for group, name, arr in arrays:
+        grouped_arrays[group][name] = arr
+
+    geometry = grouped_arrays['geometry']
+    if mesh_type == 'RectilinearGrid':
+        mesh = pv.RectilinearGrid(geometry['x'], geometry['y'], geometry['z'])
+    elif mesh_type == 'PolyData':
+        mesh = pv.PolyData(geometry['points'],
+                           verts=geometry['verts'],
+                           lines=geometry['lines'],
+                           faces=geometry['faces'],
+                           strips=geometry['strips'])
+    else:
+        raise TypeError(f'Unsupported mesh type {mesh_type}.')
+    for name, arr in grouped_arrays['point_data'].items():
+        mesh.point_data[name] = arr
+    for name, arr in grouped_arrays['cell_data'].items():
+        mesh.cell_data[name] = arr
+    return mesh
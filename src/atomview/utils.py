@@ -1,11 +1,108 @@
+from functools import lru_cache
+
 import numpy as np
 from matplotlib.colors import hsv_to_rgb
 from scipy.special import sph_harm_y as sph_harm_scipy
 from scipy.special import factorial, lpmv
 
 
+def sph_harm_recurrence(x, y, z, l, m, r=None):  # noqa
+    abs_m = abs(m)
+    if r is None:
+        r = np.sqrt(x ** 2 + y ** 2 + z ** 2)
+    complex_dtype = np.result_type(r, np.complex64)
+    nonzero_r = r != 0
+    cos_theta = np.divide(z, r,
+                          where=nonzero_r,
+                          out=np.ones_like(r))
+
+    # sin(theta)**|m| * exp(i*|m|*phi) = ((x + iy) / r)**|m|. The remaining
+    # factor of the normalized associated Legendre function is a polynomial
+    # in cos(theta) computed with the standard three-term recurrence.
+    sin_theta_exp_phi = np.divide(x + 1j * y, r,
+                                  where=nonzero_r,
+                                  out=np.zeros_like(r, dtype=complex_dtype))
+    exponential_part = np.ones_like(sin_theta_exp_phi)
+    for _ in range(abs_m):
+        exponential_part *= sin_theta_exp_phi
+
+    p_mm = np.sqrt(1 / (4 * np.pi))
+    for k in range(1, abs_m + 1):
+        p_mm *= -np.sqrt((2 * k + 1) / (2 * k))
+
+    p_prev = np.zeros_like(r)
+    p_curr = np.full_like(r, p_mm)
+    for k in range(abs_m + 1, l + 1):
+        a = ((4 * k ** 2 - 1) / (k ** 2 - abs_m ** 2)) ** 0.5
+        b = (((k - 1) ** 2 - abs_m ** 2) / (4 * (k - 1) ** 2 - 1)) ** 0.5
+        p_prev, p_curr = p_curr, a * (cos_theta * p_curr - b * p_prev)
+
+    sph_harm = p_curr * exponential_part
+    if m < 0:
+        sph_harm = (-1) ** abs_m * np.conj(sph_harm)
+
+    return sph_harm
+
+
+@lru_cache(maxsize=None)
+def get_solid_harm_coeffs(l, abs_m):  # noqa
+    # Coefficients c_k of r**l * Y_lm = (x + iy)**|m| * z**p
+    # * sum_k c_k (z**2)**(D - k) (r**2)**k, with p = (l - |m|) % 2 and
+    # D = (l - |m|) // 2, found by running the associated Legendre
+    # recurrence on polynomial coefficients in cos(theta).
+    p_mm = np.sqrt(1 / (4 * np.pi))
+    for k in range(1, abs_m + 1):
+        p_mm *= -np.sqrt((2 * k + 1) / (2 * k))
+
+    p_prev = np.zeros(1)
+    p_curr = np.array([p_mm])
+    for k in range(abs_m + 1, l + 1):
+        a = np.sqrt((4 * k ** 2 - 1) / (k ** 2 - abs_m ** 2))
+        b = np.sqrt(((k - 1) ** 2 - abs_m ** 2) / (4 * (k - 1) ** 2 - 1))
+        p_next = np.zeros(len(p_curr) + 1)
+        p_next[1:] += a * p_curr
+        p_next[:len(p_prev)] -= a * b * p_prev
+        p_prev, p_curr = p_curr, p_next
+
+    # p_curr[j] multiplies cos(theta)**j and only j with the parity of
+    # l - |m| are nonzero. Order from the highest power of z down.
+    degree = l - abs_m
+    return tuple(p_curr[degree::-2].tolist())
+
+
+def solid_harm_cartesian(x, y, z, l, m):  # noqa
+    abs_m = abs(m)
+    coeffs = get_solid_harm_coeffs(l, abs_m)
+
+    z_squared = z ** 2
+    r_squared = x ** 2 + y ** 2 + z_squared
+    poly = np.full_like(z_squared, coeffs[0])
+    r_squared_pow = np.ones_like(r_squared)
+    for coeff in coeffs[1:]:
+        r_squared_pow *= r_squared
+        poly *= z_squared
+        poly += coeff * r_squared_pow
+    if (l - abs_m) % 2 == 1:
+        poly *= z
+
+    exponential_part = np.ones_like(poly,
+                                    dtype=np.result_type(poly, np.complex64))
+    x_plus_iy = x + 1j * y
+    for _ in range(abs_m):
+        exponential_part *= x_plus_iy
+
+    solid_harm = poly * exponential_part
+    if m < 0:
+        solid_harm = (-1) ** abs_m * np.conj(solid_harm)
+
+    return solid_harm
+
+
 def sph_harm_cartesian(x, y, z, l, m, use_scipy=False,  # noqa
-                       r=None):
+                       r=None, use_recurrence=False):
+    if use_recurrence:
+        return sph_harm_recurrence(x, y, z, l, m, r=r)
+
     rho_squared = x ** 2 + y ** 2
     if r is None:
         r = np.sqrt(rho_squared + z ** 2)
@@ -16,7 +113,7 @@ def sph_harm_cartesian(x, y, z, l, m, use_scipy=False,  # noqa
     if use_scipy:
         phi = np.arctan2(y, x)
         theta = np.arccos(cos_theta)
-        sph_harm = sph_harm_scipy(m, l, phi, theta)
+        sph_harm = sph_harm_scipy(l, m, theta, phi)
     else:
         rho = np.sqrt(rho_squared)
         cos_phi = np.divide(x, rho,
@@ -39,23 +136,45 @@ def sph_harm_cartesian(x, y, z, l, m, use_scipy=False,  # noqa
     return sph_harm
 
 
-def complex_to_rgba(arr, mag_maps_to='', zero_uniform_mag=False):
+def get_slab_slices(num_pts, chunk_size=None):
+    if chunk_size is None:
+        return [slice(None)]
+    return [slice(start, min(start + chunk_size, num_pts))
+            for start in range(0, num_pts, chunk_size)]
+
+
+def get_scaled_mag(arr, zero_uniform_mag=False, mag_range=None):
+    # |arr| scaled to [0, 1]. mag_range=(min_mag, max_mag) overrides the
+    # magnitude range used for scaling, e.g. when arr is one slab of a
+    # larger array.
+    mag = np.abs(arr)
+    if mag_range is None:
+        min_mag, max_mag = np.min(mag), np.max(mag)
+    else:
+        min_mag, max_mag = mag_range
+    if not zero_uniform_mag:
+        out = np.ones_like(mag)
+    else:
+        out = np.zeros_like(mag)
+    return np.divide(
+        mag - min_mag,
+        max_mag - min_mag,
+        where=(max_mag - min_mag != 0),
+        out=out)
+
+
+def complex_to_rgba(arr, mag_maps_to='', zero_uniform_mag=False,
+                    mag_range=None):
+    # mag_range=(min_mag, max_mag) overrides the magnitude range used for
+    # scaling, e.g. when arr is one slab of a larger array.
+    float_dtype = np.result_type(np.real(arr), np.float32)
     h = (np.angle(arr) / (2 * np.pi)) % 1
-    s = np.ones_like(arr, dtype=float)
-    v = np.ones_like(arr, dtype=float)
-    a = np.ones_like(arr, dtype=float)
+    s = np.ones_like(arr, dtype=float_dtype)
+    v = np.ones_like(arr, dtype=float_dtype)
+    a = np.ones_like(arr, dtype=float_dtype)
 
     if mag_maps_to != '':
-        mag = np.abs(arr)
-        if not zero_uniform_mag:
-            out = np.ones_like(mag)
-        else:
-            out = np.zeros_like(mag)
-        scaled_mag = np.divide(
-            mag - np.min(mag),
-            np.max(mag) - np.min(mag),
-            where=(np.max(mag) - np.min(mag) != 0),
-            out=out)
+        scaled_mag = get_scaled_mag(arr, zero_uniform_mag, mag_range)
         if 's' in mag_maps_to:
             s *= scaled_mag
         if 'v' in mag_maps_to:
@@ -69,3 +188,64 @@ def complex_to_rgba(arr, mag_maps_to='', zero_uniform_mag=False):
     rgba = np.concatenate((rgb, np.expand_dims(a, -1)), axis=-1)
 
     return rgba
+
+
+# Number of phase levels in the lookup table of complex_to_rgba_lut. A power
+# of two so that negative levels wrap with a bitwise and.
+PHASE_LUT_SIZE = 4096
+
+
+@lru_cache(maxsize=None)
+def get_phase_lut(dtype):
+    # Fully saturated RGB colours of the phase levels. uint8 tables are
+    # scaled by 255 and truncated like the rest of the uint8 colour arrays.
+    dtype = np.dtype(dtype)
+    hue = np.arange(PHASE_LUT_SIZE) / PHASE_LUT_SIZE
+    rgb = hsv_to_rgb(np.stack([hue, np.ones_like(hue), np.ones_like(hue)],
+                              axis=-1))
+    if dtype == np.uint8:
+        rgb = 255 * rgb
+    lut = rgb.astype(dtype)
+    lut.flags.writeable = False
+    return lut
+
+
+def complex_to_rgba_lut(arr, mag_maps_to='', zero_uniform_mag=False,
+                        mag_range=None, out=None):
+    # Same colours as complex_to_rgba, up to quantizing the phase to
+    # PHASE_LUT_SIZE levels, without going through a full HSV conversion.
+    # The result is written to out, an array of shape arr.shape + (4,)
+    # which may be any float dtype or uint8, in which case values are
+    # scaled by 255. With saturation s and value v the HSV colour is
+    # v * (1 - s * (1 - rgb)) where rgb is the fully saturated colour.
+    if out is None:
+        out = np.empty(np.shape(arr) + (4,),
+                       dtype=np.result_type(np.real(arr), np.float32))
+    lut = get_phase_lut(out.dtype)
+    phase_idx = np.rint(np.angle(arr) * (PHASE_LUT_SIZE / (2 * np.pi)))
+    phase_idx = phase_idx.astype(np.intp) & (PHASE_LUT_SIZE - 1)
+
+    scaled_mag = None
+    if mag_maps_to != '':
+        scaled_mag = get_scaled_mag(arr, zero_uniform_mag, mag_range)
+
+    if 's' in mag_maps_to or 'v' in mag_maps_to:
+        rgb = get_phase_lut(np.result_type(scaled_mag, np.float32))[phase_idx]
+        if 's' in mag_maps_to:
+            rgb -= 1
+            rgb *= scaled_mag[..., np.newaxis]
+            rgb += 1
+        if 'v' in mag_maps_to:
+            rgb *= scaled_mag[..., np.newaxis]
+        if out.dtype == np.uint8:
+            rgb *= 255
+        out[..., :3] = rgb
+    else:
+        out[..., :3] = lut[phase_idx]
+
+    max_val = 255 if out.dtype == np.uint8 else 1
+    if 'a' in mag_maps_to:
+        out[..., 3] = max_val * scaled_mag
+    else:
+        out[..., 3] = max_val
+    return out
@@ -0,0 +1,55 @@
+import numpy as np
+from vtkmodules.vtkCommonDataModel import vtkPiecewiseFunction
+from vtkmodules.vtkRenderingCore import vtkVolume, vtkVolumeProperty
+from vtkmodules.vtkRenderingVolume import vtkGPUVolumeRayCastMapper
+import vtkmodules.vtkRenderingVolumeOpenGL2  # noqa: F401
+
+
+# Volume meshes with a 'phase_mag' point array hold four uint8 components:
+# the RGB colour of the wavefunction's phase and its normalized magnitude.
+# With four dependent components VTK uses the first three as the colour and
+# passes the fourth through the opacity transfer function, so opacity can be
+# changed on the rendered volume without generating a new mesh. The colour
+# is stored as RGB rather than as a phase index so that it interpolates like
+# baked RGBA volumes instead of sweeping through every hue where the phase
+# wraps around.
+NUM_LEVELS = 256
+
+
+def update_opacity_transfer_function(opacity_tf, max_opacity, opacity_exp):
+    scaled_mag = np.arange(NUM_LEVELS) / (NUM_LEVELS - 1)
+    opacity = (max_opacity * scaled_mag) ** opacity_exp
+    opacity_tf.RemoveAllPoints()
+    for level, level_opacity in enumerate(opacity):
+        opacity_tf.AddPoint(level, level_opacity)
+    return opacity_tf
+
+
+def add_phase_mag_volume(plotter, mesh, max_opacity=0.2, opacity_exp=1.0):
+    mapper = vtkGPUVolumeRayCastMapper()
+    mapper.SetInputData(mesh)
+    mapper.SetScalarModeToUsePointFieldData()
+    mapper.SelectScalarArray('phase_mag')
+    mapper.AutoAdjustSampleDistancesOff()
+
+    volume_property = vtkVolumeProperty()
+    volume_property.IndependentComponentsOff()
+    volume_property.SetScalarOpacity(update_opacity_transfer_function(
+        vtkPiecewiseFunction(), max_opacity, opacity_exp))
+    # The sampling, interpolation and opacity unit distance of pyvista's
+    # add_volume, so that the volume looks like a baked RGBA volume of the
+    # same grid.
+    volume_property.SetScalarOpacityUnitDistance(
+        mesh.length / (np.mean(mesh.dimensions) - 1))
+    volume_property.SetInterpolationTypeToNearest()
+
+    volume = vtkVolume()
+    volume.SetMapper(mapper)
+    volume.SetProperty(volume_property)
+    plotter.add_actor(volume)
+    return volume
+
+
+def set_volume_opacity(volume, max_opacity, opacity_exp):
+    update_opacity_transfer_function(volume.GetProperty().GetScalarOpacity(),
+                                     max_opacity, opacity_exp)
@@ -1,25 +1,75 @@
+import math
+from functools import lru_cache
+
 import numpy as np
-from scipy.special import genlaguerre, factorial
+from scipy.special import gammaln
 
-from atomview.utils import sph_harm_cartesian
+from atomview.utils import (
+    get_slab_slices, sph_harm_cartesian, sph_harm_recurrence,
+    solid_harm_cartesian)
 
 
 a0 = 1
+# Above this l the cancellation between the monomials of the solid harmonic
+# polynomial loses accuracy (about 1e-12 at l = 14, 1e-5 at l = 30) and the
+# spherical harmonic recurrence is used instead.
+SOLID_HARM_MAX_L = 8
+# Points per double precision slab when single precision inputs are
+# evaluated, see get_atomic_wavefunction.
+_DOUBLE_SLAB_PTS = 2**16
 
+@lru_cache(maxsize=None)
 def get_prefactor(n, l, atomic_number=1):  # noqa
-    factor_1 = (2 * atomic_number / (n * a0)) ** (3 / 2)
-    factor_2 = np.sqrt(
-        factorial(n - l - 1, exact=False)
-        / (2 * n * factorial(n + l, exact=False)))
-    return factor_1 * factor_2
+    log_factor_1 = 1.5 * np.log(2 * atomic_number / (n * a0))
+    log_factor_2 = 0.5 * (gammaln(n - l)
+                          - np.log(2 * n)
+                          - gammaln(n + l + 1))
+    return float(np.exp(log_factor_1 + log_factor_2))
+
+
+@lru_cache(maxsize=None)
+def get_laguerre_coeffs(k, alpha):
+    # Coefficients (a_j, b_j, c_j) of the forward recurrence
+    # L_{j+1} = (a_j - b_j x) L_j - c_j L_{j-1}.
+    return tuple(((2 * j + 1 + alpha) / (j + 1),
+                  1 / (j + 1),
+                  (j + alpha) / (j + 1))
+                 for j in range(1, k))
+
 
+def eval_genlaguerre(k, alpha, x):
+    x = np.asarray(x)
+    float_dtype = np.result_type(x, np.float32)
+    if k == 0:
+        return np.ones_like(x, dtype=float_dtype)
 
-def get_radial_part(n, l, r, atomic_number=1):  # noqa
-    rho = 2 * r * atomic_number / (n * a0)
-    return np.exp(-rho / 2) * rho ** l * genlaguerre(n - l - 1, 2 * l + 1)(rho)
+    l_prev = np.ones_like(x, dtype=float_dtype)
+    l_curr = 1 + alpha - x
+    for a, b, c in get_laguerre_coeffs(k, alpha):
+        l_prev, l_curr = l_curr, (a - b * x) * l_curr - c * l_prev
+    return l_curr
+
+
+def get_radial_part(n, l, r, atomic_number=1, include_r_l=True):  # noqa
+    rho_scale = 2 * atomic_number / (n * a0)
+    rho = rho_scale * r
+    if include_r_l:
+        power_part = rho ** l
+    else:
+        # The r**l factor is supplied by the solid harmonic.
+        power_part = rho_scale ** l
+    return (np.exp(-rho / 2) * power_part
+            * eval_genlaguerre(n - l - 1, 2 * l + 1, rho))
 
 
-def get_atomic_wavefunction(x, y, z, n, l, m, atomic_number=1, real=False):
+def get_atomic_wavefunction_slab(x, y, z, n, l, m, atomic_number=1,  # noqa
+                                 real=False, use_solid_harm=True):
+    # The radial and angular factors hold powers of r up to r**l which
+    # overflow single precision at high n and l, so they are evaluated in
+    # double precision and only psi takes the precision of the inputs.
+    dtype = np.result_type(x, y, z, np.float32)
+    x, y, z = (np.asarray(coord, dtype=np.float64) for coord in (x, y, z))
+
     prefactor = get_prefactor(n, l, atomic_number)
 
     r = np.sqrt(x**2 + y**2 + z**2)
@@ -29,15 +79,93 @@ def get_atomic_wavefunction(x, y, z, n, l, m, atomic_number=1, real=False):
     else:
         calc_m = m
 
-    angular_factor = sph_harm_cartesian(x, y, z, l, calc_m, r=r)
-    radial_factor = get_radial_part(n, l, r, atomic_number)
+    if use_solid_harm and l <= SOLID_HARM_MAX_L:
+        angular_factor = solid_harm_cartesian(x, y, z, l, calc_m)
+        radial_factor = get_radial_part(n, l, r, atomic_number,
+                                        include_r_l=False)
+    else:
+        angular_factor = sph_harm_cartesian(x, y, z, l, calc_m, r=r,
+                                            use_recurrence=True)
+        radial_factor = get_radial_part(n, l, r, atomic_number)
 
     psi = prefactor * radial_factor * angular_factor
 
     if real:
         if m > 0:
-            psi = np.sqrt(2) * (-1)**m * np.real(psi)
+            psi = 2 ** 0.5 * (-1)**m * np.real(psi)
         elif m < 0:
-            psi = np.sqrt(2) * (-1)**m * np.imag(psi)
+            psi = 2 ** 0.5 * (-1)**m * np.imag(psi)
+
+    if np.iscomplexobj(psi):
+        dtype = np.result_type(dtype, np.complex64)
+    return psi.astype(dtype, copy=False)
+
+
+def get_atomic_wavefunction(x, y, z, n, l, m, atomic_number=1, real=False,
+                            use_solid_harm=True, chunk_size=None):
+    shape = np.broadcast_shapes(np.shape(x), np.shape(y), np.shape(z))
+    if (chunk_size is None and len(shape) > 0
+            and np.result_type(x, y, z, np.float32) != np.float64):
+        # Single precision inputs are evaluated in double precision, in
+        # slabs of about _DOUBLE_SLAB_PTS points so that the double
+        # precision temporaries stay small next to the output.
+        chunk_size = max(1, _DOUBLE_SLAB_PTS // math.prod(shape[1:]))
+    if chunk_size is None:
+        return get_atomic_wavefunction_slab(x, y, z, n, l, m,
+                                            atomic_number=atomic_number,
+                                            real=real,
+                                            use_solid_harm=use_solid_harm)
+
+    # Evaluate slabs of chunk_size along the first axis into a preallocated
+    # output so only one slab of temporaries is alive.
+    x, y, z = np.broadcast_arrays(x, y, z)
+    psi = None
+    for slab in get_slab_slices(shape[0], chunk_size):
+        psi_slab = get_atomic_wavefunction_slab(x[slab], y[slab], z[slab],
+                                                n, l, m,
+                                                atomic_number=atomic_number,
+                                                real=real,
+                                                use_solid_harm=use_solid_harm)
+        if psi is None:
+            psi = np.empty(shape, dtype=psi_slab.dtype)
+        psi[slab] = psi_slab
+    return psi
+
+
+def get_atomic_wavefunction_separable(r_1d, theta_1d, phi_1d, n, l, m,  # noqa
+                                      atomic_number=1, real=False,
+                                      dtype=np.float64):
+    # On a tensor-product spherical grid psi = R(r) * P(cos(theta)) * Phi(phi)
+    # so each factor is evaluated on its 1D axis and the 3D field is formed
+    # by broadcasting. The 1D factors are computed in double precision and
+    # only the 3D product uses dtype.
+    prefactor = get_prefactor(n, l, atomic_number)
+
+    if real:
+        calc_m = abs(m)
+    else:
+        calc_m = m
+
+    radial_factor = get_radial_part(n, l, r_1d, atomic_number)
+    polar_factor = np.real(sph_harm_recurrence(np.sin(theta_1d),
+                                               np.zeros_like(theta_1d),
+                                               np.cos(theta_1d),
+                                               l, calc_m,
+                                               r=np.ones_like(theta_1d)))
+    if real and m > 0:
+        azimuthal_factor = np.sqrt(2) * (-1)**m * np.cos(m * phi_1d)
+    elif real and m < 0:
+        azimuthal_factor = np.sqrt(2) * (-1)**m * np.sin(-m * phi_1d)
+    else:
+        azimuthal_factor = np.exp(1j * calc_m * phi_1d)
+        dtype = np.result_type(dtype, np.complex64)
+
+    radial_factor = (prefactor * radial_factor).astype(dtype)
+    polar_factor = polar_factor.astype(dtype)
+    azimuthal_factor = azimuthal_factor.astype(dtype)
+
+    psi = (radial_factor[:, np.newaxis, np.newaxis]
+           * polar_factor[np.newaxis, :, np.newaxis]
+           * azimuthal_factor[np.newaxis, np.newaxis, :])
 
     return psi
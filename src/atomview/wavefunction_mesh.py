@@ -2,94 +2,1083 @@ from warnings import warn
 
 import numpy as np
 import pyvista as pv
+from scipy.ndimage import binary_dilation
 
-from atomview.utils import complex_to_rgba
-from atomview.wavefunction_calc import get_atomic_wavefunction
+from atomview.disk_cache import get_cache_key
+from atomview.utils import (
+    complex_to_rgba_lut, get_scaled_mag, get_slab_slices)
+from atomview.wavefunction_calc import (
+    get_atomic_wavefunction, get_atomic_wavefunction_separable)
 
 
-def get_psi_squared_threshold_val(psi_squared, dv, prob_enclosed_list):
+# Histogram bins for get_psi_squared_threshold_val. Each bin spans 1/8 of
+# an octave and the fixed range covers every positive float64 value, with
+# one extra bin for zeros. Bin indices fit in int16.
+_MAX_BIN = 8 * np.finfo(np.float64).maxexp + 15
+_ZERO_BIN = 8 * (np.finfo(np.float64).minexp
+                 - np.finfo(np.float64).nmant - 1) + 7
+_NUM_BINS = _MAX_BIN - _ZERO_BIN + 1
 
-    sort_index = np.argsort(psi_squared.ravel())[::-1]
 
-    sorted_psi_squared = psi_squared.ravel()[sort_index]
-    sorted_dv = dv.ravel()[sort_index]
-    sorted_prob = sorted_dv * sorted_psi_squared
-    integrated_prob = np.cumsum(sorted_prob)
-    psi_squared_thresh_list = []
+# Corner offsets of a grid cell in VTK hexahedron order.
+_HEX_CORNERS = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                         [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]])
+
+
+# Points of the 3x3x3 lattice of a cell split in two along each axis, in
+# units of the child cell size, and their positions in that list for the
+# parent cell corners, the other points and the corners of each child.
+_SUB_POINTS = np.array([[i, j, k]
+                        for i in range(3) for j in range(3) for k in range(3)])
+_CORNER_SUB_POINTS = np.array([9 * i + 3 * j + k
+                               for i, j, k in 2 * _HEX_CORNERS])
+_NEW_SUB_POINTS = np.setdiff1d(np.arange(27), _CORNER_SUB_POINTS)
+_CHILD_CORNER_SUB_POINTS = np.array([[9 * i + 3 * j + k
+                                      for i, j, k in child + _HEX_CORNERS]
+                                     for child in _HEX_CORNERS])
+
+
+def get_spherical_axes(n, num_pts):
+    span = (1.5 * n) ** 2
+    r_1d = np.sinh(np.linspace(0, np.arcsinh(span), num_pts))
+    theta_1d = np.linspace(0, np.pi, num_pts, endpoint=True)
+    phi_1d = np.linspace(0, 2 * np.pi, num_pts, endpoint=True)
+    return r_1d, theta_1d, phi_1d
+
+
+def get_clip_mask(theta, phi):
+    return (phi > 0) & (phi < np.pi/2) & (theta < np.pi/2)
+
+
+def get_ghost_clip_mask(theta, phi):
+    return (phi > 0) & (phi > np.pi / 2) & (theta > np.pi / 2)
+
+
+def get_straddling_cells(min_vals, max_vals, iso_list):
+    # Cells whose corner values span any of the isovalues.
+    straddling = np.zeros(np.shape(min_vals), dtype=bool)
+    for iso in iso_list:
+        straddling |= (min_vals < iso) & (max_vals >= iso)
+    return straddling
+
+
+def get_spherical_trig(r_1d, theta_1d, phi_1d):
+    return (r_1d, np.sin(theta_1d), np.cos(theta_1d),
+            np.sin(phi_1d), np.cos(phi_1d))
+
+
+def get_spherical_points(trig, r_idx, theta_idx, phi_idx):
+    # Cartesian coordinates of spherical grid points given by their indices.
+    # trig is from get_spherical_trig.
+    r_1d, sin_theta, cos_theta, sin_phi, cos_phi = trig
+    r = r_1d[r_idx]
+    r_sin_theta = r * sin_theta[theta_idx]
+    return np.stack([r_sin_theta * cos_phi[phi_idx],
+                     r_sin_theta * sin_phi[phi_idx],
+                     r * cos_theta[theta_idx]], axis=-1)
+
+
+def contour_index_space(scalars, iso_list, origin=(0, 0, 0)):
+    # Marching cubes on the lattice of point indices rather than on the grid
+    # points. scalars is indexed [i, j, k] and origin is the lattice index
+    # of scalars[0, 0, 0], so a block of a larger lattice can be contoured
+    # on its own. Returns the contour as a surface tuple:
+    # triangles: (T, 3) vertex indices.
+    # edge_idx_0, edge_idx_1: (V, 3) lattice indices of the ends of the
+    #     edge each vertex lies on.
+    # t: (V,) position of each vertex along its edge, so that point data
+    #     can be interpolated onto the vertices exactly as a contour filter
+    #     on the grid would.
+    # iso_vals: (V,) isovalue of each vertex.
+    # tri_cells: (T, 3) lattice index of the cell holding each triangle.
+    shape = scalars.shape
+    scalars_flat = np.ravel(scalars, order='F')
+    image = pv.ImageData(dimensions=shape)
+    image.point_data['scalars'] = scalars_flat
+    contour = image.contour(iso_list, scalars='scalars',
+                            method='flying_edges')
+    if contour.n_points == 0:
+        empty_idx = np.empty((0, 3), dtype=np.int64)
+        return (empty_idx, empty_idx, empty_idx, np.empty(0),
+                np.empty(0, dtype=scalars.dtype), empty_idx)
+
+    # Each vertex lies on a lattice edge, so its coordinates are fractional
+    # in at most one index. The output points are single precision, so t is
+    # recomputed from the scalars.
+    coords = np.asarray(contour.points, dtype=np.float64)
+    iso_vals = contour['scalars']
+    strides = np.array([1, shape[0], shape[0] * shape[1]])
+    rounded_idx = np.rint(coords).astype(np.int64)
+    rounding_err = np.abs(coords - rounded_idx)
+    edge_axis = np.argmax(rounding_err, axis=1)
+    vert_range = np.arange(len(coords))
+    edge_idx_0 = rounded_idx.copy()
+    edge_idx_0[vert_range, edge_axis] = np.floor(
+        coords[vert_range, edge_axis])
+
+    # Vertices within rounding of a lattice point don't show which edge
+    # they lie on. For those both edges through the lattice point along
+    # each axis are tried and the one whose crossing best matches the
+    # vertex is kept. Should several edges fit equally well the vertex is
+    # still placed to within that rounding.
+    near = np.flatnonzero(rounding_err.max(axis=1) < 1e-3)
+    near_idx = rounded_idx[near]
+    near_flat_idx = near_idx @ strides
+    best_err = np.full(len(near), np.inf)
+    for axis in range(3):
+        for offset in (-1, 0):
+            in_bounds = ((near_idx[:, axis] + offset >= 0)
+                         & (near_idx[:, axis] + offset + 1 < shape[axis]))
+            edge_flat_idx_0 = np.where(
+                in_bounds, near_flat_idx + offset * strides[axis], 0)
+            edge_flat_idx_1 = np.where(
+                in_bounds, edge_flat_idx_0 + strides[axis], 0)
+            scalars_0 = scalars_flat[edge_flat_idx_0]
+            delta = scalars_flat[edge_flat_idx_1] - scalars_0
+            edge_t = np.divide(iso_vals[near] - scalars_0, delta,
+                               where=(delta != 0),
+                               out=np.full_like(delta, np.nan))
+            err = np.abs(offset + edge_t - (coords[near, axis]
+                                            - near_idx[:, axis]))
+            better = (in_bounds & (edge_t >= 0) & (edge_t <= 1)
+                      & (err < best_err))
+            best_err[better] = err[better]
+            better_near = near[better]
+            edge_idx_0[better_near] = near_idx[better]
+            edge_idx_0[better_near, axis] += offset
+            edge_axis[better_near] = axis
+
+    edge_idx_1 = edge_idx_0.copy()
+    edge_idx_1[vert_range, edge_axis] += 1
+    scalars_0 = scalars_flat[edge_idx_0 @ strides]
+    delta = scalars_flat[edge_idx_1 @ strides] - scalars_0
+    t = np.divide(iso_vals - scalars_0, delta,
+                  where=(delta != 0), out=np.zeros_like(delta))
+
+    # A triangle lies in the cell it was generated in and not within one
+    # of its faces, so its cell is the least of its vertices' floors.
+    triangles = contour.faces.reshape(-1, 4)[:, 1:]
+    vertex_floors = np.floor(coords).astype(np.int32)
+    tri_cells = np.minimum(
+        np.minimum(vertex_floors[triangles[:, 0]],
+                   vertex_floors[triangles[:, 1]]),
+        vertex_floors[triangles[:, 2]])
+    tri_cells = np.minimum(tri_cells, np.array(shape) - 2)
+    origin = np.asarray(origin)
+    return (triangles, edge_idx_0 + origin, edge_idx_1 + origin,
+            np.clip(t, 0, 1), iso_vals, tri_cells + origin)
+
+
+def select_triangles(surface, keep):
+    # Keep the triangles where keep is set and drop unused vertices.
+    triangles, *vertex_arrays, tri_cells = surface
+    triangles = triangles[keep]
+    used = np.zeros(len(vertex_arrays[0]), dtype=bool)
+    used[triangles] = True
+    new_idx = np.cumsum(used) - 1
+    return (new_idx[triangles], *(arr[used] for arr in vertex_arrays),
+            tri_cells[keep])
+
+
+def merge_surfaces(surface, block_surface, shape, iso_list):
+    # Join a surface with one contoured from a block of the same lattice of
+    # the given shape. Vertices of the block surface on the same edge and
+    # at the same isovalue as a vertex of surface are merged into it.
+    if len(block_surface[0]) == 0:
+        return surface
+    iso_list = np.unique(iso_list)
+
+    def get_vertex_keys(edge_idx_0, edge_idx_1, iso_vals):
+        flat_idx_0 = np.ravel_multi_index(tuple(edge_idx_0.T), shape,
+                                          order='F')
+        edge_axis = np.argmax(edge_idx_1 - edge_idx_0, axis=1)
+        iso_idx = np.searchsorted(iso_list, iso_vals)
+        return (flat_idx_0 * 3 + edge_axis) * len(iso_list) + iso_idx
+
+    triangles, edge_idx_0, edge_idx_1, t, iso_vals, tri_cells = surface
+    (block_triangles, block_edge_idx_0, block_edge_idx_1, block_t,
+     block_iso_vals, block_tri_cells) = block_surface
+    block_keys = get_vertex_keys(block_edge_idx_0, block_edge_idx_1,
+                                 block_iso_vals)
+    block_key_order = np.argsort(block_keys)
+    sorted_block_keys = block_keys[block_key_order]
+
+    # Only vertices of surface within the block can be shared.
+    block_min = block_edge_idx_0.min(axis=0, initial=np.iinfo(np.int64).max)
+    block_max = block_edge_idx_1.max(axis=0, initial=-1)
+    candidates = np.flatnonzero(np.all((edge_idx_0 >= block_min)
+                                       & (edge_idx_1 <= block_max), axis=1))
+    candidate_keys = get_vertex_keys(edge_idx_0[candidates],
+                                     edge_idx_1[candidates],
+                                     iso_vals[candidates])
+    pos = np.minimum(np.searchsorted(sorted_block_keys, candidate_keys),
+                     len(sorted_block_keys) - 1)
+    shared = sorted_block_keys[pos] == candidate_keys
+
+    block_vertex_idx = np.full(len(block_keys), -1, dtype=np.int64)
+    block_vertex_idx[block_key_order[pos[shared]]] = candidates[shared]
+    new_vertices = block_vertex_idx < 0
+    block_vertex_idx[new_vertices] = len(t) + np.arange(
+        np.count_nonzero(new_vertices))
+    return (np.concatenate([triangles, block_vertex_idx[block_triangles]]),
+            np.concatenate([edge_idx_0, block_edge_idx_0[new_vertices]]),
+            np.concatenate([edge_idx_1, block_edge_idx_1[new_vertices]]),
+            np.concatenate([t, block_t[new_vertices]]),
+            np.concatenate([iso_vals, block_iso_vals[new_vertices]]),
+            np.concatenate([tri_cells, block_tri_cells]))
+
+
+def decimate_mesh(mesh, max_triangles):
+    # Decimation only removes vertices, so the remaining ones keep their
+    # point data, e.g. rgba, unchanged. max_triangles is a target, with
+    # preserve_topology it is not always reached.
+    if mesh.n_cells <= max_triangles:
+        return mesh
+    return mesh.decimate_pro(1 - max_triangles / mesh.n_cells,
+                             preserve_topology=True)
+
+
+def get_lod_meshes(mesh, lod_max_triangles):
+    # Levels of detail of a triangle mesh, finest first, one per triangle
+    # budget that the mesh exceeds. Each level is decimated from the
+    # previous one.
+    lod_meshes = []
+    for max_triangles in sorted(lod_max_triangles, reverse=True):
+        if max_triangles >= mesh.n_cells:
+            continue
+        mesh = decimate_mesh(mesh, max_triangles)
+        lod_meshes.append(mesh)
+    return tuple(lod_meshes)
+
+
+def get_psi_squared_bin_idx(psi_squared):
+    # Bin 0 holds the largest values.
+    mantissa, exponent = np.frexp(psi_squared)
+    bin_idx = 8 * exponent + np.floor(16 * mantissa).astype(exponent.dtype)
+    bin_idx[psi_squared == 0] = _ZERO_BIN
+    return (_MAX_BIN - bin_idx).astype(np.int16)
+
+
+def get_psi_squared_threshold_val(psi_squared, dv, prob_enclosed_list,
+                                  chunk_size=None):
+    # Find, for each requested probability, the largest psi_squared
+    # threshold such that the points with psi_squared at or above it enclose
+    # the requested probability. Rather than sorting every point, the points
+    # are histogrammed into bins of 1/8 octave in psi_squared (using the
+    # binary exponent and leading mantissa bits), the bin containing each
+    # threshold is located from the cumulative bin probabilities, and only
+    # the points in that bin are sorted. The result is the same point value
+    # as a full sort would give, up to floating point summation order.
+    # dv only needs to broadcast against psi_squared. Work is done in slabs
+    # of chunk_size along the last axis.
+    psi_squared = np.asarray(psi_squared)
+    dv = np.broadcast_to(dv, psi_squared.shape)
+    slab_slices = get_slab_slices(psi_squared.shape[-1], chunk_size)
+
+    bin_idx_list = []
+    bin_count = np.zeros(_NUM_BINS, dtype=int)
+    bin_prob = np.zeros(_NUM_BINS)
+    for slab in slab_slices:
+        slab_psi_squared = psi_squared[..., slab]
+        slab_bin_idx = get_psi_squared_bin_idx(slab_psi_squared).ravel()
+        bin_idx_list.append(slab_bin_idx)
+        bin_count += np.bincount(slab_bin_idx, minlength=_NUM_BINS)
+        bin_prob += np.bincount(
+            slab_bin_idx,
+            weights=(dv[..., slab] * slab_psi_squared).ravel(),
+            minlength=_NUM_BINS)
+    occupied_bins = np.flatnonzero(bin_count)
+    integrated_bin_prob = np.cumsum(bin_prob[occupied_bins])
+    total_prob = integrated_bin_prob[-1]
+
+    # Locate the bin of each threshold, then gather the points of all these
+    # bins in one pass over the slabs.
+    thresh_bin_list = []
     for prob_enclosed in prob_enclosed_list:
-        idx = np.searchsorted(integrated_prob, prob_enclosed)
-        if idx >= len(sorted_psi_squared):
+        if prob_enclosed > total_prob:
             warn(f'Requested enclosed probability ({prob_enclosed:.2f}) is '
                  f'greater than the total enclosed probability '
-                 f'({integrated_prob[-1]:.2f}).')
-            idx = len(sorted_psi_squared) - 1
-        psi_squared_threshold = sorted_psi_squared[idx]
-        psi_squared_thresh_list.append(psi_squared_threshold)
+                 f'({total_prob:.2f}).')
+            thresh_bin_list.append(None)
+            continue
+        occupied_idx = min(np.searchsorted(integrated_bin_prob, prob_enclosed),
+                           len(occupied_bins) - 1)
+        if occupied_idx > 0:
+            prob_above = integrated_bin_prob[occupied_idx - 1]
+        else:
+            prob_above = 0
+        thresh_bin_list.append((occupied_bins[occupied_idx], prob_above))
+
+    is_thresh_bin = np.zeros(_NUM_BINS, dtype=bool)
+    for thresh_bin in thresh_bin_list:
+        if thresh_bin is not None:
+            is_thresh_bin[thresh_bin[0]] = True
+    thresh_bin_idx_list = []
+    bin_psi_squared_list = []
+    bin_prob_list = []
+    if np.any(is_thresh_bin):
+        for slab, slab_bin_idx in zip(slab_slices, bin_idx_list):
+            slab_psi_squared = psi_squared[..., slab].ravel()
+            bin_mask = is_thresh_bin[slab_bin_idx]
+            thresh_bin_idx_list.append(slab_bin_idx[bin_mask])
+            bin_psi_squared_list.append(slab_psi_squared[bin_mask])
+            bin_prob_list.append(dv[..., slab].ravel()[bin_mask]
+                                 * slab_psi_squared[bin_mask])
+        gathered_bin_idx = np.concatenate(thresh_bin_idx_list)
+        gathered_psi_squared = np.concatenate(bin_psi_squared_list)
+        gathered_prob = np.concatenate(bin_prob_list)
+
+    # Each bin is sorted once, however many thresholds fall in it.
+    sorted_bins = dict()
+    psi_squared_thresh_list = []
+    for prob_enclosed, thresh_bin in zip(prob_enclosed_list,
+                                         thresh_bin_list):
+        if thresh_bin is None:
+            psi_squared_thresh_list.append(np.min(psi_squared))
+            continue
+        thresh_bin, prob_above = thresh_bin
+        if thresh_bin not in sorted_bins:
+            bin_mask = gathered_bin_idx == thresh_bin
+            bin_psi_squared = gathered_psi_squared[bin_mask]
+            sort_index = np.argsort(bin_psi_squared)[::-1]
+            sorted_bins[thresh_bin] = (bin_psi_squared[sort_index],
+                                       gathered_prob[bin_mask][sort_index])
+        sorted_psi_squared, sorted_prob = sorted_bins[thresh_bin]
+        integrated_prob = prob_above + np.cumsum(sorted_prob,
+                                                 dtype=np.float64)
+
+        idx = min(np.searchsorted(integrated_prob, prob_enclosed),
+                  len(sorted_psi_squared) - 1)
+        psi_squared_thresh_list.append(sorted_psi_squared[idx])
     return psi_squared_thresh_list
 
 
-def get_wavefunction_prob_contour_mesh(n, l, m, real=False,  # noqa
-                                       num_pts=50,
-                                       prob_threshold_list=(0.6,),
-                                       mag_maps_to='',
-                                       clip=False,
-                                       clip_ghost=False,
-                                       ghost_opacity=0.2):
-    span = (1.5 * n) ** 2
+class MeshPipelineCancelled(Exception):
+    pass
 
-    r_1d = np.sinh(np.linspace(0, np.arcsinh(span), num_pts))
-    theta_1d = np.linspace(0, np.pi, num_pts, endpoint=True)
-    phi_1d = np.linspace(0, 2 * np.pi, num_pts, endpoint=True)
 
-    r, theta, phi = np.meshgrid(r_1d, theta_1d, phi_1d, indexing='ij')
+class MeshPipeline:
+    """
+    Mesh generation split into stages whose outputs are memoized. Each
+    stage lists the parameters its output depends on, including those of
+    the stages upstream of it, and is only recomputed when one of those
+    parameters has changed since its output was last computed.
+
+    If is_cancelled is set to a callable it is checked before each stage is
+    computed and MeshPipelineCancelled is raised if it returns True. Stages
+    completed before cancellation stay memoized.
+
+    If disk_cache is set to an atomview.disk_cache.DiskCache the outputs of
+    the stages in persistent_stages are also stored there and loaded from
+    there instead of being recomputed, e.g. in a later session.
+    """
+    default_params = dict()
+    stage_params = dict()
+    persistent_stages = ()
+    # The stage whose output get_mesh returns.
+    mesh_stage = None
+
+    def __init__(self, **params):
+        self.params = dict(self.default_params)
+        self.stage_outputs = dict()
+        self.is_cancelled = None
+        self.disk_cache = None
+        self.set_params(**params)
+
+    def set_params(self, **params):
+        for name, value in params.items():
+            if name not in self.default_params:
+                raise TypeError(f'Unknown parameter \'{name}\'.')
+            if name == 'dtype':
+                value = np.dtype(value)
+            elif isinstance(value, list):
+                value = tuple(value)
+            self.params[name] = value
 
-    x = r * np.sin(theta) * np.cos(phi)
-    y = r * np.sin(theta) * np.sin(phi)
-    z = r * np.cos(theta)
-    dv = (r**2 * np.sin(theta)
-          * np.gradient(r, axis=0)
-          * np.gradient(theta, axis=1)
-          * np.gradient(phi, axis=2))
+    def get_stage_key(self, stage):
+        return tuple(self.params[name] for name in self.stage_params[stage])
 
-    psi = get_atomic_wavefunction(x, y, z, n, l, m, real=real)
-    psi_squared = np.abs(psi) ** 2
+    def get_disk_key(self, stage):
+        return get_cache_key(type(self).__name__, stage,
+                             dict(zip(self.stage_params[stage],
+                                      self.get_stage_key(stage))))
 
-    psi_squared_thresh_list = get_psi_squared_threshold_val(
-        psi_squared, dv, prob_threshold_list)
+    def has_stage_output(self, stage):
+        # Whether the stage output is available without computing it.
+        key = self.get_stage_key(stage)
+        if stage in self.stage_outputs and self.stage_outputs[stage][0] == key:
+            return True
+        return (self.disk_cache is not None
+                and stage in self.persistent_stages
+                and self.get_disk_key(stage) in self.disk_cache)
 
-    rgba = complex_to_rgba(
-        psi,
-        mag_maps_to=mag_maps_to
+    def get_stage_output(self, stage, compute_func):
+        key = self.get_stage_key(stage)
+        if stage in self.stage_outputs:
+            cached_key, output = self.stage_outputs[stage]
+            if cached_key == key:
+                return output
+
+        disk_key = None
+        if self.disk_cache is not None and stage in self.persistent_stages:
+            disk_key = self.get_disk_key(stage)
+            value = self.disk_cache.get(disk_key)
+            if value is not None:
+                output = self.load_stage(stage, value)
+                self.stage_outputs[stage] = (key, output)
+                return output
+
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise MeshPipelineCancelled
+        output = compute_func()
+        self.stage_outputs[stage] = (key, output)
+        if disk_key is not None:
+            self.disk_cache.put(disk_key, self.dump_stage(stage, output))
+        return output
+
+    def dump_stage(self, stage, output):
+        # Convert a stage output to a mesh, tuple of meshes or dict of arrays
+        # for the disk cache.
+        return output
+
+    def load_stage(self, stage, value):
+        return value
+
+    def clear(self):
+        self.stage_outputs.clear()
+
+
+class ContourMeshPipeline(MeshPipeline):
+    default_params = dict(
+        n=1, l=0, m=0, real=False,
+        num_pts=50,
+        prob_threshold_list=(0.6,),
+        mag_maps_to='',
+        clip=False,
+        clip_ghost=False,
+        ghost_opacity=0.2,
+        separable=True,
+        dtype=np.dtype(np.float64),
+        chunk_size=None,
+        refine_levels=0,
+        color_mode='grid',
+        lod_max_triangles=(),
+    )
+    _grid_params = ('n', 'num_pts', 'dtype')
+    _field_params = _grid_params + ('l', 'm', 'real', 'separable')
+    _threshold_params = _field_params + ('prob_threshold_list',)
+    _color_params = _field_params + ('mag_maps_to',)
+    _contour_params = (_threshold_params + _color_params
+                       + ('clip', 'clip_ghost', 'ghost_opacity',
+                          'refine_levels', 'color_mode'))
+    stage_params = dict(
+        grid=_grid_params,
+        field=_field_params,
+        threshold=_threshold_params,
+        color=_color_params,
+        surface=_threshold_params,
+        contour=_contour_params,
+        lod=_contour_params + ('lod_max_triangles',),
     )
+    persistent_stages = ('field', 'contour')
+    mesh_stage = 'contour'
+
+    def get_grid(self):
+        return self.get_stage_output('grid', self.compute_grid)
+
+    def get_field(self):
+        return self.get_stage_output('field', self.compute_field)
+
+    def get_thresholds(self):
+        return self.get_stage_output('threshold', self.compute_thresholds)
+
+    def get_rgba(self):
+        return self.get_stage_output('color', self.compute_rgba)
+
+    def get_surface(self):
+        return self.get_stage_output('surface', self.compute_surface)
+
+    def get_mesh(self):
+        return self.get_stage_output('contour', self.compute_contour)
+
+    def get_lod_meshes(self):
+        return self.get_stage_output('lod', self.compute_lod_meshes)
+
+    def dump_stage(self, stage, output):
+        if stage == 'field':
+            psi, psi_squared_flat, _ = output
+            arrays = {'psi_squared': psi_squared_flat}
+            if psi is not None:
+                arrays['psi'] = psi
+            return arrays
+        return output
+
+    def load_stage(self, stage, value):
+        if stage == 'field':
+            num_pts = self.params['num_pts']
+            psi_squared_flat = value['psi_squared']
+            psi_squared = psi_squared_flat.reshape(
+                (num_pts, num_pts, num_pts)).T
+            return value.get('psi'), psi_squared_flat, psi_squared
+        return value
+
+    def compute_grid(self):
+        num_pts = self.params['num_pts']
+        dtype = self.params['dtype']
 
-    mesh = pv.StructuredGrid(x, y, z)
-    mesh['psi_squared'] = psi_squared.ravel(order='F')
-    mesh['rgba'] = rgba.reshape(psi.size, 4, order='F')
+        r_1d, theta_1d, phi_1d = get_spherical_axes(self.params['n'], num_pts)
 
-    if clip:
-        clip_mask = ((phi > 0)
-                     & (phi < np.pi/2)
-                     & (theta < np.pi/2)).ravel(order='F')
+        r = r_1d.astype(dtype)[:, np.newaxis, np.newaxis]
+        theta = theta_1d.astype(dtype)[np.newaxis, :, np.newaxis]
+        phi = phi_1d.astype(dtype)[np.newaxis, np.newaxis, :]
 
-        mesh['psi_squared'][clip_mask] = 0
+        dr = np.gradient(r, axis=0)
+        dtheta = np.gradient(theta, axis=1)
+        # The phi grid is uniform so dv is only stored on the (r, theta)
+        # plane.
+        dphi = 2 * np.pi / (num_pts - 1)
+        dv = (r**2 * dr) * (np.sin(theta) * dtheta) * dphi
 
-    contour_mesh = mesh.contour(psi_squared_thresh_list,
-                                scalars='psi_squared')
+        # The grid points themselves are never stored. The contour is
+        # extracted in index space and only its vertices are mapped to
+        # Cartesian coordinates, see contour_index_space.
+        return r_1d, theta_1d, phi_1d, theta, phi, dv
 
-    if clip and clip_ghost:
-        ghost_clip_mask = ((phi > 0)
-                           & (phi > np.pi / 2)
-                           & (theta > np.pi / 2)).ravel(order='F')
+    def get_psi_slab(self, slab):
+        r_1d, theta_1d, phi_1d, theta, phi, _ = self.get_grid()
+        n, l, m = self.params['n'], self.params['l'], self.params['m']  # noqa
+        real = self.params['real']
+        dtype = self.params['dtype']
+        if self.params['separable']:
+            return get_atomic_wavefunction_separable(r_1d, theta_1d,
+                                                     phi_1d[slab],
+                                                     n, l, m, real=real,
+                                                     dtype=dtype)
+        else:
+            r = r_1d.astype(dtype)[:, np.newaxis, np.newaxis]
+            phi_slab = phi[:, :, slab]
+            x, y, z = np.broadcast_arrays(
+                r * (np.sin(theta) * np.cos(phi_slab)),
+                r * (np.sin(theta) * np.sin(phi_slab)),
+                r * np.cos(theta))
+            return get_atomic_wavefunction(x, y, z, n, l, m, real=real)
 
-        ghost_mesh = mesh.copy()
-        ghost_mesh['psi_squared'][ghost_clip_mask] = 0
-        ghost_mesh['rgba'][:, 3] = ghost_opacity
-        ghost_contour_mesh = ghost_mesh.contour(psi_squared_thresh_list,
-                                                scalars='psi_squared')
+    def compute_field(self):
+        num_pts = self.params['num_pts']
+        chunk_size = self.params['chunk_size']
 
+        # Output buffers are in VTK point order (r index fastest). The
+        # views index them as [r, theta, phi] so that each phi slab is a
+        # contiguous block of the buffer.
+        shape = (num_pts, num_pts, num_pts)
+        psi_squared_flat = np.empty(num_pts ** 3, dtype=self.params['dtype'])
+        psi_squared = psi_squared_flat.reshape(shape).T
+
+        # psi itself is only kept when the grid is evaluated in one slab.
+        # Otherwise the colour stage re-evaluates it slab by slab.
+        psi = None
+        slab_slices = get_slab_slices(num_pts, chunk_size)
+        for slab in slab_slices:
+            psi_slab = self.get_psi_slab(slab)
+            psi_squared[:, :, slab] = np.abs(psi_slab) ** 2
+            if len(slab_slices) == 1:
+                psi = psi_slab
+
+        return psi, psi_squared_flat, psi_squared
+
+    def compute_thresholds(self):
+        dv = self.get_grid()[5]
+        psi_squared = self.get_field()[2]
+        return get_psi_squared_threshold_val(
+            psi_squared, dv, self.params['prob_threshold_list'],
+            chunk_size=self.params['chunk_size'])
+
+    def get_mag_range(self):
+        # Colours are scaled by the magnitude range of the whole grid.
+        psi_squared = self.get_field()[2]
+        return np.sqrt(np.min(psi_squared)), np.sqrt(np.max(psi_squared))
+
+    def compute_rgba(self):
+        num_pts = self.params['num_pts']
+        psi = self.get_field()[0]
+
+        shape = (num_pts, num_pts, num_pts)
+        rgba_flat = np.empty((num_pts ** 3, 4), dtype=self.params['dtype'])
+        rgba = rgba_flat.reshape(shape + (4,)).transpose(2, 1, 0, 3)
+
+        mag_range = self.get_mag_range()
+        for slab in get_slab_slices(num_pts, self.params['chunk_size']):
+            if psi is None:
+                psi_slab = self.get_psi_slab(slab)
+            else:
+                psi_slab = psi[:, :, slab]
+            complex_to_rgba_lut(
+                psi_slab,
+                mag_maps_to=self.params['mag_maps_to'],
+                mag_range=mag_range,
+                out=rgba[:, :, slab]
+            )
+
+        return rgba_flat
+
+    def compute_surface(self):
+        # Contour of the unclipped field, see contour_index_space. Clipping
+        # only recontours the cells it changes, see clip_surface.
+        return contour_index_space(self.get_field()[2],
+                                   self.get_thresholds())
+
+    def clip_surface(self, surface, clip_mask, prev_clip_mask=None):
+        # Surface of the field zeroed where the (theta, phi) mask clip_mask
+        # is set, given the surface of the field zeroed where prev_clip_mask
+        # is set, which clip_mask must include. Only the cells with a corner
+        # that is newly zeroed are contoured again, from a block of the
+        # field just covering them. The other triangles are kept.
+        psi_squared = self.get_field()[2]
+        if prev_clip_mask is None:
+            changed = clip_mask
+        else:
+            changed = clip_mask & ~prev_clip_mask
+        changed_cells = (changed[:-1, :-1] | changed[1:, :-1]
+                         | changed[:-1, 1:] | changed[1:, 1:])
+        if not changed_cells.any():
+            return surface
+
+        theta_cells = np.flatnonzero(changed_cells.any(axis=1))
+        phi_cells = np.flatnonzero(changed_cells.any(axis=0))
+        theta_slice = slice(theta_cells[0], theta_cells[-1] + 2)
+        phi_slice = slice(phi_cells[0], phi_cells[-1] + 2)
+        block = psi_squared[:, theta_slice, phi_slice].copy(order='F')
+        block[:, clip_mask[theta_slice, phi_slice]] = 0
+        block_surface = contour_index_space(
+            block, self.get_thresholds(),
+            origin=(0, theta_slice.start, phi_slice.start))
+
+        tri_cells = surface[5]
+        block_tri_cells = block_surface[5]
+        return merge_surfaces(
+            select_triangles(
+                surface, ~changed_cells[tri_cells[:, 1], tri_cells[:, 2]]),
+            select_triangles(
+                block_surface, changed_cells[block_tri_cells[:, 1],
+                                             block_tri_cells[:, 2]]),
+            psi_squared.shape, self.get_thresholds())
+
+    def get_surface_mesh(self, surface):
+        # color_mode selects how the vertices are coloured: 'grid'
+        # interpolates the colours of the whole grid (the color stage),
+        # 'interpolate' interpolates psi along the edge of each vertex and
+        # 'exact' evaluates psi at each vertex. The last two only colour the
+        # vertices.
+        triangles, edge_idx_0, edge_idx_1, t, iso_vals, _ = surface
+        if len(triangles) == 0:
+            return pv.PolyData()
+        r_1d, theta_1d, phi_1d = self.get_grid()[:3]
+        dtype = self.params['dtype']
+        trig = get_spherical_trig(*(axis.astype(dtype)
+                                    for axis in (r_1d, theta_1d, phi_1d)))
+
+        t = t.astype(dtype)[:, np.newaxis]
+        faces = np.empty((len(triangles), 4), dtype=np.int64)
+        faces[:, 0] = 3
+        faces[:, 1:] = triangles
+        points = ((1 - t) * get_spherical_points(trig, *edge_idx_0.T)
+                  + t * get_spherical_points(trig, *edge_idx_1.T))
+        mesh = pv.PolyData(points, faces=faces.ravel())
+
+        color_mode = self.params['color_mode']
+        if color_mode == 'grid':
+            rgba_flat = self.get_rgba()
+            shape = (len(r_1d),) * 3
+            flat_idx_0 = np.ravel_multi_index(tuple(edge_idx_0.T), shape,
+                                              order='F')
+            flat_idx_1 = np.ravel_multi_index(tuple(edge_idx_1.T), shape,
+                                              order='F')
+            mesh['rgba'] = ((1 - t) * rgba_flat[flat_idx_0]
+                            + t * rgba_flat[flat_idx_1])
+        else:
+            if color_mode == 'exact':
+                vertex_psi = get_atomic_wavefunction(
+                    *points.T, self.params['n'], self.params['l'],
+                    self.params['m'], real=self.params['real'])
+            elif color_mode == 'interpolate':
+                vertex_psi = ((1 - t[:, 0]) * self.get_lattice_psi(edge_idx_0,
+                                                                   trig)
+                              + t[:, 0] * self.get_lattice_psi(edge_idx_1,
+                                                               trig))
+            else:
+                raise ValueError(f'Unknown color_mode \'{color_mode}\'.')
+            mesh['rgba'] = complex_to_rgba_lut(
+                vertex_psi,
+                mag_maps_to=self.params['mag_maps_to'],
+                mag_range=self.get_mag_range(),
+                out=np.empty((len(vertex_psi), 4), dtype=dtype))
+        mesh['psi_squared'] = iso_vals
+        return mesh
+
+    def get_lattice_psi(self, idx, trig):
+        # psi at the grid points given by their (r, theta, phi) indices,
+        # taken from the field stage when it kept psi.
+        psi = self.get_field()[0]
+        if psi is not None:
+            return psi[tuple(idx.T)]
+        return self.get_fine_psi(idx, trig)
+
+    def compute_contour(self):
+        if self.params['refine_levels'] > 0:
+            return self.compute_adaptive_contour()
+
+        surface = self.get_surface()
+        if not self.params['clip']:
+            return self.get_surface_mesh(surface)
+
+        # The masks are on the (theta, phi) plane.
+        _, _, _, theta, phi, _ = self.get_grid()
+        theta = theta[0]
+        phi = phi[0]
+        clip_mask = get_clip_mask(theta, phi)
+        clipped_surface = self.clip_surface(surface, clip_mask)
+        contour_mesh = self.get_surface_mesh(clipped_surface)
+        if not self.params['clip_ghost']:
+            return contour_mesh
+
+        # The ghost is clipped by both masks.
+        ghost_clip_mask = clip_mask | get_ghost_clip_mask(theta, phi)
+        ghost_contour_mesh = self.get_surface_mesh(
+            self.clip_surface(clipped_surface, ghost_clip_mask, clip_mask))
+        if ghost_contour_mesh.n_points > 0:
+            ghost_contour_mesh['rgba'][:, 3] = self.params['ghost_opacity']
         return contour_mesh, ghost_contour_mesh
-    else:
-        return contour_mesh
+
+    def compute_lod_meshes(self):
+        # Coarser versions of the contour mesh for display while the camera
+        # moves, see get_lod_meshes. A ghost mesh is not decimated.
+        mesh = self.get_mesh()
+        if isinstance(mesh, tuple):
+            mesh = mesh[0]
+        return get_lod_meshes(mesh, self.params['lod_max_triangles'])
+
+    def get_fine_psi(self, fine_idx, fine_trig):
+        # psi at points of the refined grid given by their (r, theta, phi)
+        # indices along the last axis. fine_trig is from get_spherical_trig.
+        r_1d, sin_theta, cos_theta, sin_phi, cos_phi = fine_trig
+        r = r_1d[fine_idx[..., 0]]
+        r_sin_theta = r * sin_theta[fine_idx[..., 1]]
+        x = r_sin_theta * cos_phi[fine_idx[..., 2]]
+        y = r_sin_theta * sin_phi[fine_idx[..., 2]]
+        z = r * cos_theta[fine_idx[..., 1]]
+        return get_atomic_wavefunction(x, y, z, self.params['n'],
+                                       self.params['l'], self.params['m'],
+                                       real=self.params['real'])
+
+    def compute_adaptive_contour(self):
+        # Contour on a grid refined refine_levels times by factors of 2,
+        # evaluating psi only in the cells that straddle an isovalue. See
+        # refine_contour. Only the points of the remaining cells are
+        # coloured, whatever the color_mode.
+        refine_levels = self.params['refine_levels']
+        num_fine_pts = (self.params['num_pts'] - 1) * 2 ** refine_levels + 1
+        r_1d, theta_1d, phi_1d = (
+            axis.astype(self.params['dtype'])
+            for axis in get_spherical_axes(self.params['n'], num_fine_pts))
+        fine_axes = (r_1d, theta_1d, phi_1d)
+        fine_trig = get_spherical_trig(r_1d, theta_1d, phi_1d)
+
+        if not self.params['clip']:
+            return self.refine_contour(fine_axes, fine_trig, None)
+        contour_mesh = self.refine_contour(fine_axes, fine_trig,
+                                           get_clip_mask)
+        if not self.params['clip_ghost']:
+            return contour_mesh
+        # Like the ghost mesh of the regular grid, the ghost is clipped by
+        # both masks.
+        ghost_contour_mesh = self.refine_contour(
+            fine_axes, fine_trig,
+            lambda theta, phi: (get_clip_mask(theta, phi)
+                                | get_ghost_clip_mask(theta, phi)))
+        if ghost_contour_mesh.n_points > 0:
+            ghost_contour_mesh['rgba'][:, 3] = self.params['ghost_opacity']
+        return contour_mesh, ghost_contour_mesh
+
+    def refine_contour(self, fine_axes, fine_trig, clip_mask_func):
+        # Cells of the num_pts grid straddling an isovalue, and their
+        # neighbours, are split into 8 children, children that straddle an
+        # isovalue are split again and so on down to the fine grid. The
+        # remaining fine cells are then contoured as hexahedra. Cells are
+        # tracked by the fine grid index of their first corner together with
+        # psi at their 8 corners, so splitting a cell only evaluates the 19
+        # new points of its 3x3x3 sub-lattice. Per cell values are stored
+        # with the cell index last so reductions over corners are
+        # contiguous. Surface pockets smaller than a cell at some level and
+        # not touching its corners are missed, as they would be by a regular
+        # grid of that resolution.
+        num_pts = self.params['num_pts']
+        num_fine_pts = len(fine_axes[0])
+        fine_shape = (num_fine_pts, num_fine_pts, num_fine_pts)
+        _, _, _, theta, phi, _ = self.get_grid()
+        psi, _, psi_squared = self.get_field()
+        iso_list = self.get_thresholds()
+        corners = _HEX_CORNERS[:, np.newaxis, :]
+
+        def get_corner_psi_squared(cells, step, cell_psi):
+            corner_psi_squared = np.abs(cell_psi) ** 2
+            if clip_mask_func is not None:
+                corner_idx = cells + step * corners
+                clip_mask = clip_mask_func(fine_axes[1][corner_idx[..., 1]],
+                                           fine_axes[2][corner_idx[..., 2]])
+                corner_psi_squared[clip_mask] = 0
+            return corner_psi_squared
+
+        mag_range = self.get_mag_range()
+        if clip_mask_func is not None:
+            psi_squared = np.where(clip_mask_func(theta, phi), 0, psi_squared)
+        cell_slices = [tuple(slice(offset, num_pts - 1 + offset)
+                             for offset in corner)
+                       for corner in _HEX_CORNERS]
+        min_vals = np.minimum.reduce([psi_squared[cell_slice]
+                                      for cell_slice in cell_slices])
+        max_vals = np.maximum.reduce([psi_squared[cell_slice]
+                                      for cell_slice in cell_slices])
+        straddling = get_straddling_cells(min_vals, max_vals, iso_list)
+        # Neighbours are included to catch surfaces which pass through a
+        # coarse cell without changing sign at its corners.
+        straddling = binary_dilation(straddling,
+                                     structure=np.ones((3, 3, 3), dtype=bool))
+
+        step = 2 ** self.params['refine_levels']
+        coarse_cells = np.argwhere(straddling)
+        cells = coarse_cells * step
+        coarse_corner_idx = coarse_cells + corners
+        if psi is not None:
+            cell_psi = psi[tuple(np.moveaxis(coarse_corner_idx, -1, 0))]
+        else:
+            cell_psi = self.get_fine_psi(step * coarse_corner_idx, fine_trig)
+
+        while step > 1 and len(cells) > 0:
+            step //= 2
+            new_psi = self.get_fine_psi(
+                cells + step * _SUB_POINTS[_NEW_SUB_POINTS, np.newaxis, :],
+                fine_trig)
+            sub_psi = np.empty((len(_SUB_POINTS), len(cells)),
+                               dtype=np.result_type(cell_psi, new_psi))
+            sub_psi[_CORNER_SUB_POINTS] = cell_psi
+            sub_psi[_NEW_SUB_POINTS] = new_psi
+
+            # Children are ordered child corner first, matching the
+            # (corner, child, cell) order of cell_psi before reshaping.
+            cells = (cells + step * corners).reshape(-1, 3)
+            cell_psi = sub_psi[_CHILD_CORNER_SUB_POINTS.T].reshape(8, -1)
+            corner_psi_squared = get_corner_psi_squared(cells, step, cell_psi)
+            straddling = get_straddling_cells(corner_psi_squared.min(axis=0),
+                                              corner_psi_squared.max(axis=0),
+                                              iso_list)
+            cells = cells[straddling]
+            cell_psi = cell_psi[:, straddling]
+
+        if len(cells) == 0:
+            return pv.PolyData()
+
+        # Cells become rows again for the hexahedron connectivity.
+        corner_flat_idx = np.ravel_multi_index(
+            tuple(np.moveaxis(cells + corners, -1, 0)), fine_shape).T
+        point_flat_idx, first_idx, inverse = np.unique(
+            corner_flat_idx, return_index=True, return_inverse=True)
+        point_psi = cell_psi.T.ravel()[first_idx]
+        point_psi_squared = get_corner_psi_squared(
+            cells, 1, cell_psi).T.ravel()[first_idx]
+
+        r_idx, theta_idx, phi_idx = np.unravel_index(point_flat_idx,
+                                                     fine_shape)
+        points = get_spherical_points(fine_trig, r_idx, theta_idx, phi_idx)
+
+        cell_conn = np.empty((len(cells), 9), dtype=np.int64)
+        cell_conn[:, 0] = 8
+        cell_conn[:, 1:] = inverse.reshape(corner_flat_idx.shape)
+        mesh = pv.UnstructuredGrid(
+            cell_conn.ravel(),
+            np.full(len(cells), pv.CellType.HEXAHEDRON, dtype=np.uint8),
+            points)
+        mesh['psi_squared'] = point_psi_squared
+        mesh['rgba'] = complex_to_rgba_lut(
+            point_psi,
+            mag_maps_to=self.params['mag_maps_to'],
+            mag_range=mag_range,
+            out=np.empty((len(point_psi), 4), dtype=self.params['dtype']))
+        return mesh.contour(iso_list, scalars='psi_squared')
+
+
+class VolumeMeshPipeline(MeshPipeline):
+    default_params = dict(
+        n=1, l=0, m=0, real=False,
+        num_pts=50,
+        max_opacity=0.2,
+        opacity_exp=1.0,
+        clip=False,
+        dtype=np.dtype(np.float64),
+        chunk_size=None,
+        baked_rgba=True,
+    )
+    _grid_params = ('n', 'num_pts', 'dtype')
+    _field_params = _grid_params + ('l', 'm', 'real', 'clip')
+    _color_params = _field_params + ('max_opacity', 'opacity_exp')
+    stage_params = dict(
+        grid=_grid_params,
+        field=_field_params,
+        color=_color_params,
+        phase_mag=_field_params,
+        volume=_color_params + ('baked_rgba',),
+    )
+    persistent_stages = ('volume',)
+    mesh_stage = 'volume'
+
+    def get_grid(self):
+        return self.get_stage_output('grid', self.compute_grid)
+
+    def get_field(self):
+        return self.get_stage_output('field', self.compute_field)
+
+    def get_rgba(self):
+        return self.get_stage_output('color', self.compute_rgba)
+
+    def get_phase_mag(self):
+        return self.get_stage_output('phase_mag', self.compute_phase_mag)
+
+    def get_mesh(self):
+        return self.get_stage_output('volume', self.compute_volume)
+
+    def compute_grid(self):
+        span = (1.5 * self.params['n']) ** 2
+
+        single_ax_array = np.linspace(
+                -span,
+                span,
+                self.params['num_pts'],
+                dtype=self.params['dtype']
+            )
+
+        return single_ax_array
+
+    def get_color_arr_slab(self, slab):
+        single_ax_array = self.get_grid()
+        x = single_ax_array[:, np.newaxis, np.newaxis]
+        y = single_ax_array[np.newaxis, :, np.newaxis]
+        z = single_ax_array[np.newaxis, np.newaxis, slab]
+        x_slab, y_slab, z_slab = np.broadcast_arrays(x, y, z)
+        psi = get_atomic_wavefunction(x_slab, y_slab, z_slab,
+                                      self.params['n'], self.params['l'],
+                                      self.params['m'],
+                                      real=self.params['real'])
+        if self.params['clip']:
+            clip_mask = ((x_slab > 0)
+                         & (y_slab > 0)
+                         & (z_slab > 0))
+            psi[clip_mask] = 0
+        return np.abs(psi) * psi
+
+    def compute_field(self):
+        # The colour array |psi| * psi is only kept when the grid is
+        # evaluated in one slab. Otherwise only its magnitude range is kept
+        # and the colour stage re-evaluates it slab by slab.
+        slab_slices = get_slab_slices(self.params['num_pts'],
+                                      self.params['chunk_size'])
+        color_arr = None
+        min_mag, max_mag = np.inf, -np.inf
+        for slab in slab_slices:
+            color_arr_slab = self.get_color_arr_slab(slab)
+            mag = np.abs(color_arr_slab)
+            min_mag = min(min_mag, np.min(mag))
+            max_mag = max(max_mag, np.max(mag))
+            if len(slab_slices) == 1:
+                color_arr = color_arr_slab
+
+        return color_arr, (min_mag, max_mag)
+
+    def compute_rgba(self):
+        num_pts = self.params['num_pts']
+        color_arr, mag_range = self.get_field()
+
+        # See ContourMeshPipeline.compute_field for the buffer layout.
+        shape = (num_pts, num_pts, num_pts)
+        rgba_flat = np.empty((num_pts ** 3, 4), dtype=np.uint8)
+        rgba_uint8 = rgba_flat.reshape(shape + (4,)).transpose(2, 1, 0, 3)
+
+        for slab in get_slab_slices(num_pts, self.params['chunk_size']):
+            if color_arr is None:
+                color_arr_slab = self.get_color_arr_slab(slab)
+            else:
+                color_arr_slab = color_arr[:, :, slab]
+            # The phase colour comes from the lookup table, the opacity is
+            # computed from the magnitude.
+            complex_to_rgba_lut(color_arr_slab, out=rgba_uint8[:, :, slab])
+            alpha = get_scaled_mag(color_arr_slab, mag_range=mag_range)
+            alpha *= self.params['max_opacity']
+            alpha **= self.params['opacity_exp']
+            rgba_uint8[:, :, slab, 3] = 255 * alpha
+
+        return rgba_flat
+
+    def compute_phase_mag(self):
+        # The RGB phase colour of compute_rgba and the normalized magnitude
+        # as four uint8 channels. Opacity is then applied at render time,
+        # see atomview.volume_render.
+        num_pts = self.params['num_pts']
+        color_arr, mag_range = self.get_field()
+
+        shape = (num_pts, num_pts, num_pts)
+        phase_mag_flat = np.empty((num_pts ** 3, 4), dtype=np.uint8)
+        phase_mag = phase_mag_flat.reshape(shape + (4,)).transpose(2, 1, 0, 3)
+
+        for slab in get_slab_slices(num_pts, self.params['chunk_size']):
+            if color_arr is None:
+                color_arr_slab = self.get_color_arr_slab(slab)
+            else:
+                color_arr_slab = color_arr[:, :, slab]
+            complex_to_rgba_lut(color_arr_slab, out=phase_mag[:, :, slab])
+            phase_mag[:, :, slab, 3] = 255 * get_scaled_mag(
+                color_arr_slab, mag_range=mag_range)
+
+        return phase_mag_flat
+
+    def compute_volume(self):
+        single_ax_array = self.get_grid()
+        mesh = pv.RectilinearGrid(single_ax_array,
+                                  single_ax_array,
+                                  single_ax_array)
+
+        if self.params['baked_rgba']:
+            mesh['rgba'] = self.get_rgba()
+        else:
+            mesh['phase_mag'] = self.get_phase_mag()
+
+        return mesh
+
+
+def get_wavefunction_prob_contour_mesh(n, l, m, real=False,  # noqa
+                                       num_pts=50,
+                                       prob_threshold_list=(0.6,),
+                                       mag_maps_to='',
+                                       clip=False,
+                                       clip_ghost=False,
+                                       ghost_opacity=0.2,
+                                       separable=True,
+                                       dtype=np.float64,
+                                       chunk_size=None,
+                                       refine_levels=0,
+                                       color_mode='grid'):
+    pipeline = ContourMeshPipeline(
+        n=n, l=l, m=m, real=real,
+        num_pts=num_pts,
+        prob_threshold_list=prob_threshold_list,
+        mag_maps_to=mag_maps_to,
+        clip=clip,
+        clip_ghost=clip_ghost,
+        ghost_opacity=ghost_opacity,
+        separable=separable,
+        dtype=dtype,
+        chunk_size=chunk_size,
+        refine_levels=refine_levels,
+        color_mode=color_mode,
+    )
+    return pipeline.get_mesh()
 
 
 def get_wavefunction_volume_mesh(
@@ -101,40 +1090,18 @@ def get_wavefunction_volume_mesh(
         max_opacity=0.2,
         opacity_exp=1.0,
         clip=False,
+        dtype=np.float64,
+        chunk_size=None,
+        baked_rgba=True,
 ):
-    span = (1.5 * n) ** 2
-
-    single_ax_array = np.linspace(
-            -span,
-            span,
-            num_pts
-        )
-
-    x, y, z = np.meshgrid(single_ax_array,
-                          single_ax_array,
-                          single_ax_array,
-                          indexing='ij')
-
-    psi = get_atomic_wavefunction(x, y, z, n, l, m, real=real)
-    if clip:
-        clip_mask = ((x > 0)
-                     & (y > 0)
-                     & (z > 0))
-        psi[clip_mask] = 0
-
-    rgba = complex_to_rgba(
-        np.abs(psi) * psi,
-        mag_maps_to='a'
+    pipeline = VolumeMeshPipeline(
+        n=n, l=l, m=m, real=real,
+        num_pts=num_pts,
+        max_opacity=max_opacity,
+        opacity_exp=opacity_exp,
+        clip=clip,
+        dtype=dtype,
+        chunk_size=chunk_size,
+        baked_rgba=baked_rgba,
     )
-
-    rgba[:, :, :, 3] *= max_opacity
-    rgba[:, :, :, 3] **= opacity_exp
-    rgba_uint8 = (255 * rgba).astype(np.uint8)
-
-    mesh = pv.RectilinearGrid(single_ax_array,
-                              single_ax_array,
-                              single_ax_array)
-
-    mesh['rgba'] = rgba_uint8.reshape((psi.size, 4), order='F')
-
-    return mesh
+    return pipeline.get_mesh()
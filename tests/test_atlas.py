@@ -0,0 +1,72 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from atomview.atlas import Atlas, build_atlas, get_mode_params
+from atomview.wavefunction_mesh import ContourMeshPipeline
+
+
+class TestAtlas(unittest.TestCase):
+    def test_build_and_resume(self):
+        with tempfile.TemporaryDirectory() as atlas_dir:
+            log = []
+            atlas = build_atlas(atlas_dir, 2, modes=('contour',),
+                                reals=(False,), num_pts=20, processes=1,
+                                log=log.append)
+            self.assertEqual(len(atlas), 5)
+            self.assertEqual(len(log), 6)
+
+            # Rebuilding skips the states already built.
+            log = []
+            build_atlas(atlas_dir, 2, modes=('contour',), reals=(False,),
+                        num_pts=20, processes=1, log=log.append)
+            self.assertEqual(log, ['5 of 5 states already built, '
+                                   'building 0.'])
+
+            atlas = Atlas(atlas_dir)
+            kind, params = get_mode_params('contour', 2, 1, -1, num_pts=20)
+            expected = ContourMeshPipeline(**params).get_mesh()
+            mesh = atlas.get_state('contour', 2, 1, -1, num_pts=20)
+            np.testing.assert_array_equal(mesh.points, expected.points)
+            np.testing.assert_array_equal(mesh['rgba'], expected['rgba'])
+
+            # Pipelines using the atlas as their disk cache find its meshes.
+            pipeline = ContourMeshPipeline(**params)
+            pipeline.disk_cache = atlas.disk_cache
+            pipeline.get_mesh()
+            self.assertEqual(list(pipeline.stage_outputs), ['contour'])
+            self.assertFalse(atlas.has_mesh('contour', dict(params, m=0,
+                                                            real=True)))
+
+            # Meshes are found through the index after the mesh code is
+            # edited, which changes the content keys.
+            with mock.patch('atomview.disk_cache.get_source_hash',
+                            return_value='edited'):
+                atlas = Atlas(atlas_dir)
+                self.assertTrue(atlas.has_mesh(kind, params))
+                mesh = atlas.get_state('contour', 2, 1, -1, num_pts=20)
+                np.testing.assert_array_equal(mesh.points, expected.points)
+                log = []
+                build_atlas(atlas_dir, 2, modes=('contour',),
+                            reals=(False,), num_pts=20, processes=1,
+                            log=log.append)
+                self.assertEqual(log, ['5 of 5 states already built, '
+                                       'building 0.'])
+
+            # An atlas of another cache format is ignored.
+            index_path = Path(atlas_dir, 'index.json')
+            index = json.loads(index_path.read_text())
+            index['cache_format_version'] = -1
+            index_path.write_text(json.dumps(index))
+            with self.assertWarns(UserWarning):
+                atlas = Atlas(atlas_dir)
+            self.assertEqual(len(atlas), 0)
+            self.assertIsNone(atlas.get(kind, params))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parents[1] / 'ui'))
+
+from atomview.mesh_executor import (  # noqa: E402
+    SerialMeshExecutor, init_disk_cache)
+from atomviewwindow import ExecutorMeshWorker, VisMode  # noqa: E402
+
+
+class FailingMeshExecutor(SerialMeshExecutor):
+    def submit(self, kind, params, pipeline_key=None):
+        future = Future()
+        future.set_exception(RuntimeError('Mesh generation failed.'))
+        return future
+
+
+class TestExecutorMeshWorker(unittest.TestCase):
+    def test_failed_job(self):
+        worker = ExecutorMeshWorker(FailingMeshExecutor(),
+                                    preview_num_pts=(10,))
+        worker.latest_request_id = 1
+        errors = []
+        meshes = []
+        worker.mesh_error_signal.connect(
+            lambda error, request_id: errors.append((error, request_id)))
+        worker.mesh_ready_signal.connect(
+            lambda *args: meshes.append(args))
+        worker.preview_ready_signal.connect(
+            lambda *args: meshes.append(args))
+        # The executor's futures are already done, so the signals are
+        # emitted from within gen_mesh_and_plot.
+        worker.gen_mesh_and_plot(VisMode.CONTOUR, 2, 1, 0, 0.5, False, False,
+                                 [], 0.5, 1.0, 1)
+        self.assertEqual(meshes, [])
+        self.assertEqual(len(errors), 2)
+        for error, request_id in errors:
+            self.assertIsInstance(error, RuntimeError)
+            self.assertEqual(request_id, 1)
+        self.assertEqual(worker.futures, dict())
+
+    def test_prefetch_id(self):
+        # Prefetch jobs of an old prefetch id are dropped without touching
+        # the request id.
+        worker = ExecutorMeshWorker(SerialMeshExecutor())
+        worker.latest_request_id = 3
+        worker.latest_prefetch_id = 2
+        prefetched = []
+        worker.prefetch_ready_signal.connect(
+            lambda mesh, key, prefetch_id: prefetched.append(
+                (key, prefetch_id)))
+        params = {'n': 2, 'l': 1, 'm': 0, 'num_pts': 20}
+        jobs = [('a', 'contour', params), ('b', 'volume', params)]
+        worker.prefetch(jobs, 1)
+        self.assertEqual(prefetched, [])
+        worker.prefetch(jobs, 2)
+        self.assertEqual(prefetched, [('a', 2), ('b', 2)])
+        self.assertEqual(worker.latest_request_id, 3)
+
+    def test_cached_mesh_skips_previews(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.addCleanup(init_disk_cache, None)
+            args = (VisMode.CONTOUR, 2, 1, 0, 0.5, False, False, [], 0.5,
+                    1.0, 1)
+            for cached in [False, True]:
+                # Without memoized pipelines only the disk cache is shared.
+                worker = ExecutorMeshWorker(
+                    SerialMeshExecutor(disk_cache_dir=cache_dir),
+                    preview_num_pts=(10,))
+                worker.latest_request_id = 1
+                previews = []
+                meshes = []
+                worker.preview_ready_signal.connect(
+                    lambda *args: previews.append(args))
+                worker.mesh_ready_signal.connect(
+                    lambda *args: meshes.append(args))
+                with mock.patch.dict('atomview.mesh_executor._pipelines',
+                                     clear=True):
+                    worker.gen_mesh_and_plot(*args)
+                self.assertEqual(len(previews), 0 if cached else 1)
+                self.assertEqual(len(meshes), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
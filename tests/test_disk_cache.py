@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pyvista as pv
+
+from atomview.disk_cache import (
+    DiskCache, get_cache_key, get_module_code_bytes, get_source_hash,
+    write_array_file)
+from atomview.wavefunction_mesh import ContourMeshPipeline
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        cache = DiskCache(self.cache_dir)
+        sphere = pv.Sphere()
+        sphere['rgba'] = np.zeros((sphere.n_points, 4), dtype=np.uint8)
+        grid = pv.RectilinearGrid(np.arange(3.), np.arange(4.), np.arange(5.))
+        arrays = {'a': np.arange(10.), 'b': np.ones((3, 4), np.complex64)}
+        cache.put('mesh', sphere)
+        cache.put('meshes', (sphere, grid))
+        cache.put('arrays', arrays)
+
+        # A new instance reads the same directory, e.g. in a later session.
+        cache = DiskCache(self.cache_dir)
+        self.assertEqual(len(cache), 3)
+        sphere_out = cache.get('mesh')
+        np.testing.assert_array_equal(sphere_out.points, sphere.points)
+        np.testing.assert_array_equal(sphere_out.faces, sphere.faces)
+        np.testing.assert_array_equal(sphere_out['rgba'], sphere['rgba'])
+        _, grid_out = cache.get('meshes')
+        np.testing.assert_array_equal(grid_out.y, grid.y)
+        arrays_out = cache.get('arrays')
+        for name, arr in arrays.items():
+            np.testing.assert_array_equal(arrays_out[name], arr)
+            self.assertEqual(arrays_out[name].dtype, arr.dtype)
+        self.assertIsNone(cache.get('missing'))
+
+    def test_lru_eviction(self):
+        arrays = {'a': np.zeros(2**16)}
+        cache = DiskCache(self.cache_dir)
+        cache.put('a', arrays)
+        file_nbytes = cache.nbytes
+        cache.set_max_bytes(2 * file_nbytes)
+        cache.put('b', arrays)
+        os.utime(cache.get_path('a'), (0, 0))
+        os.utime(cache.get_path('b'), (1, 1))
+        cache.get('a')
+        cache.put('c', arrays)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.nbytes, 2 * file_nbytes)
+
+        # Recency is recovered from modification times.
+        os.utime(cache.get_path('a'), (2, 2))
+        os.utime(cache.get_path('c'), (1, 1))
+        cache = DiskCache(self.cache_dir, max_bytes=file_nbytes)
+        self.assertNotIn('c', cache)
+        self.assertIn('a', cache)
+
+    def test_cache_key(self):
+        self.assertEqual(get_cache_key('field', {'n': 1, 'x': 0.5}),
+                         get_cache_key('field', {'x': np.float64(0.5),
+                                                 'n': 1}))
+        self.assertNotEqual(get_cache_key('field', {'n': 1}),
+                            get_cache_key('field', {'n': 2}))
+        # Editing the mesh code changes every key.
+        key = get_cache_key('field', {'n': 1})
+        with mock.patch('atomview.disk_cache.get_source_hash',
+                        return_value='edited'):
+            self.assertNotEqual(get_cache_key('field', {'n': 1}), key)
+
+    def test_module_code_bytes(self):
+        # Frozen modules, like those of a PyInstaller bundle, have code but
+        # no source file. Built-in modules have neither.
+        self.assertIsNotNone(get_module_code_bytes('zipimport'))
+        self.assertIsNone(get_module_code_bytes('sys'))
+        self.assertNotEqual(get_source_hash(), 'unknown')
+
+    def test_interrupted_write(self):
+        def chunks():
+            yield np.zeros(4)
+            raise KeyboardInterrupt
+
+        path = Path(self.cache_dir, 'entry.atv')
+        with self.assertRaises(KeyboardInterrupt):
+            write_array_file(path, b'ATOMVIEW', {},
+                             [('', 'a', np.float64, (8,), chunks())])
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_pipeline(self):
+        params = dict(n=3, l=2, m=1, num_pts=30, clip=True, clip_ghost=True)
+        pipeline = ContourMeshPipeline(**params)
+        pipeline.disk_cache = DiskCache(self.cache_dir)
+        mesh, ghost_mesh = pipeline.get_mesh()
+
+        pipeline = ContourMeshPipeline(**params)
+        pipeline.disk_cache = DiskCache(self.cache_dir)
+        mesh_out, ghost_mesh_out = pipeline.get_mesh()
+        self.assertEqual(list(pipeline.stage_outputs), ['contour'])
+        np.testing.assert_array_equal(mesh_out.points, mesh.points)
+        np.testing.assert_array_equal(ghost_mesh_out['rgba'],
+                                      ghost_mesh['rgba'])
+
+        # A new threshold reuses the stored field.
+        pipeline.set_params(prob_threshold_list=(0.3,))
+        expected = ContourMeshPipeline(
+            **params, prob_threshold_list=(0.3,)).get_mesh()
+        np.testing.assert_array_equal(pipeline.get_mesh()[0].points,
+                                      expected[0].points)
+        self.assertIsInstance(pipeline.get_field()[1], np.memmap)
+
+
+if __name__ == '__main__':
+    unittest.main()
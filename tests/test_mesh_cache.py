@@ -0,0 +1,33 @@
+import unittest
+
+import pyvista as pv
+
+from atomview.mesh_cache import MeshCache, get_mesh_nbytes
+
+
+class TestMeshCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        mesh = pv.Sphere()
+        mesh_nbytes = get_mesh_nbytes(mesh)
+        cache = MeshCache(max_bytes=2 * mesh_nbytes)
+        cache.put('a', mesh)
+        cache.put('b', mesh.copy())
+        self.assertIs(cache.get('a'), mesh)
+        cache.put('c', mesh.copy())
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.nbytes, 2 * mesh_nbytes)
+
+    def test_tuple_and_oversized(self):
+        mesh = pv.Sphere()
+        mesh_nbytes = get_mesh_nbytes(mesh)
+        cache = MeshCache(max_bytes=mesh_nbytes)
+        cache.put('pair', (mesh, mesh.copy()))
+        self.assertNotIn('pair', cache)
+        self.assertEqual(cache.nbytes, 0)
+        cache.set_max_bytes(3 * mesh_nbytes)
+        cache.put('pair', (mesh, mesh.copy()))
+        self.assertEqual(cache.nbytes, 2 * mesh_nbytes)
+        cache.set_max_bytes(mesh_nbytes)
+        self.assertEqual(len(cache), 0)
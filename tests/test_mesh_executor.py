@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pyvista as pv
+
+from atomview.mesh_executor import (
+    ProcessMeshExecutor, SerialMeshExecutor, generate_mesh,
+    mesh_from_shared_memory, mesh_to_shared_memory)
+
+
+class TestSharedMemory(unittest.TestCase):
+    def test_round_trip(self):
+        sphere = pv.Sphere()
+        sphere.point_data['rgba'] = np.arange(
+            4 * sphere.n_points, dtype=np.uint8).reshape(-1, 4)
+        grid = pv.RectilinearGrid(np.arange(3.), np.arange(4.), np.arange(5.))
+        grid.point_data['phase_mag'] = np.ones((grid.n_points, 2), np.uint8)
+
+        sphere_out, grid_out = mesh_from_shared_memory(
+            mesh_to_shared_memory((sphere, grid)))
+        np.testing.assert_array_equal(sphere_out.points, sphere.points)
+        np.testing.assert_array_equal(sphere_out.faces, sphere.faces)
+        np.testing.assert_array_equal(sphere_out['rgba'], sphere['rgba'])
+        np.testing.assert_array_equal(grid_out.z, grid.z)
+        np.testing.assert_array_equal(grid_out['phase_mag'],
+                                      grid['phase_mag'])
+
+
+class TestExecutors(unittest.TestCase):
+    params = {'n': 3, 'l': 1, 'm': 1, 'num_pts': 30,
+              'prob_threshold_list': (0.5,)}
+
+    def check_mesh(self, mesh):
+        expected = generate_mesh('contour', self.params)
+        np.testing.assert_array_equal(mesh.points, expected.points)
+        np.testing.assert_array_equal(mesh['rgba'], expected['rgba'])
+
+    def test_serial(self):
+        executor = SerialMeshExecutor()
+        self.check_mesh(executor.submit('contour', self.params).result())
+
+    def test_process(self):
+        executor = ProcessMeshExecutor(max_workers=1)
+        try:
+            future = executor.submit('contour', self.params, 'contour')
+            self.check_mesh(future.result(timeout=120))
+        finally:
+            executor.shutdown()
+
+    def test_process_has_cached_mesh(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            executor = ProcessMeshExecutor(max_workers=1,
+                                           disk_cache_dir=cache_dir)
+            try:
+                self.assertFalse(
+                    executor.has_cached_mesh('contour', self.params))
+                executor.submit('contour', self.params).result(timeout=120)
+                self.assertTrue(
+                    executor.has_cached_mesh('contour', self.params))
+                self.assertFalse(executor.has_cached_mesh(
+                    'contour', dict(self.params, num_pts=20)))
+            finally:
+                executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pyvista as pv
+
+from atomview.disk_cache import write_cache_file
+from atomview.mesh_export import (
+    decode_octahedral, encode_octahedral, export_mesh, import_mesh,
+    open_exported_mesh)
+from atomview.wavefunction_mesh import (
+    get_wavefunction_prob_contour_mesh, get_wavefunction_volume_mesh)
+
+
+class TestMeshExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name, 'mesh.atq')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_contour_round_trip(self):
+        mesh = get_wavefunction_prob_contour_mesh(
+            3, 2, 1, num_pts=40, mag_maps_to='a',
+            prob_threshold_list=(0.5, 0.8))
+        export_mesh(self.path, mesh, normals=True)
+        imported = import_mesh(self.path)
+
+        extent = np.array(mesh.bounds[1::2]) - np.array(mesh.bounds[::2])
+        self.assertTrue(np.all(np.abs(imported.points - mesh.points)
+                               <= 0.5 * extent / 65535 + 1e-12))
+        np.testing.assert_array_equal(imported.faces, mesh.faces)
+        self.assertEqual(imported['rgba'].dtype, np.uint8)
+        self.assertLessEqual(
+            np.max(np.abs(imported['rgba'] / 255 - mesh['rgba'])), 0.5 / 255)
+        np.testing.assert_array_equal(imported['psi_squared'],
+                                      mesh['psi_squared'])
+        cos_angle = np.sum(imported['Normals'] * mesh.point_normals, axis=1)
+        self.assertGreater(np.min(cos_angle), 1 - 1e-6)
+
+        # Quantized arrays are memory mapped from the file.
+        _, mesh_arrays = open_exported_mesh(self.path)
+        points = mesh_arrays[0]['geometry']['points']
+        self.assertEqual(points.dtype, np.uint16)
+        self.assertIsInstance(points.base, np.memmap)
+
+        cache_path = Path(self.tmp_dir.name, 'mesh.atv')
+        write_cache_file(cache_path, mesh)
+        self.assertLess(3.5 * self.path.stat().st_size,
+                        cache_path.stat().st_size)
+
+    def test_volume_and_tuple(self):
+        volume_mesh = get_wavefunction_volume_mesh(2, 1, 0, num_pts=20)
+        meshes = (volume_mesh, pv.PolyData())
+        export_mesh(self.path, meshes)
+        imported, empty = import_mesh(self.path)
+        np.testing.assert_array_equal(imported.x, volume_mesh.x)
+        np.testing.assert_array_equal(imported['rgba'], volume_mesh['rgba'])
+        self.assertEqual(empty.n_points, 0)
+
+    def test_octahedral(self):
+        rng = np.random.default_rng(0)
+        normals = rng.normal(size=(1000, 3))
+        normals = np.concatenate([normals, np.eye(3), -np.eye(3)])
+        normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+        decoded = decode_octahedral(encode_octahedral(normals))
+        self.assertLess(np.max(np.linalg.norm(decoded - normals, axis=1)),
+                        1e-4)
+
+    def test_non_triangle_mesh(self):
+        with self.assertRaises(ValueError):
+            export_mesh(self.path, pv.Plane())
@@ -9,7 +9,7 @@ from sciform import (
     FormatOptions, ExpFormat, ExpMode, set_global_defaults, SciNumUnc
 )
 
-from src.atomview.utils import sph_harm_cartesian
+from src.atomview.utils import sph_harm_cartesian, solid_harm_cartesian
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +40,31 @@ class TestSphHarm(unittest.TestCase):
 
         assert_allclose(ylm, ylm_scipy)
 
+    def test_compare_recurrence(self):
+        for test_l in range(6):
+            for test_m in range(-test_l, test_l + 1):
+                ylm = sph_harm_cartesian(x, y, z, test_l, test_m,
+                                         use_recurrence=True)
+                ylm_scipy = sph_harm_cartesian(x, y, z, test_l, test_m,
+                                               use_scipy=True)
+                assert_allclose(ylm, ylm_scipy, atol=1e-12)
+
+    def test_recurrence_high_l(self):
+        ylm = sph_harm_cartesian(x, y, z, 200, 150, use_recurrence=True)
+        ylm_scipy = sph_harm_cartesian(x, y, z, 200, 150, use_scipy=True)
+        self.assertTrue(np.all(np.isfinite(ylm)))
+        assert_allclose(ylm, ylm_scipy, atol=1e-12)
+
+    def test_compare_solid_harm(self):
+        r = np.sqrt(x ** 2 + y ** 2 + z ** 2)
+        for test_l in range(6):
+            for test_m in range(-test_l, test_l + 1):
+                solid_harm = solid_harm_cartesian(x, y, z, test_l, test_m)
+                ylm_scipy = sph_harm_cartesian(x, y, z, test_l, test_m,
+                                               use_scipy=True)
+                assert_allclose(solid_harm, r ** test_l * ylm_scipy,
+                                rtol=1e-10, atol=1e-10 * span ** test_l)
+
     def test_benchmark_sph_harm_cartesian(self):
         num_trials = 10
         num_reps = 10
@@ -62,3 +87,15 @@ class TestSphHarm(unittest.TestCase):
         sem_t = sem(t) / num_trials
 
         logger.info(f'use_scipy=True: {SciNumUnc(mean_t, sem_t)}s')
+
+    def test_benchmark_sph_harm_cartesian_recurrence(self):
+        num_trials = 10
+        num_reps = 10
+        t = timeit.repeat(lambda: sph_harm_cartesian(x, y, z, l, m,
+                                                     use_recurrence=True),
+                          repeat=num_reps, number=num_trials)
+
+        mean_t = np.mean(t) / num_trials
+        sem_t = sem(t) / num_trials
+
+        logger.info(f'use_recurrence=True: {SciNumUnc(mean_t, sem_t)}s')
@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+
+from atomview.utils import (
+    PHASE_LUT_SIZE, complex_to_rgba, complex_to_rgba_lut)
+
+
+class TestComplexToRgbaLut(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.arr = (rng.normal(size=(20, 30, 10))
+                    + 1j * rng.normal(size=(20, 30, 10)))
+        self.mag_range = (0, np.max(np.abs(self.arr)))
+        # RGB changes by at most 6 per turn of phase.
+        self.atol = 6 * 0.5 / PHASE_LUT_SIZE
+
+    def test_compare_complex_to_rgba(self):
+        for mag_maps_to in ('', 'a', 's', 'v', 'sva'):
+            for zero_uniform_mag in (False, True):
+                kwargs = dict(mag_maps_to=mag_maps_to,
+                              zero_uniform_mag=zero_uniform_mag,
+                              mag_range=self.mag_range)
+                np.testing.assert_allclose(
+                    complex_to_rgba_lut(self.arr, **kwargs),
+                    complex_to_rgba(self.arr, **kwargs),
+                    atol=self.atol)
+
+    def test_out(self):
+        out = np.empty(self.arr.shape + (4,), dtype=np.float32)
+        rgba = complex_to_rgba_lut(self.arr[:, :, 2:5], mag_maps_to='a',
+                                   mag_range=self.mag_range,
+                                   out=out[:, :, 2:5])
+        self.assertIs(rgba.base, out)
+        np.testing.assert_allclose(
+            out[:, :, 2:5],
+            complex_to_rgba(self.arr, mag_maps_to='a',
+                            mag_range=self.mag_range)[:, :, 2:5],
+            atol=self.atol)
+
+    def test_uint8(self):
+        rgba = complex_to_rgba_lut(
+            self.arr, mag_maps_to='v',
+            out=np.empty(self.arr.shape + (4,), dtype=np.uint8))
+        expected = (255 * complex_to_rgba(self.arr, mag_maps_to='v')).astype(
+            np.uint8)
+        diff = rgba.astype(int) - expected.astype(int)
+        self.assertLessEqual(np.max(np.abs(diff)), 1)
+
+    def test_real(self):
+        arr = np.real(self.arr)
+        np.testing.assert_allclose(complex_to_rgba_lut(arr, mag_maps_to='s'),
+                                   complex_to_rgba(arr, mag_maps_to='s'),
+                                   atol=1e-12)
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+import pyvista as pv
+
+from atomview.volume_render import add_phase_mag_volume, set_volume_opacity
+from atomview.wavefunction_mesh import get_wavefunction_volume_mesh
+
+
+def render(add_volume):
+    plotter = pv.Plotter(off_screen=True, window_size=(200, 200))
+    plotter.set_background('black')
+    add_volume(plotter)
+    plotter.camera_position = 'xy'
+    img = plotter.screenshot(return_img=True).astype(int)
+    plotter.close()
+    return img
+
+
+class TestPhaseMagVolume(unittest.TestCase):
+    def test_compare_baked_rgba(self):
+        # With max_opacity=1 and opacity_exp=1 the baked alpha is the
+        # magnitude channel of phase_mag, so both volumes have the same
+        # opacity. Complex m != 0 orbitals have a phase wrap, n changes the
+        # spacing of the grid and so the opacity unit distance.
+        for (n, l, m) in [(1, 0, 0), (3, 2, 1), (6, 3, -2)]:  # noqa
+            mesh = get_wavefunction_volume_mesh(n, l, m, num_pts=30,
+                                                max_opacity=1.0)
+            phase_mag_mesh = get_wavefunction_volume_mesh(
+                n, l, m, num_pts=30, baked_rgba=False)
+            img = render(lambda plotter: plotter.add_volume(
+                mesh, scalars='rgba', mapper='gpu'))
+            phase_mag_img = render(lambda plotter: add_phase_mag_volume(
+                plotter, phase_mag_mesh, 1.0, 1.0))
+            self.assertGreater(np.max(img), 0)
+            self.assertLessEqual(np.max(np.abs(phase_mag_img - img)), 2)
+
+    def test_set_volume_opacity(self):
+        mesh = get_wavefunction_volume_mesh(3, 2, 1, num_pts=30,
+                                            baked_rgba=False)
+
+        def add_and_update(plotter):
+            volume = add_phase_mag_volume(plotter, mesh, 0.2, 1.0)
+            set_volume_opacity(volume, 0.6, 2.0)
+
+        img = render(lambda plotter: add_phase_mag_volume(plotter, mesh,
+                                                          0.6, 2.0))
+        np.testing.assert_array_equal(render(add_and_update), img)
+
+
+if __name__ == '__main__':
+    unittest.main()
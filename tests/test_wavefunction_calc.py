@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.integrate import simpson
+from scipy.special import eval_genlaguerre as eval_genlaguerre_scipy
+from scipy.special import sph_harm_y
+
+from atomview.wavefunction_calc import (
+    SOLID_HARM_MAX_L, eval_genlaguerre, get_atomic_wavefunction,
+    get_atomic_wavefunction_separable, get_prefactor, get_radial_part)
+
+
+class TestRadialPart(unittest.TestCase):
+    def test_compare_scipy_laguerre(self):
+        x = np.linspace(0, 200, 1001)
+        for k in range(30):
+            for alpha in (1, 5, 21, 59):
+                expected = eval_genlaguerre_scipy(k, alpha, x)
+                assert_allclose(eval_genlaguerre(k, alpha, x), expected,
+                                rtol=1e-10,
+                                atol=1e-10 * np.max(np.abs(expected)))
+
+    def test_normalization_high_n(self):
+        for n in (5, 15, 30):
+            for l in (0, n // 2, n - 1):  # noqa
+                r = np.linspace(0, 3 * (1.5 * n) ** 2, 100001)
+                radial_part = get_prefactor(n, l) * get_radial_part(n, l, r)
+                norm = simpson(radial_part ** 2 * r ** 2, x=r)
+                self.assertAlmostEqual(norm, 1, places=8)
+
+
+class TestHighL(unittest.TestCase):
+    def test_compare_scipy_sph_harm(self):
+        rng = np.random.default_rng(0)
+        for (n, l, m) in [(10, SOLID_HARM_MAX_L, 3), (30, 29, 0),  # noqa
+                          (40, 39, 0), (40, 39, -20)]:
+            r = rng.uniform(0, 2 * n ** 2, 2000)
+            theta = rng.uniform(0, np.pi, 2000)
+            phi = rng.uniform(0, 2 * np.pi, 2000)
+            x = r * np.sin(theta) * np.cos(phi)
+            y = r * np.sin(theta) * np.sin(phi)
+            z = r * np.cos(theta)
+            expected = (get_prefactor(n, l) * get_radial_part(n, l, r)
+                        * sph_harm_y(l, m, theta, phi))
+            psi = get_atomic_wavefunction(x, y, z, n, l, m)
+            assert_allclose(psi, expected,
+                            atol=1e-12 * np.max(np.abs(expected)))
+
+
+class TestSeparable(unittest.TestCase):
+    def test_compare_cartesian(self):
+        r_1d = np.linspace(0, 40, 30)
+        theta_1d = np.linspace(0, np.pi, 30)
+        phi_1d = np.linspace(0, 2 * np.pi, 30)
+        r, theta, phi = np.meshgrid(r_1d, theta_1d, phi_1d, indexing='ij')
+        x = r * np.sin(theta) * np.cos(phi)
+        y = r * np.sin(theta) * np.sin(phi)
+        z = r * np.cos(theta)
+        for (n, l, m) in [(1, 0, 0), (3, 1, -1), (4, 3, 2), (5, 2, 0)]:  # noqa
+            for real in (False, True):
+                psi = get_atomic_wavefunction(x, y, z, n, l, m, real=real)
+                psi_separable = get_atomic_wavefunction_separable(
+                    r_1d, theta_1d, phi_1d, n, l, m, real=real)
+                assert_allclose(psi_separable, psi, atol=1e-12)
+
+
+class TestChunked(unittest.TestCase):
+    def test_chunked_wavefunction(self):
+        single_ax_array = np.linspace(-10, 10, 21)
+        x, y, z = np.meshgrid(single_ax_array, single_ax_array,
+                              single_ax_array, indexing='ij')
+        psi = get_atomic_wavefunction(x, y, z, 3, 2, -1)
+        psi_chunked = get_atomic_wavefunction(x, y, z, 3, 2, -1, chunk_size=4)
+        assert_allclose(psi_chunked, psi)
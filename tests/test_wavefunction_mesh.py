@@ -0,0 +1,341 @@
+import tracemalloc
+import unittest
+import warnings
+
+import numpy as np
+import pyvista as pv
+from scipy.spatial import cKDTree
+
+from atomview.wavefunction_mesh import (
+    ContourMeshPipeline, MeshPipelineCancelled, contour_index_space,
+    get_clip_mask, get_ghost_clip_mask, get_psi_squared_threshold_val,
+    get_spherical_points, get_spherical_trig,
+    get_wavefunction_prob_contour_mesh, get_wavefunction_volume_mesh)
+
+
+def get_psi_squared_threshold_val_sorted(psi_squared, dv, prob_enclosed_list):
+    sort_index = np.argsort(psi_squared.ravel())[::-1]
+    sorted_psi_squared = psi_squared.ravel()[sort_index]
+    sorted_dv = dv.ravel()[sort_index]
+    integrated_prob = np.cumsum(sorted_dv * sorted_psi_squared)
+    psi_squared_thresh_list = []
+    for prob_enclosed in prob_enclosed_list:
+        idx = np.searchsorted(integrated_prob, prob_enclosed)
+        idx = min(idx, len(sorted_psi_squared) - 1)
+        psi_squared_thresh_list.append(sorted_psi_squared[idx])
+    return psi_squared_thresh_list
+
+
+def assert_same_surface(test_case, mesh, expected_mesh, atol=1e-9):
+    # Compare vertices, matched by position, and their colours.
+    test_case.assertEqual(mesh.n_points, expected_mesh.n_points)
+    test_case.assertEqual(mesh.n_cells, expected_mesh.n_cells)
+    dist, idx = cKDTree(expected_mesh.points).query(mesh.points)
+    test_case.assertLess(np.max(dist), atol)
+    expected_dist, _ = cKDTree(mesh.points).query(expected_mesh.points)
+    test_case.assertLess(np.max(expected_dist), atol)
+    np.testing.assert_allclose(mesh['rgba'], expected_mesh['rgba'][idx],
+                               atol=1e-6)
+
+
+class TestThreshold(unittest.TestCase):
+    def test_compare_sorted(self):
+        rng = np.random.default_rng(0)
+        prob_enclosed_list = (0, 0.001, 0.2, 0.5, 0.6, 0.999, 1.2)
+        for _ in range(5):
+            psi_squared = rng.random((20, 20, 20)) ** 6
+            psi_squared[rng.random(psi_squared.shape) < 0.1] = 0
+            dv = rng.random((20, 20, 20))
+            dv /= np.sum(dv * psi_squared)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                thresh_list = get_psi_squared_threshold_val(
+                    psi_squared, dv, prob_enclosed_list)
+            expected_thresh_list = get_psi_squared_threshold_val_sorted(
+                psi_squared, dv, prob_enclosed_list)
+            np.testing.assert_allclose(thresh_list, expected_thresh_list,
+                                       rtol=1e-12)
+
+    def test_shared_bins_chunked(self):
+        # Several thresholds in one bin, gathered from every slab.
+        rng = np.random.default_rng(1)
+        prob_enclosed_list = (0.5, 0.5001, 0.9, 0.5)
+        psi_squared = rng.random((20, 20, 20))
+        dv = np.full((20, 20, 20), 1 / np.sum(psi_squared))
+        thresh_list = get_psi_squared_threshold_val(
+            psi_squared, dv, prob_enclosed_list, chunk_size=3)
+        expected_thresh_list = get_psi_squared_threshold_val_sorted(
+            psi_squared, dv, prob_enclosed_list)
+        np.testing.assert_allclose(thresh_list, expected_thresh_list,
+                                   rtol=1e-12)
+
+    def test_warn_unreachable_probability(self):
+        psi_squared = np.ones((5, 5, 5))
+        dv = np.full((5, 5, 5), 0.5 / psi_squared.size)
+        with self.assertWarns(UserWarning):
+            get_psi_squared_threshold_val(psi_squared, dv, (0.6,))
+
+
+class TestPrecision(unittest.TestCase):
+    def test_float32_contour_mesh(self):
+        mesh = get_wavefunction_prob_contour_mesh(3, 2, 1, num_pts=40)
+        mesh_32 = get_wavefunction_prob_contour_mesh(3, 2, 1, num_pts=40,
+                                                     dtype=np.float32)
+        self.assertEqual(mesh_32['rgba'].dtype, np.float32)
+        self.assertAlmostEqual(mesh_32.n_points / mesh.n_points, 1, places=2)
+
+    def test_float32_volume_mesh(self):
+        mesh = get_wavefunction_volume_mesh(3, 2, 1, num_pts=40)
+        mesh_32 = get_wavefunction_volume_mesh(3, 2, 1, num_pts=40,
+                                               dtype=np.float32)
+        diff = (mesh['rgba'].astype(int) - mesh_32['rgba'].astype(int))
+        self.assertLessEqual(np.max(np.abs(diff)), 1)
+
+    def test_float32_high_n(self):
+        # r**l overflows single precision at this n and l.
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            mesh_32 = get_wavefunction_volume_mesh(40, 39, 0, num_pts=40,
+                                                   dtype=np.float32)
+            contour_mesh_32 = get_wavefunction_prob_contour_mesh(
+                40, 39, 0, num_pts=40, separable=False, dtype=np.float32)
+        self.assertGreater(np.max(mesh_32['rgba'][:, 3]), 0)
+        self.assertGreater(contour_mesh_32.n_points, 0)
+
+    def test_float32_peak_memory(self):
+        # Double precision is only used in small slabs, so single precision
+        # meshes need well under the memory of double precision ones.
+        for get_mesh, kwargs in ((get_wavefunction_volume_mesh, {}),
+                                 (get_wavefunction_prob_contour_mesh,
+                                  {'separable': False})):
+            peaks = []
+            for dtype in (np.float64, np.float32):
+                tracemalloc.start()
+                get_mesh(3, 2, 1, num_pts=80, dtype=dtype, **kwargs)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            self.assertLess(peaks[1], 0.75 * peaks[0])
+
+
+class TestChunked(unittest.TestCase):
+    def test_chunked_contour_mesh(self):
+        for kwargs in ({}, {'separable': False}, {'mag_maps_to': 'a'}):
+            mesh = get_wavefunction_prob_contour_mesh(
+                3, 2, 1, num_pts=30, clip=True, **kwargs)
+            mesh_chunked = get_wavefunction_prob_contour_mesh(
+                3, 2, 1, num_pts=30, clip=True, chunk_size=7, **kwargs)
+            np.testing.assert_allclose(mesh_chunked.points, mesh.points)
+            np.testing.assert_allclose(mesh_chunked['rgba'], mesh['rgba'])
+
+    def test_chunked_volume_mesh(self):
+        mesh = get_wavefunction_volume_mesh(3, 2, 1, num_pts=30, clip=True)
+        mesh_chunked = get_wavefunction_volume_mesh(3, 2, 1, num_pts=30,
+                                                    clip=True, chunk_size=7)
+        np.testing.assert_array_equal(mesh_chunked['rgba'], mesh['rgba'])
+
+
+class TestPipeline(unittest.TestCase):
+    def test_only_downstream_stages_recomputed(self):
+        pipeline = ContourMeshPipeline(n=3, l=2, m=1, num_pts=30)
+        pipeline.get_mesh()
+        field = pipeline.get_field()
+        rgba = pipeline.get_rgba()
+
+        pipeline.set_params(prob_threshold_list=[0.3], clip=True)
+        mesh = pipeline.get_mesh()
+        self.assertIs(pipeline.get_field(), field)
+        self.assertIs(pipeline.get_rgba(), rgba)
+        expected_mesh = get_wavefunction_prob_contour_mesh(
+            3, 2, 1, num_pts=30, prob_threshold_list=[0.3], clip=True)
+        self.assertEqual(mesh.n_points, expected_mesh.n_points)
+
+        pipeline.set_params(m=0)
+        pipeline.get_mesh()
+        self.assertIsNot(pipeline.get_field(), field)
+
+    def test_cancel_between_stages(self):
+        pipeline = ContourMeshPipeline(n=3, l=2, m=1, num_pts=30)
+        pipeline.is_cancelled = lambda: len(pipeline.stage_outputs) >= 2
+        with self.assertRaises(MeshPipelineCancelled):
+            pipeline.get_mesh()
+        self.assertEqual(list(pipeline.stage_outputs), ['grid', 'field'])
+
+        pipeline.is_cancelled = None
+        field = pipeline.get_field()
+        pipeline.get_mesh()
+        self.assertIs(pipeline.get_field(), field)
+
+    def test_has_stage_output(self):
+        pipeline = ContourMeshPipeline(n=3, l=2, m=1, num_pts=30)
+        self.assertFalse(pipeline.has_stage_output('contour'))
+        pipeline.get_mesh()
+        self.assertTrue(pipeline.has_stage_output('contour'))
+        pipeline.set_params(num_pts=34)
+        self.assertFalse(pipeline.has_stage_output('contour'))
+        self.assertFalse(pipeline.has_stage_output('grid'))
+
+    def test_unknown_param(self):
+        with self.assertRaises(TypeError):
+            ContourMeshPipeline(max_opacity=0.5)
+
+
+class TestIndexSpaceContour(unittest.TestCase):
+    def test_compare_structured_grid(self):
+        num_pts = 40
+        for params in ({}, {'prob_threshold_list': (0.2, 0.5, 0.8),
+                            'mag_maps_to': 'a'}):
+            pipeline = ContourMeshPipeline(n=3, l=2, m=1, num_pts=num_pts,
+                                           **params)
+            # Isovalues are nudged so that no grid point lies on them or
+            # within single precision rounding of them.
+            iso_list = [iso * (1 + 1e-4)
+                        for iso in pipeline.get_thresholds()]
+            pipeline.stage_outputs['threshold'] = (
+                pipeline.get_stage_key('threshold'), iso_list)
+            mesh = pipeline.get_mesh()
+
+            r_1d, theta_1d, phi_1d = pipeline.get_grid()[:3]
+            shape = (num_pts, num_pts, num_pts)
+            grid = pv.StructuredGrid()
+            grid.points = get_spherical_points(
+                get_spherical_trig(r_1d, theta_1d, phi_1d),
+                *np.unravel_index(np.arange(num_pts ** 3), shape, order='F'))
+            grid.dimensions = shape
+            grid['psi_squared'] = pipeline.get_field()[1]
+            grid['rgba'] = pipeline.get_rgba()
+            expected_mesh = grid.contour(iso_list, scalars='psi_squared')
+
+            assert_same_surface(self, mesh, expected_mesh)
+
+    def test_clip_surface(self):
+        # Clipping recontours only the changed cells of the unclipped
+        # surface. Compare with contouring the fully masked field.
+        num_pts = 40
+        pipeline = ContourMeshPipeline(n=3, l=1, m=-1, num_pts=num_pts,
+                                       prob_threshold_list=(0.3, 0.7))
+        iso_list = [iso * (1 + 1e-4) for iso in pipeline.get_thresholds()]
+        pipeline.stage_outputs['threshold'] = (
+            pipeline.get_stage_key('threshold'), iso_list)
+        pipeline.get_mesh()
+        surface = pipeline.get_surface()
+        pipeline.set_params(clip=True, clip_ghost=True)
+        meshes = pipeline.get_mesh()
+        self.assertIs(pipeline.get_surface(), surface)
+
+        _, _, _, theta, phi, _ = pipeline.get_grid()
+        clip_mask = get_clip_mask(theta, phi)
+        ghost_clip_mask = clip_mask | get_ghost_clip_mask(theta, phi)
+        for mesh, mask in zip(meshes, (clip_mask, ghost_clip_mask)):
+            psi_squared = pipeline.get_field()[2].copy()
+            psi_squared[np.broadcast_to(mask, psi_squared.shape)] = 0
+            expected_mesh = pipeline.get_surface_mesh(
+                contour_index_space(psi_squared, iso_list))
+            if mask is ghost_clip_mask:
+                expected_mesh['rgba'][:, 3] = 0.2
+            assert_same_surface(self, mesh, expected_mesh)
+
+
+class TestAdaptive(unittest.TestCase):
+    def get_meshes(self, refine_levels, num_pts, **params):
+        # Adaptive mesh and the mesh of the full fine grid at the same
+        # isovalues. The isovalues are nudged off the sampled psi_squared
+        # values so that no grid point lies on or very close to them.
+        pipeline = ContourMeshPipeline(num_pts=num_pts,
+                                       refine_levels=refine_levels, **params)
+        iso_list = [iso * (1 + 1e-4) for iso in pipeline.get_thresholds()]
+        pipeline.stage_outputs['threshold'] = (
+            pipeline.get_stage_key('threshold'), iso_list)
+        num_evaluated = 0
+        get_fine_psi = pipeline.get_fine_psi
+
+        def get_fine_psi_counted(fine_idx, fine_trig):
+            nonlocal num_evaluated
+            num_evaluated += fine_idx.size // 3
+            return get_fine_psi(fine_idx, fine_trig)
+
+        pipeline.get_fine_psi = get_fine_psi_counted
+        mesh = pipeline.get_mesh()
+
+        num_fine_pts = (num_pts - 1) * 2 ** refine_levels + 1
+        fine_pipeline = ContourMeshPipeline(num_pts=num_fine_pts, **params)
+        fine_pipeline.stage_outputs['threshold'] = (
+            fine_pipeline.get_stage_key('threshold'), iso_list)
+        fine_mesh = fine_pipeline.get_mesh()
+        return mesh, fine_mesh, num_evaluated / num_fine_pts ** 3
+
+    def test_compare_fine_grid(self):
+        mesh, fine_mesh, evaluated_frac = self.get_meshes(
+            2, 40, n=3, l=2, m=1, prob_threshold_list=(0.5, 0.8))
+        assert_same_surface(self, mesh, fine_mesh)
+        self.assertLess(evaluated_frac, 0.4)
+
+    def test_clip_ghost(self):
+        meshes, fine_meshes, _ = self.get_meshes(
+            1, 30, n=3, l=1, m=1, real=True, clip=True, clip_ghost=True)
+        for mesh, fine_mesh in zip(meshes, fine_meshes):
+            assert_same_surface(self, mesh, fine_mesh)
+
+
+class TestVertexColor(unittest.TestCase):
+    def test_compare_grid_colors(self):
+        kwargs = dict(n=3, l=2, m=1, num_pts=40, mag_maps_to='sva',
+                      prob_threshold_list=(0.5, 0.8))
+        grid_mesh = ContourMeshPipeline(**kwargs).get_mesh()
+        for color_mode in ('interpolate', 'exact'):
+            for chunk_size in (None, 7):
+                pipeline = ContourMeshPipeline(
+                    color_mode=color_mode, chunk_size=chunk_size, **kwargs)
+                mesh = pipeline.get_mesh()
+                self.assertNotIn('color', pipeline.stage_outputs)
+                np.testing.assert_array_equal(mesh.points, grid_mesh.points)
+                np.testing.assert_allclose(mesh['rgba'], grid_mesh['rgba'],
+                                           atol=0.03)
+
+    def test_clip_ghost(self):
+        kwargs = dict(n=3, l=1, m=1, real=True, num_pts=30, clip=True,
+                      clip_ghost=True)
+        grid_meshes = get_wavefunction_prob_contour_mesh(**kwargs)
+        meshes = get_wavefunction_prob_contour_mesh(color_mode='exact',
+                                                    **kwargs)
+        for mesh, grid_mesh in zip(meshes, grid_meshes):
+            np.testing.assert_allclose(mesh['rgba'], grid_mesh['rgba'],
+                                       atol=0.03)
+
+
+class TestLod(unittest.TestCase):
+    def test_lod_meshes(self):
+        pipeline = ContourMeshPipeline(
+            n=3, l=2, m=1, num_pts=40, mag_maps_to='a',
+            prob_threshold_list=(0.5, 0.8),
+            lod_max_triangles=(1000, 10**9, 4000))
+        mesh = pipeline.get_mesh()
+        lod_meshes = pipeline.get_lod_meshes()
+        self.assertEqual(len(lod_meshes), 2)
+        for lod_mesh, max_triangles in zip(lod_meshes, (4000, 1000)):
+            self.assertLessEqual(lod_mesh.n_cells, max_triangles)
+            self.assertGreater(lod_mesh.n_cells, 0.9 * max_triangles)
+            self.assertTrue(lod_mesh.is_all_triangles)
+            # Decimation keeps a subset of the vertices and their colours.
+            dist, idx = cKDTree(mesh.points).query(lod_mesh.points)
+            self.assertEqual(np.max(dist), 0)
+            np.testing.assert_array_equal(lod_mesh['rgba'],
+                                          mesh['rgba'][idx])
+
+        # Only the lod stage depends on the budgets.
+        pipeline.set_params(lod_max_triangles=())
+        self.assertTrue(pipeline.has_stage_output('contour'))
+        self.assertEqual(pipeline.get_lod_meshes(), ())
+
+
+class TestPhaseMagVolume(unittest.TestCase):
+    def test_compare_baked_rgba(self):
+        mesh = get_wavefunction_volume_mesh(3, 2, 1, num_pts=30,
+                                            max_opacity=1.0)
+        phase_mag_mesh = get_wavefunction_volume_mesh(3, 2, 1, num_pts=30,
+                                                      baked_rgba=False)
+        self.assertEqual(phase_mag_mesh['phase_mag'].dtype, np.uint8)
+        np.testing.assert_array_equal(phase_mag_mesh['phase_mag'][:, :3],
+                                      mesh['rgba'][:, :3])
+        alpha = mesh['rgba'][:, 3].astype(int)
+        mag = phase_mag_mesh['phase_mag'][:, 3].astype(int)
+        self.assertLessEqual(np.max(np.abs(alpha - mag)), 1)
@@ -1,13 +1,54 @@
 import sys
 import ctypes
+import multiprocessing
+from argparse import ArgumentParser
 from pathlib import Path
 
 from PyQt6.QtGui import QIcon
 from PyQt6.QtWidgets import QApplication
 from atomviewwindow import AtomViewWindow
+from atomview.atlas import Atlas
+from atomview.disk_cache import DiskCache
+from atomview.mesh_executor import ProcessMeshExecutor
 
 
 def run():
+    parser = ArgumentParser()
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Generate meshes in a pool of this many worker '
+                             'processes. By default meshes are generated in '
+                             'a single background thread.')
+    parser.add_argument('--prefetch-radius', type=int, default=1,
+                        help='Prefetch meshes for (n, l, m) states within '
+                             'this many steps of the current state. 0 '
+                             'disables prefetching.')
+    parser.add_argument('--prefetch-max-mb', type=float, default=256,
+                        help='Memory available to prefetched meshes in MiB.')
+    parser.add_argument('--cache-dir', type=Path,
+                        default=Path.home() / '.atomview' / 'cache',
+                        help='Directory of the on-disk cache of fields and '
+                             'meshes.')
+    parser.add_argument('--cache-max-mb', type=float, default=2048,
+                        help='Size limit of the on-disk cache in MiB. 0 '
+                             'disables the on-disk cache.')
+    parser.add_argument('--atlas', type=Path, default=None,
+                        help='Directory of precomputed meshes built with '
+                             'atomview-atlas.')
+    parser.add_argument('--preview-num-pts', type=int, nargs='*',
+                        default=[34],
+                        help='Grid sizes of the coarse meshes shown while '
+                             'a mesh is generated. Pass no values to disable '
+                             'previews.')
+    parser.add_argument('--lod-max-triangles', type=int, nargs='*',
+                        default=[200_000, 50_000],
+                        help='Triangle budgets of the decimated contour '
+                             'meshes shown while the camera moves. Pass no '
+                             'values to always show the full mesh.')
+    parser.add_argument('--lod-target-fps', type=float, default=30,
+                        help='Frame rate the level shown while the camera '
+                             'moves is adapted to.')
+    args, _ = parser.parse_known_args()
+
     try:
         # PyInstaller creates a temp folder and stores path in _MEIPASS
         base_path = sys._MEIPASS
@@ -22,11 +63,34 @@ def run():
     myappid = u'atomview_app'  # arbitrary string
     ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
-    window = AtomViewWindow()
+    cache_max_bytes = int(args.cache_max_mb * 2**20)
+    cache_dir = args.cache_dir if cache_max_bytes > 0 else None
+    if args.processes > 0:
+        mesh_executor = ProcessMeshExecutor(
+            max_workers=args.processes,
+            disk_cache_dir=cache_dir,
+            disk_cache_max_bytes=cache_max_bytes)
+        disk_cache = None
+    else:
+        mesh_executor = None
+        if cache_dir is None:
+            disk_cache = None
+        else:
+            disk_cache = DiskCache(cache_dir, max_bytes=cache_max_bytes)
+    window = AtomViewWindow(
+        mesh_executor=mesh_executor,
+        disk_cache=disk_cache,
+        atlas=Atlas(args.atlas) if args.atlas is not None else None,
+        preview_num_pts=tuple(args.preview_num_pts),
+        lod_max_triangles=tuple(args.lod_max_triangles),
+        lod_target_fps=args.lod_target_fps,
+        prefetch_radius=args.prefetch_radius,
+        prefetch_max_bytes=int(args.prefetch_max_mb * 2**20))
     window.show()
 
     app.exec()
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     run()
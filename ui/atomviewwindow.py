@@ -4,7 +4,10 @@ from PyQt6 import QtCore
 from pyvistaqt import MainWindow
 
 from ui_atomviewwindow import Ui_AtomViewWindow
-from atomview.wavefunction_mesh import get_wavefunction_prob_contour_mesh, get_wavefunction_volume_mesh
+from atomview.atlas import get_mode_params
+from atomview.mesh_cache import MeshCache, get_mesh_nbytes
+from atomview.volume_render import add_phase_mag_volume, set_volume_opacity
+from atomview.wavefunction_mesh import ContourMeshPipeline, VolumeMeshPipeline, MeshPipelineCancelled, get_lod_meshes
 
 
 class VisMode(Enum):
@@ -13,11 +16,97 @@ class VisMode(Enum):
     VOLUME = 'volume'
 
 
+NUM_PTS = 100
+# Coarse meshes shown while the NUM_PTS mesh is generated. With 34 points the
+# preview grid is every third point of the full grid.
+PREVIEW_NUM_PTS = (34,)
+# Triangle budgets of the decimated contour meshes shown while the camera
+# moves.
+LOD_MAX_TRIANGLES = (200_000, 50_000)
+
+
+def get_mesh_key(vis_mode: VisMode, n: int, l: int, m: int,  # noqa
+                 contour_prob_threshold: float,
+                 real: bool, cutout: bool,
+                 mc_threshold_list: list[float], max_opacity: float,
+                 opacity_exp: float):
+    # Only the parameters that affect the mesh for vis_mode are included.
+    if vis_mode is VisMode.CONTOUR:
+        mode_params = (contour_prob_threshold, cutout)
+    elif vis_mode is VisMode.MULTI_CONTOUR:
+        mode_params = (tuple(mc_threshold_list),)
+    elif vis_mode is VisMode.VOLUME:
+        # Opacity is applied by the volume's transfer function.
+        mode_params = ()
+    else:
+        raise NotImplementedError
+    return (vis_mode, n, l, m, real, NUM_PTS) + mode_params
+
+
+def get_pipeline_params(vis_mode: VisMode, n: int, l: int, m: int,  # noqa
+                        contour_prob_threshold: float,
+                        real: bool, cutout: bool,
+                        mc_threshold_list: list[float]):
+    return get_mode_params(vis_mode.value, n, l, m, real=real,
+                           num_pts=NUM_PTS,
+                           contour_prob_threshold=contour_prob_threshold,
+                           cutout=cutout,
+                           mc_threshold_list=mc_threshold_list)
+
+
+def get_neighbour_states(n: int, l: int, m: int, radius: int,  # noqa
+                         max_n: int):
+    # Valid (n, l, m) states within radius steps of (n, l, m), nearest first.
+    # At equal distance m steps come before l steps before n steps since
+    # that is the order users usually step through the combo boxes.
+    states = []
+    for n2 in range(max(1, n - radius), min(max_n, n + radius) + 1):
+        for l2 in range(max(0, l - radius), min(n2 - 1, l + radius) + 1):
+            for m2 in range(max(-l2, m - radius), min(l2, m + radius) + 1):
+                distance = abs(n2 - n) + abs(l2 - l) + abs(m2 - m)
+                if 0 < distance <= radius:
+                    states.append((n2, l2, m2))
+    states.sort(key=lambda state: (
+        abs(state[0] - n) + abs(state[1] - l) + abs(state[2] - m),
+        abs(state[0] - n), abs(state[1] - l), abs(state[2] - m)))
+    return states
+
+
 class MeshWorker(QtCore.QObject):
-    mesh_ready_signal = QtCore.pyqtSignal(object, object)
+    mesh_ready_signal = QtCore.pyqtSignal(object, object, object, int)
+    preview_ready_signal = QtCore.pyqtSignal(object, object, int)
+    prefetch_ready_signal = QtCore.pyqtSignal(object, object, int)
+    mesh_error_signal = QtCore.pyqtSignal(object, int)
 
-    def __init__(self):
+    def __init__(self, disk_cache=None, preview_num_pts=PREVIEW_NUM_PTS):
         super().__init__()
+        # Set from the GUI thread when a request is queued. Queued requests
+        # that are no longer the latest are skipped and the running one is
+        # cancelled between pipeline stages.
+        self.latest_request_id = 0
+        # Likewise for prefetch jobs, which are stopped by new requests and
+        # when the prefetch cache is full.
+        self.latest_prefetch_id = 0
+        # One pipeline per mode so that e.g. a threshold or cutout change
+        # only recomputes the stages downstream of it.
+        self.pipelines = {
+            VisMode.CONTOUR: ContourMeshPipeline(),
+            VisMode.MULTI_CONTOUR: ContourMeshPipeline(),
+            VisMode.VOLUME: VolumeMeshPipeline(),
+        }
+        # Prefetching uses its own pipelines so that it does not replace the
+        # memoized stages of the state being viewed.
+        self.prefetch_pipelines = {
+            'contour': ContourMeshPipeline(),
+            'volume': VolumeMeshPipeline(),
+        }
+        for pipeline in (list(self.pipelines.values())
+                         + list(self.prefetch_pipelines.values())):
+            pipeline.disk_cache = disk_cache
+        # Preview pipelines per (vis_mode, num_pts), so each level keeps its
+        # memoized stages.
+        self.preview_num_pts = preview_num_pts
+        self.preview_pipelines = dict()
         self.thread = QtCore.QThread()
         self.moveToThread(self.thread)
         self.thread.start()
@@ -26,42 +115,237 @@ class MeshWorker(QtCore.QObject):
                           contour_prob_threshold: float,
                           real: bool, cutout: bool,
                           mc_threshold_list: list[float], max_opacity: float,
-                          opacity_exp: float):
-        if vis_mode is VisMode.CONTOUR:
-            mesh = get_wavefunction_prob_contour_mesh(
-                n, l, m,
-                prob_threshold_list=[contour_prob_threshold],
-                num_pts=100,
-                real=real,
-                clip=cutout)
-        elif vis_mode is VisMode.MULTI_CONTOUR:
-            mesh = get_wavefunction_prob_contour_mesh(
-                n, l, m,
-                prob_threshold_list=mc_threshold_list,
-                num_pts=100,
-                mag_maps_to='a',
-                real=real,
-                clip=False)
-        elif vis_mode is VisMode.VOLUME:
-            mesh = get_wavefunction_volume_mesh(n, l, m,
-                                                num_pts=100,
-                                                real=real,
-                                                max_opacity=max_opacity,
-                                                opacity_exp=opacity_exp)
+                          opacity_exp: float, request_id: int):
+        if request_id != self.latest_request_id:
+            return
+
+        _, params = get_pipeline_params(vis_mode, n, l, m,
+                                        contour_prob_threshold, real, cutout,
+                                        mc_threshold_list)
+        pipeline = self.pipelines[vis_mode]
+        pipeline.set_params(**params)
+        is_cancelled = lambda: request_id != self.latest_request_id  # noqa
+        pipeline.is_cancelled = is_cancelled
+        try:
+            # Show coarse meshes first unless the mesh is already available.
+            if not pipeline.has_stage_output(pipeline.mesh_stage):
+                for preview_num_pts in self.preview_num_pts:
+                    preview_pipeline = self.preview_pipelines.setdefault(
+                        (vis_mode, preview_num_pts), type(pipeline)())
+                    preview_pipeline.set_params(**params)
+                    preview_pipeline.set_params(num_pts=preview_num_pts)
+                    preview_pipeline.is_cancelled = is_cancelled
+                    self.preview_ready_signal.emit(
+                        preview_pipeline.get_mesh(), vis_mode, request_id)
+            mesh = pipeline.get_mesh()
+        except MeshPipelineCancelled:
+            return
+        except Exception as error:
+            self.mesh_error_signal.emit(error, request_id)
+            return
+
+        key = get_mesh_key(vis_mode, n, l, m, contour_prob_threshold, real,
+                           cutout, mc_threshold_list, max_opacity,
+                           opacity_exp)
+        self.mesh_ready_signal.emit(mesh, vis_mode, key, request_id)
+
+    def prefetch(self, jobs: list, prefetch_id: int):
+        # jobs is a list of (key, kind, params). Prefetching stops as soon as
+        # a new request is made, the request is then handled next.
+        for key, kind, params in jobs:
+            if prefetch_id != self.latest_prefetch_id:
+                return
+            pipeline = self.prefetch_pipelines[kind]
+            pipeline.set_params(**params)
+            pipeline.is_cancelled = (
+                lambda: prefetch_id != self.latest_prefetch_id)
+            try:
+                mesh = pipeline.get_mesh()
+            except MeshPipelineCancelled:
+                return
+            self.prefetch_ready_signal.emit(mesh, key, prefetch_id)
+
+    def stop(self):
+        self.latest_request_id = None
+        self.latest_prefetch_id = None
+        self.thread.quit()
+        self.thread.wait()
+
+
+class ExecutorMeshWorker(QtCore.QObject):
+    """
+    Mesh worker that submits requests to a mesh executor from
+    atomview.mesh_executor, e.g. a ProcessMeshExecutor, so that several
+    requests can be generated concurrently. Requests still waiting in the
+    executor are cancelled when a newer request arrives. Requests that are
+    already running finish and are cached by the window.
+
+    Prefetch jobs are submitted one at a time so that they occupy at most
+    one worker process.
+    """
+    mesh_ready_signal = QtCore.pyqtSignal(object, object, object, int)
+    preview_ready_signal = QtCore.pyqtSignal(object, object, int)
+    prefetch_ready_signal = QtCore.pyqtSignal(object, object, int)
+    prefetch_done_signal = QtCore.pyqtSignal(object, object, int)
+    mesh_error_signal = QtCore.pyqtSignal(object, int)
+
+    def __init__(self, mesh_executor, preview_num_pts=PREVIEW_NUM_PTS):
+        super().__init__()
+        self.mesh_executor = mesh_executor
+        self.preview_num_pts = preview_num_pts
+        self.latest_request_id = 0
+        self.latest_prefetch_id = 0
+        self.futures = dict()
+        self.prefetch_jobs = []
+        self.prefetch_future = None
+        self.prefetch_done_signal.connect(self.prefetch_done)
+
+    def gen_mesh_and_plot(self, vis_mode: VisMode, n: int, l: int, m: int,
+                          contour_prob_threshold: float,
+                          real: bool, cutout: bool,
+                          mc_threshold_list: list[float], max_opacity: float,
+                          opacity_exp: float, request_id: int):
+        for future in list(self.futures.values()):
+            future.cancel()
+        self.cancel_prefetch()
+
+        kind, params = get_pipeline_params(vis_mode, n, l, m,
+                                           contour_prob_threshold, real,
+                                           cutout, mc_threshold_list)
+        key = get_mesh_key(vis_mode, n, l, m, contour_prob_threshold, real,
+                           cutout, mc_threshold_list, max_opacity,
+                           opacity_exp)
+        # Previews are submitted first so that they are generated first, and
+        # skipped when the full mesh can be loaded rather than computed.
+        preview_num_pts_list = (
+            () if self.mesh_executor.has_cached_mesh(kind, params,
+                                                     vis_mode.value)
+            else self.preview_num_pts)
+        for preview_num_pts in preview_num_pts_list:
+            self.submit(kind, dict(params, num_pts=preview_num_pts),
+                        f'{vis_mode.value}_{preview_num_pts}', vis_mode, None,
+                        request_id)
+        self.submit(kind, params, vis_mode.value, vis_mode, key, request_id)
+
+    def submit(self, kind, params, pipeline_key, vis_mode, key, request_id):
+        # key is None for previews, which are not cached.
+        future = self.mesh_executor.submit(kind, params,
+                                           pipeline_key=pipeline_key)
+        self.futures[(request_id, pipeline_key)] = future
+        future.add_done_callback(
+            lambda done_future: self.future_done(
+                done_future, vis_mode, key, request_id, pipeline_key))
+
+    def future_done(self, future, vis_mode, key, request_id, pipeline_key):
+        # Called from an executor thread, the signal is queued to the GUI.
+        self.futures.pop((request_id, pipeline_key), None)
+        if future.cancelled() or self.latest_request_id is None:
+            return
+        if future.exception() is not None:
+            self.mesh_error_signal.emit(future.exception(), request_id)
+        elif key is None:
+            self.preview_ready_signal.emit(future.result(), vis_mode,
+                                           request_id)
         else:
-            raise NotImplementedError
+            self.mesh_ready_signal.emit(future.result(), vis_mode, key,
+                                        request_id)
+
+    def prefetch(self, jobs: list, prefetch_id: int):
+        self.cancel_prefetch()
+        self.prefetch_jobs = list(jobs)
+        self.submit_next_prefetch(prefetch_id)
+
+    def submit_next_prefetch(self, prefetch_id):
+        if not self.prefetch_jobs or prefetch_id != self.latest_prefetch_id:
+            return
+        key, kind, params = self.prefetch_jobs.pop(0)
+        future = self.mesh_executor.submit(kind, params,
+                                           pipeline_key=f'prefetch_{kind}')
+        self.prefetch_future = future
+        # The done callback may run in an executor thread, the signal queues
+        # the follow up to this object's thread.
+        future.add_done_callback(
+            lambda done_future: self.prefetch_done_signal.emit(
+                done_future, key, prefetch_id))
+
+    def prefetch_done(self, future, key, prefetch_id):
+        if future is self.prefetch_future:
+            self.prefetch_future = None
+        if (future.cancelled() or future.exception() is not None
+                or prefetch_id != self.latest_prefetch_id):
+            return
+        self.prefetch_ready_signal.emit(future.result(), key, prefetch_id)
+        self.submit_next_prefetch(prefetch_id)
+
+    def cancel_prefetch(self):
+        self.prefetch_jobs = []
+        if self.prefetch_future is not None:
+            self.prefetch_future.cancel()
+            self.prefetch_future = None
+
+    def stop(self):
+        self.latest_request_id = None
+        self.latest_prefetch_id = None
+        self.cancel_prefetch()
+        self.mesh_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LodWorker(QtCore.QObject):
+    """
+    Decimates contour meshes into levels of detail in a background thread,
+    see atomview.wavefunction_mesh.get_lod_meshes. Requests that are no
+    longer the latest when they are reached are skipped.
+    """
+    lod_ready_signal = QtCore.pyqtSignal(object, object, int)
+
+    def __init__(self, lod_max_triangles=LOD_MAX_TRIANGLES):
+        super().__init__()
+        self.lod_max_triangles = lod_max_triangles
+        self.latest_request_id = 0
+        self.thread = QtCore.QThread()
+        self.moveToThread(self.thread)
+        self.thread.start()
+
+    def gen_lod_meshes(self, mesh, key, request_id: int):
+        if request_id != self.latest_request_id:
+            return
+        self.lod_ready_signal.emit(
+            get_lod_meshes(mesh, self.lod_max_triangles), key, request_id)
 
-        self.mesh_ready_signal.emit(mesh, vis_mode)
+    def stop(self):
+        self.latest_request_id = None
+        self.thread.quit()
+        self.thread.wait()
 
 
 class AtomViewWindow(MainWindow):
     nlm_update_signal = QtCore.pyqtSignal()
     mesh_worker_signal = QtCore.pyqtSignal(object, int, int, int, float,
-                                           bool, bool, object, float, float)
-
-    def __init__(self):
+                                           bool, bool, object, float, float,
+                                           int)
+    prefetch_signal = QtCore.pyqtSignal(object, int)
+    lod_signal = QtCore.pyqtSignal(object, object, int)
+
+    def __init__(self, mesh_cache_max_bytes=512 * 2**20, mesh_executor=None,
+                 prefetch_radius=1, prefetch_max_bytes=256 * 2**20,
+                 disk_cache=None, atlas=None,
+                 preview_num_pts=PREVIEW_NUM_PTS,
+                 lod_max_triangles=LOD_MAX_TRIANGLES, lod_target_fps=30,
+                 lod_cache_max_bytes=128 * 2**20):
         super().__init__()
 
+        self.mesh_cache = MeshCache(max_bytes=mesh_cache_max_bytes)
+        # Prefetched meshes are kept apart so that they cannot evict meshes
+        # which have been viewed. They move to mesh_cache once viewed.
+        self.prefetch_radius = prefetch_radius
+        self.prefetch_cache = MeshCache(max_bytes=prefetch_max_bytes)
+        self.prefetch_nbytes = 0
+        # Generation of the queued prefetch jobs, kept apart from request_id
+        # so that stopping prefetching cannot drop interactive requests.
+        self.prefetch_id = 0
+        # Precomputed meshes, see atomview.atlas.
+        self.atlas = atlas
+
         self.ui = Ui_AtomViewWindow()
         self.ui.setupUi(self)
 
@@ -77,9 +361,32 @@ class AtomViewWindow(MainWindow):
         self.max_opacity = self.ui.max_opacity_doubleSpinBox.value()
         self.opacity_exp = self.ui.opacity_exp_doubleSpinBox.value()
         self.mc_threshold_list = self.get_multi_contour_list()
+        self.volume = None
+        self.request_id = 0
+        # Request whose full resolution mesh is shown, previews for it are
+        # then ignored.
+        self.plotted_request_id = 0
+
+        # Levels of detail of contour meshes, shown while the camera moves.
+        # lod_actors holds the actor of the full mesh followed by those of
+        # the levels, lod_level is the level shown while interacting. It is
+        # adapted to lod_target_fps after each interaction.
+        self.lod_max_triangles = tuple(lod_max_triangles)
+        self.lod_target_fps = lod_target_fps
+        self.lod_cache = MeshCache(max_bytes=lod_cache_max_bytes)
+        self.lod_key = None
+        self.lod_actors = []
+        self.lod_level = 1
 
         self.ui.plotter.camera.position = (10, 10, 10)
         self.ui.plotter.set_background('black')
+        # The interactor style invokes these when a camera drag or zoom
+        # starts and ends.
+        interactor_style = self.ui.plotter.iren.style
+        interactor_style.AddObserver('StartInteractionEvent',
+                                     self.start_interaction)
+        interactor_style.AddObserver('EndInteractionEvent',
+                                     self.end_interaction)
 
         self.ui.n_comboBox.activated.connect(self.update_n)
         self.ui.l_comboBox.activated.connect(self.update_l)
@@ -118,14 +425,29 @@ class AtomViewWindow(MainWindow):
             spinbox.editingFinished.connect(
                 self.multi_contour_prob_threshold_updated)
 
-        self.mesh_worker = MeshWorker()
+        # disk_cache is an atomview.disk_cache.DiskCache used by the thread
+        # worker. A mesh executor is given its cache directory directly.
+        if mesh_executor is None:
+            self.mesh_worker = MeshWorker(disk_cache=disk_cache,
+                                          preview_num_pts=preview_num_pts)
+        else:
+            self.mesh_worker = ExecutorMeshWorker(
+                mesh_executor, preview_num_pts=preview_num_pts)
         self.mesh_worker_signal.connect(self.mesh_worker.gen_mesh_and_plot)
-        self.mesh_worker.mesh_ready_signal.connect(self.plot_new_mesh)
+        self.mesh_worker.mesh_ready_signal.connect(self.mesh_ready)
+        self.mesh_worker.preview_ready_signal.connect(self.preview_ready)
+        self.mesh_worker.mesh_error_signal.connect(self.mesh_error)
+        self.prefetch_signal.connect(self.mesh_worker.prefetch)
+        self.mesh_worker.prefetch_ready_signal.connect(self.prefetch_ready)
+        self.lod_worker = LodWorker(self.lod_max_triangles)
+        self.lod_signal.connect(self.lod_worker.gen_lod_meshes)
+        self.lod_worker.lod_ready_signal.connect(self.lod_ready)
 
         self.request_new_mesh()
 
     def closeEvent(self, event):
-        self.mesh_worker.thread.terminate()
+        self.mesh_worker.stop()
+        self.lod_worker.stop()
         super().closeEvent(event)
 
     def mc_checkbox_0_toggled(self):
@@ -186,13 +508,19 @@ class AtomViewWindow(MainWindow):
         old_max_opacity = self.max_opacity
         self.max_opacity = self.ui.max_opacity_doubleSpinBox.value()
         if self.max_opacity != old_max_opacity:
-            self.request_new_mesh()
+            self.update_volume_opacity()
 
     def opacity_exp_updated(self):
         old_opacity_exp = self.opacity_exp
         self.opacity_exp = self.ui.opacity_exp_doubleSpinBox.value()
         if self.opacity_exp != old_opacity_exp:
-            self.request_new_mesh()
+            self.update_volume_opacity()
+
+    def update_volume_opacity(self):
+        if self.volume is not None:
+            set_volume_opacity(self.volume, self.max_opacity,
+                               self.opacity_exp)
+            self.ui.plotter.render()
 
     def update_vis_mode(self):
         if self.ui.contour_radioButton.isChecked():
@@ -207,19 +535,125 @@ class AtomViewWindow(MainWindow):
         self.request_new_mesh()
 
     def request_new_mesh(self):
+        key = get_mesh_key(self.vis_mode, self.n, self.l, self.m,
+                           self.contour_prob_threshold,
+                           self.real, self.cutout,
+                           self.mc_threshold_list, self.max_opacity,
+                           self.opacity_exp)
+        self.request_id += 1
+        self.mesh_worker.latest_request_id = self.request_id
+        self.lod_worker.latest_request_id = self.request_id
+        self.stop_prefetch()
+
+        mesh = self.mesh_cache.get(key)
+        if mesh is None:
+            mesh = self.prefetch_cache.pop(key)
+            if mesh is None and self.atlas is not None:
+                mesh = self.atlas.get(*get_pipeline_params(
+                    self.vis_mode, self.n, self.l, self.m,
+                    self.contour_prob_threshold, self.real, self.cutout,
+                    self.mc_threshold_list))
+            if mesh is not None:
+                self.mesh_cache.put(key, mesh)
+        if mesh is not None:
+            self.plot_new_mesh(mesh, self.vis_mode, key)
+            self.plotted_request_id = self.request_id
+            self.start_prefetch()
+            return
+
         self.mesh_worker_signal.emit(self.vis_mode, self.n, self.l, self.m,
                                      self.contour_prob_threshold,
                                      self.real, self.cutout,
                                      self.mc_threshold_list, self.max_opacity,
-                                     self.opacity_exp)
-
-    def plot_new_mesh(self, mesh, vis_mode):
+                                     self.opacity_exp, self.request_id)
+
+    def mesh_ready(self, mesh, vis_mode, key, request_id):
+        # Meshes that finished after a newer request was made are cached
+        # but not plotted.
+        self.mesh_cache.put(key, mesh)
+        if request_id == self.request_id:
+            self.plot_new_mesh(mesh, vis_mode, key)
+            self.plotted_request_id = request_id
+            self.start_prefetch()
+
+    def preview_ready(self, mesh, vis_mode, request_id):
+        if (request_id == self.request_id
+                and self.plotted_request_id != request_id):
+            self.plot_new_mesh(mesh, vis_mode)
+
+    def mesh_error(self, error, request_id):
+        # A preview or mesh failed to generate. Errors of earlier requests
+        # are ignored, their meshes are not shown anyway.
+        if request_id != self.request_id:
+            return
+        self.plotted_request_id = request_id
         self.ui.plotter.clear_actors()
+        self.volume = None
+        self.lod_key = None
+        self.lod_actors = []
+        self.ui.plotter.add_text(
+            f'Mesh generation failed:\n{error!r}',
+            font_size=12,
+            color='red',
+            position='lower_edge')
+
+    def start_prefetch(self):
+        # Queue meshes for the states neighbouring the current one, with
+        # the current display settings, which are not already cached.
+        if self.prefetch_radius <= 0 or self.prefetch_cache.max_bytes <= 0:
+            return
+        max_n = int(self.ui.n_comboBox.itemText(
+            self.ui.n_comboBox.count() - 1))
+        jobs = []
+        for n, l, m in get_neighbour_states(self.n, self.l, self.m,
+                                            self.prefetch_radius, max_n):
+            key = get_mesh_key(self.vis_mode, n, l, m,
+                               self.contour_prob_threshold,
+                               self.real, self.cutout,
+                               self.mc_threshold_list, self.max_opacity,
+                               self.opacity_exp)
+            if key in self.mesh_cache or key in self.prefetch_cache:
+                continue
+            kind, params = get_pipeline_params(self.vis_mode, n, l, m,
+                                               self.contour_prob_threshold,
+                                               self.real, self.cutout,
+                                               self.mc_threshold_list)
+            if self.atlas is not None and self.atlas.has_mesh(kind, params):
+                continue
+            jobs.append((key, kind, params))
+        self.prefetch_nbytes = 0
+        if jobs:
+            self.stop_prefetch()
+            self.prefetch_signal.emit(jobs, self.prefetch_id)
+
+    def stop_prefetch(self):
+        # Cancels the queued prefetch jobs, leaving mesh requests alone.
+        self.prefetch_id += 1
+        self.mesh_worker.latest_prefetch_id = self.prefetch_id
+
+    def prefetch_ready(self, mesh, key, prefetch_id):
+        if prefetch_id != self.prefetch_id or key in self.mesh_cache:
+            return
+        mesh_nbytes = get_mesh_nbytes(mesh)
+        if self.prefetch_nbytes + mesh_nbytes > self.prefetch_cache.max_bytes:
+            # Stop rather than evict the nearer states prefetched for this
+            # request.
+            self.stop_prefetch()
+            return
+        self.prefetch_nbytes += mesh_nbytes
+        self.prefetch_cache.put(key, mesh)
+
+    def plot_new_mesh(self, mesh, vis_mode, key=None):
+        # key is None for previews, which get no levels of detail.
+        self.ui.plotter.clear_actors()
+        self.volume = None
+        self.lod_key = None
+        self.lod_actors = []
         if vis_mode is VisMode.CONTOUR:
             try:
-                self.ui.plotter.add_mesh(
+                self.lod_actors.append(self.ui.plotter.add_mesh(
                     mesh, scalars='rgba', rgb=True,
-                    specular=0, diffuse=1, ambient=0.3)
+                    specular=0, diffuse=1, ambient=0.3))
             except ValueError:
                 self.ui.plotter.add_text(
                     'Empty mesh.\n'
@@ -230,9 +664,9 @@ class AtomViewWindow(MainWindow):
                     position='lower_edge')
         elif vis_mode is VisMode.MULTI_CONTOUR:
             try:
-                self.ui.plotter.add_mesh(
+                self.lod_actors.append(self.ui.plotter.add_mesh(
                     mesh, scalars='rgba', rgb=True,
-                    specular=0, diffuse=1, ambient=0.3)
+                    specular=0, diffuse=1, ambient=0.3))
             except ValueError:
                 self.ui.plotter.add_text(
                     'Empty mesh.\n'
@@ -242,10 +676,56 @@ class AtomViewWindow(MainWindow):
                     color='red',
                     position='lower_edge')
         elif vis_mode is VisMode.VOLUME:
-            self.ui.plotter.add_volume(mesh, scalars='rgba', mapper='gpu')
+            self.volume = add_phase_mag_volume(self.ui.plotter, mesh,
+                                               self.max_opacity,
+                                               self.opacity_exp)
         else:
             raise NotImplementedError
 
+        if (key is None or not self.lod_actors or not self.lod_max_triangles
+                or mesh.n_cells <= min(self.lod_max_triangles)):
+            return
+        self.lod_key = key
+        lod_meshes = self.lod_cache.get(key)
+        if lod_meshes is None:
+            self.lod_signal.emit(mesh, key, self.request_id)
+        else:
+            self.add_lod_meshes(lod_meshes)
+
+    def lod_ready(self, lod_meshes, key, request_id):
+        self.lod_cache.put(key, lod_meshes)
+        if key == self.lod_key and len(self.lod_actors) == 1:
+            self.add_lod_meshes(lod_meshes)
+
+    def add_lod_meshes(self, lod_meshes):
+        for lod_mesh in lod_meshes:
+            actor = self.ui.plotter.add_mesh(
+                lod_mesh, scalars='rgba', rgb=True,
+                specular=0, diffuse=1, ambient=0.3, reset_camera=False)
+            actor.SetVisibility(False)
+            self.lod_actors.append(actor)
+
+    def start_interaction(self, *args):
+        if len(self.lod_actors) > 1:
+            self.lod_level = min(self.lod_level, len(self.lod_actors) - 1)
+            self.lod_actors[0].SetVisibility(False)
+            self.lod_actors[self.lod_level].SetVisibility(True)
+
+    def end_interaction(self, *args):
+        if len(self.lod_actors) <= 1:
+            return
+        self.lod_actors[self.lod_level].SetVisibility(False)
+        self.lod_actors[0].SetVisibility(True)
+        # Use a coarser level next time if the last frame was too slow, or
+        # a finer one if it was well within the target.
+        frame_seconds = self.ui.plotter.renderer.GetLastRenderTimeInSeconds()
+        if (frame_seconds > 1 / self.lod_target_fps
+                and self.lod_level < len(self.lod_actors) - 1):
+            self.lod_level += 1
+        elif frame_seconds < 0.5 / self.lod_target_fps and self.lod_level > 1:
+            self.lod_level -= 1
+        self.ui.plotter.render()
+
     def update_real(self):
         self.real = self.ui.real_radioButton.isChecked()
         self.request_new_mesh()